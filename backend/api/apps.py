@@ -5,3 +5,7 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'API System'
+
+    def ready(self):
+        # Connects the quiz catalog invalidation and subject stats signals
+        from . import quiz_catalog, subject_stats  # noqa: F401
@@ -0,0 +1,318 @@
+"""
+Quiz and subject leaderboards as served to clients.
+
+Builds, caches and invalidates the rendered leaderboards behind the views in
+api.optimized_views, the WebSocket snapshots and the lifecycle scheduler.
+"""
+import json
+import logging
+from django.db.models import Q
+from caching import utils
+from caching.responses import render_json
+from caching.ranking import quiz_rank_engine
+from .models import Quiz, QuizSession, UserSubjectStats, Bidang
+from .quiz_catalog import active_bidangs, get_quiz_metadata, is_quiz_final
+
+logger = logging.getLogger(__name__)
+
+leaderboard_cache = utils.leaderboard_cache
+leaderboard_warmer = utils.leaderboard_warmer
+
+# Leaderboards are fresh for LEADERBOARD_CACHE_TIMEOUT seconds and may then be
+# served stale for LEADERBOARD_STALE_TIMEOUT more while one request refreshes them
+LEADERBOARD_CACHE_TIMEOUT = 180
+# Subjects without a running quiz only change when a quiz is edited, so their
+# leaderboards are kept longer
+LEADERBOARD_IDLE_CACHE_TIMEOUT = 3600
+LEADERBOARD_STALE_TIMEOUT = 60
+# Frozen leaderboards of ended quizzes never change, but still expire so
+# Redis can evict them; an expired one is simply frozen again
+FINAL_LEADERBOARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Other pages of a quiz leaderboard are cached per leaderboard version, so
+# they never need invalidating; pages of older versions simply age out
+QUIZ_LEADERBOARD_PAGE_CACHE_TIMEOUT = 600
+SUBJECT_LEADERBOARD_SIZE = 20
+QUIZ_LEADERBOARD_SIZE = 20
+
+SUBJECT_STATS_FIELDS = (
+    'user__id', 'user__username', 'bidang', 'total_score', 'quiz_count',
+    'average_score', 'total_duration', 'average_duration',
+)
+
+
+def build_subject_leaderboard(bidang):
+    """
+    Top 20 of a subject leaderboard from the per-subject aggregates.
+    """
+    results = (
+        UserSubjectStats.objects
+        .filter(bidang=bidang)
+        .values(*SUBJECT_STATS_FIELDS)
+        .order_by('-average_score', 'average_duration')[:SUBJECT_LEADERBOARD_SIZE]
+    )
+    
+    leaderboard_data = []
+    bidang_name = dict(Bidang.choices).get(bidang, bidang)
+    
+    for rank, row in enumerate(results, 1):
+        leaderboard_data.append({
+            'rank': rank,
+            'user_id': row['user__id'],
+            'username': row['user__username'],
+            'bidang': row['bidang'],
+            'bidang_name': bidang_name,
+            'total_score': row['total_score'],
+            'quiz_count': row['quiz_count'],
+            'average_score': round(row['average_score'], 2) if row['average_score'] else 0,
+            'total_duration': row['total_duration'],
+            'average_duration': round(row['average_duration'], 2) if row['average_duration'] else 0
+        })
+    
+    logger.info(f"Computed subject leaderboard for {bidang}")
+    return {
+        'bidang': bidang,
+        'bidang_name': bidang_name,
+        'total_participants': len(leaderboard_data),
+        'leaderboard': leaderboard_data
+    }
+
+
+@leaderboard_warmer.register('subject_leaderboard')
+def subject_leaderboard_spec(bidang):
+    active = bidang in active_bidangs()
+    return {
+        'key': utils.generate_leaderboard_cache_key(bidang),
+        'callable_func': lambda: render_json(build_subject_leaderboard(bidang)),
+        'timeout': LEADERBOARD_CACHE_TIMEOUT if active else LEADERBOARD_IDLE_CACHE_TIMEOUT,
+        'stale_timeout': LEADERBOARD_STALE_TIMEOUT,
+        'stale_key': utils.generate_leaderboard_cache_key(bidang, versioned=False),
+    }
+
+
+def get_subject_leaderboard(bidang):
+    """
+    Cached rendered subject leaderboard, recomputed by one caller at a time
+    and refreshed ahead of expiry by the warm_leaderboards command.
+
+    Returns:
+        Dict with the JSON 'body' and its 'etag'
+    """
+    return leaderboard_warmer.get('subject_leaderboard', bidang)
+
+
+def invalidate_subject_leaderboard_if_changed(bidang, user_ids):
+    """
+    Invalidate a cached subject leaderboard only if new stats of these users
+    can change it.
+
+    That is the case when one of them is already on the board, the board is
+    not full yet, or one of them now ranks at or above its last row (the
+    cut-off). Averages on the board are rounded, so ties count as changes.
+
+    Args:
+        bidang: Subject code
+        user_ids: Users whose stats in the subject were just updated
+
+    Returns:
+        True if the leaderboard was invalidated
+    """
+    rendered = leaderboard_cache.peek(utils.generate_leaderboard_cache_key(bidang))
+    if rendered is None:
+        # Nothing current is cached; the next reader computes it anyway
+        return False
+
+    board = json.loads(rendered['body'])['leaderboard']
+    changed = len(board) < SUBJECT_LEADERBOARD_SIZE or any(row['user_id'] in user_ids for row in board)
+    if not changed:
+        cutoff = (board[-1]['average_score'], -board[-1]['average_duration'])
+        stats = (
+            UserSubjectStats.objects
+            .filter(bidang=bidang, user_id__in=user_ids)
+            .values_list('average_score', 'average_duration')
+        )
+        changed = any(
+            (round(average_score or 0, 2), -round(average_duration or 0, 2)) >= cutoff
+            for average_score, average_duration in stats
+        )
+
+    if changed:
+        utils.invalidate_leaderboard_caches(bidang)
+    return changed
+
+
+def get_quiz_leaderboard_page(quiz_id, offset, limit):
+    """
+    Get a rank range of a quiz leaderboard and the number of participants.
+
+    Sessions with the same score and duration share a rank. Served from the
+    rank engine; falls back to the database when Redis is unavailable.
+    """
+    page = quiz_rank_engine.page(quiz_id, offset, limit)
+    if page is None:
+        page = get_database_leaderboard_page(quiz_id, offset, limit)
+    return page
+
+
+def get_database_leaderboard_page(quiz_id, offset, limit):
+    """
+    Get a range of a quiz leaderboard from the database.
+
+    Sessions with the same score and duration share a rank and are ordered
+    by ID, so every session has a stable position (see
+    get_database_session_position).
+
+    Returns:
+        (ranked rows in leaderboard order, total_participants)
+    """
+    qs = QuizSession.objects.filter(quiz_id=quiz_id)
+    results = qs.select_related('user').order_by('-score', 'duration', 'id')[offset:offset + limit]
+
+    leaderboard_data = []
+    previous = None
+    for position, session in enumerate(results, offset + 1):
+        if previous is None:
+            rank = qs.filter(
+                Q(score__gt=session.score) | Q(score=session.score, duration__lt=session.duration)
+            ).count() + 1
+        elif (session.score, session.duration) != (previous.score, previous.duration):
+            rank = position
+        leaderboard_data.append({'rank': rank, **quiz_rank_engine.session_entry(session)})
+        previous = session
+    return leaderboard_data, qs.count()
+
+
+def get_database_session_position(quiz_id, session):
+    """
+    Zero-based position of a session in get_database_leaderboard_page order.
+    """
+    return QuizSession.objects.filter(
+        Q(score__gt=session.score)
+        | Q(score=session.score, duration__lt=session.duration)
+        | Q(score=session.score, duration=session.duration, id__lt=session.id),
+        quiz_id=quiz_id,
+    ).count()
+
+
+def build_quiz_leaderboard(quiz_id, offset, limit):
+    """
+    Quiz leaderboard response for a rank range.
+
+    Raises Quiz.DoesNotExist for unknown quizzes.
+    """
+    quiz = get_quiz_metadata(quiz_id)
+    if quiz is None:
+        raise Quiz.DoesNotExist(f"Quiz {quiz_id} does not exist")
+    leaderboard_data, total_participants = get_quiz_leaderboard_page(quiz_id, offset, limit)
+    
+    return {
+        'quiz_id': quiz['id'],
+        'quiz_title': quiz['title'],
+        'total_participants': total_participants,
+        'offset': offset,
+        'limit': limit,
+        'leaderboard': leaderboard_data
+    }
+
+
+def get_quiz_leaderboard_range(quiz_id, offset, limit):
+    """
+    Rendered rank range of a quiz leaderboard, cached per leaderboard version.
+
+    Every new session and every edit of the quiz moves the version on, so
+    like the top page, a page carries the version it was built at and its
+    ETag is derived from it.
+
+    Raises Quiz.DoesNotExist for unknown quizzes.
+
+    Returns:
+        Dict with the JSON 'body' and its 'etag'
+    """
+    version = quiz_rank_engine.version(quiz_id)
+    if version is None:
+        return render_json(build_quiz_leaderboard(quiz_id, offset, limit))
+
+    def build():
+        body = render_json({**build_quiz_leaderboard(quiz_id, offset, limit), 'version': version})['body']
+        return {'body': body, 'etag': f'"quiz-{quiz_id}-{version}-{offset}-{limit}"'}
+
+    return leaderboard_cache.get_or_set(
+        utils.generate_quiz_leaderboard_page_cache_key(quiz_id, version, offset, limit),
+        build,
+        QUIZ_LEADERBOARD_PAGE_CACHE_TIMEOUT,
+    )
+
+
+def get_quiz_leaderboard_top(quiz_id):
+    """
+    Rendered top page of a quiz leaderboard.
+
+    The page is kept by the rank engine, which patches it whenever a session
+    is added, so it is only built from scratch after it was dropped. It
+    carries the leaderboard version, which is also its ETag, so clients can
+    apply the diffs pushed over WebSocket on top of it.
+
+    Raises Quiz.DoesNotExist for unknown quizzes.
+
+    Returns:
+        Dict with the JSON 'body' and its 'etag'
+    """
+    document = quiz_rank_engine.top_document(quiz_id)
+    if document is None:
+        version = quiz_rank_engine.version(quiz_id)
+        rendered = render_json({
+            **build_quiz_leaderboard(quiz_id, 0, QUIZ_LEADERBOARD_SIZE),
+            'version': version,
+        })
+        if version is None:
+            return rendered
+        quiz_rank_engine.store_top_document(quiz_id, rendered['body'], version)
+        document = rendered['body'], version
+
+    body, version = document
+    return {'body': body, 'etag': f'"quiz-{quiz_id}-{version}"'}
+
+
+def freeze_quiz_leaderboard(quiz_id):
+    """
+    Store the final top page of an ended quiz for a week.
+
+    Nothing can be submitted to an ended quiz, so the snapshot is only
+    dropped early if the quiz itself is edited.
+
+    Returns:
+        Dict with the JSON 'body' and its 'etag'
+    """
+    rendered = get_quiz_leaderboard_top(quiz_id)
+    leaderboard_cache.set(
+        utils.generate_final_quiz_leaderboard_cache_key(quiz_id), rendered, FINAL_LEADERBOARD_CACHE_TIMEOUT
+    )
+    logger.info(f"Froze leaderboard for quiz: {quiz_id}")
+    return rendered
+
+
+def get_final_quiz_leaderboard(quiz_id):
+    """
+    Frozen top page of an ended quiz, frozen now if the scheduler has not yet.
+    """
+    rendered = leaderboard_cache.get(utils.generate_final_quiz_leaderboard_cache_key(quiz_id))
+    if rendered is None:
+        rendered = freeze_quiz_leaderboard(quiz_id)
+    return rendered
+
+
+def get_quiz_leaderboard_snapshot(quiz_id):
+    """
+    Rendered top page of a quiz leaderboard as clients should see it now:
+    the frozen final page once the quiz has ended, the live page otherwise.
+
+    Raises Quiz.DoesNotExist for unknown quizzes.
+
+    Returns:
+        Dict with the JSON 'body' and its 'etag'
+    """
+    quiz = get_quiz_metadata(quiz_id)
+    if quiz is None:
+        raise Quiz.DoesNotExist
+    if is_quiz_final(quiz):
+        return get_final_quiz_leaderboard(quiz_id)
+    return get_quiz_leaderboard_top(quiz_id)
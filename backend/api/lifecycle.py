@@ -0,0 +1,72 @@
+"""
+Quiz lifecycle scheduling.
+
+``manage.py run_quiz_lifecycle`` calls run_lifecycle_cycle periodically to
+warm the caches of quizzes that are about to start, so the first wave of
+requests does not find them cold, and to freeze the leaderboards of quizzes
+that have ended, so they are never recomputed again.
+"""
+import logging
+from datetime import timedelta
+from django.utils import timezone
+from caching import utils
+from .models import Quiz
+from .leaderboards import freeze_quiz_leaderboard, get_quiz_leaderboard_top, get_subject_leaderboard
+from .quiz_catalog import QUIZ_FREEZE_GRACE, get_quiz_metadata, get_quiz_schedule
+
+logger = logging.getLogger(__name__)
+
+
+def prewarm_quiz(quiz_id: int):
+    """
+    Load the metadata, rank set and leaderboards of a quiz into the caches.
+    """
+    quiz = get_quiz_metadata(quiz_id)
+    if quiz is None:
+        return
+    get_quiz_schedule()
+    get_quiz_leaderboard_top(quiz_id)
+    get_subject_leaderboard(quiz['bidang'])
+    logger.info(f"Pre-warmed caches for quiz: {quiz_id}")
+
+
+def run_lifecycle_cycle(prewarm_lead: int, lookback: int, prewarmed: set) -> dict:
+    """
+    Pre-warm quizzes starting within `prewarm_lead` seconds and freeze the
+    leaderboards of quizzes that ended within the last `lookback` seconds.
+
+    Quizzes that ended earlier are frozen by their first leaderboard request.
+
+    Args:
+        prewarm_lead: Seconds before start_date to pre-warm a quiz
+        lookback: Seconds after end_date a quiz is still frozen by the scheduler
+        prewarmed: IDs of quizzes already pre-warmed by this process; updated
+
+    Returns:
+        Dict with the pre-warmed and frozen quiz IDs
+    """
+    now = timezone.now()
+    report = {'prewarmed': [], 'frozen': []}
+
+    starting = Quiz.objects.filter(
+        start_date__gt=now, start_date__lte=now + timedelta(seconds=prewarm_lead)
+    ).values_list('id', flat=True)
+    for quiz_id in starting:
+        if quiz_id in prewarmed:
+            continue
+        prewarm_quiz(quiz_id)
+        prewarmed.add(quiz_id)
+        report['prewarmed'].append(quiz_id)
+
+    ended = Quiz.objects.filter(
+        end_date__lte=now - timedelta(seconds=QUIZ_FREEZE_GRACE),
+        end_date__gt=now - timedelta(seconds=lookback),
+    ).values_list('id', flat=True)
+    for quiz_id in ended:
+        prewarmed.discard(quiz_id)
+        if utils.leaderboard_cache.get(utils.generate_final_quiz_leaderboard_cache_key(quiz_id)) is not None:
+            continue
+        freeze_quiz_leaderboard(quiz_id)
+        report['frozen'].append(quiz_id)
+
+    return report
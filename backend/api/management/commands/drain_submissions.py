@@ -0,0 +1,82 @@
+import os
+import socket
+import time
+from django.core.management.base import BaseCommand
+from api.post_commit import post_commit_executor
+from api.submission_queue import submission_queue
+from api.submissions import MAX_BATCH_SIZE
+from websocket.utils import websocket_notifier
+
+
+class Command(BaseCommand):
+    help = 'Insert queued quiz session submissions in batches (run several for more throughput)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            default=f'{socket.gethostname()}-{os.getpid()}',
+            help='Consumer name within the group; must be unique per running worker (default: host-pid)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help=f'Maximum submissions inserted per batch, up to {MAX_BATCH_SIZE} (default: 500)'
+        )
+        parser.add_argument(
+            '--block',
+            type=int,
+            default=5000,
+            help='Milliseconds to wait for new submissions before polling again (default: 5000)'
+        )
+        parser.add_argument(
+            '--claim-idle',
+            type=int,
+            default=60000,
+            help='Milliseconds after which submissions held by a stalled worker are taken over (default: 60000)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for new submissions'
+        )
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        batch_size = min(options['batch_size'], MAX_BATCH_SIZE)
+        block_ms = None if options['once'] else options['block']
+
+        submission_queue.ensure_group()
+        self.stdout.write(f'Draining quiz session submissions as {consumer}...')
+
+        try:
+            while True:
+                try:
+                    messages, redelivered = submission_queue.read(
+                        consumer, batch_size, block_ms, options['claim_idle']
+                    )
+                    if not messages:
+                        if options['once']:
+                            break
+                        continue
+
+                    counts = submission_queue.process(messages, redelivered)
+                except Exception as e:
+                    # Unacknowledged submissions stay pending and are claimed again
+                    self.stderr.write(self.style.ERROR(f'Failed to drain batch: {e}'))
+                    if options['once']:
+                        raise
+                    time.sleep(1)
+                    continue
+
+                self.stdout.write(
+                    f'Processed {len(messages)} submissions: '
+                    f'{counts["created"]} created, {counts["rejected"]} rejected'
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            post_commit_executor.wait()
+            websocket_notifier.flush()
+
+        self.stdout.write(self.style.SUCCESS('Stopped draining quiz session submissions'))
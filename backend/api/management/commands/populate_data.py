@@ -1,5 +1,6 @@
 import random
 from datetime import timedelta
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.db import transaction
@@ -57,6 +58,7 @@ class Command(BaseCommand):
             return
             
         self.create_quiz_sessions(users, num_sessions)
+        call_command('rebuild_subject_stats', stdout=self.stdout)
         
         self.stdout.write(
             self.style.SUCCESS(
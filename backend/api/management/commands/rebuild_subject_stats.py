@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum, Count
+from api.models import QuizSession, UserSubjectStats, Bidang
+from caching.utils import invalidate_leaderboard_caches
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user per-subject aggregates from existing quiz sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bidang',
+            choices=Bidang.values,
+            help='Only rebuild aggregates for this subject (default: all subjects)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of aggregate rows inserted per query (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        bidang = options['bidang']
+        batch_size = options['batch_size']
+
+        sessions = QuizSession.objects.all()
+        stats = UserSubjectStats.objects.all()
+        if bidang:
+            sessions = sessions.filter(bidang=bidang)
+            stats = stats.filter(bidang=bidang)
+
+        self.stdout.write(f'Rebuilding subject stats for {bidang or "all subjects"}...')
+
+        aggregated = (
+            sessions
+            .values('user_id', 'bidang')
+            .annotate(
+                total_score=Sum('score'),
+                quiz_count=Count('id'),
+                total_duration=Sum('duration'),
+            )
+            .order_by()
+        )
+
+        with transaction.atomic():
+            # Sessions inserted between the aggregate and the swap would be
+            # counted by neither, so hold inserts off until the swap commits.
+            # Their aggregates are updated on top of the rebuilt rows.
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {QuizSession._meta.db_table} IN SHARE MODE')
+
+            rows = [
+                UserSubjectStats(
+                    user_id=item['user_id'],
+                    bidang=item['bidang'],
+                    total_score=item['total_score'],
+                    quiz_count=item['quiz_count'],
+                    total_duration=item['total_duration'],
+                    average_score=item['total_score'] / item['quiz_count'],
+                    average_duration=item['total_duration'] / item['quiz_count'],
+                )
+                for item in aggregated.iterator()
+            ]
+            deleted, _ = stats.delete()
+            UserSubjectStats.objects.bulk_create(rows, batch_size=batch_size)
+
+        invalidate_leaderboard_caches(bidang)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Replaced {deleted} rows with {len(rows)} subject stats rows')
+        )
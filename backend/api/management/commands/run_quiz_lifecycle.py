@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand
+from api.lifecycle import run_lifecycle_cycle
+
+
+class Command(BaseCommand):
+    help = 'Pre-warm caches before quizzes start and freeze their leaderboards after they end'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=10,
+            help='Seconds between checks (default: 10)'
+        )
+        parser.add_argument(
+            '--prewarm-lead',
+            type=int,
+            default=300,
+            help='Pre-warm quizzes starting within this many seconds (default: 300)'
+        )
+        parser.add_argument(
+            '--lookback',
+            type=int,
+            default=60 * 60 * 24,
+            help='Freeze quizzes that ended within this many seconds (default: 86400)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single check and exit'
+        )
+
+    def handle(self, *args, **options):
+        prewarmed = set()
+        self.stdout.write('Running quiz lifecycle scheduler...')
+
+        try:
+            while True:
+                try:
+                    report = run_lifecycle_cycle(options['prewarm_lead'], options['lookback'], prewarmed)
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f'Lifecycle check failed: {e}'))
+                    if options['once']:
+                        raise
+                else:
+                    for quiz_id in report['prewarmed']:
+                        self.stdout.write(f'Pre-warmed quiz {quiz_id}')
+                    for quiz_id in report['frozen']:
+                        self.stdout.write(f'Froze leaderboard of quiz {quiz_id}')
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('Stopped quiz lifecycle scheduler'))
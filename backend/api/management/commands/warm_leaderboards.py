@@ -0,0 +1,76 @@
+import time
+from django.core.management.base import BaseCommand
+from api.leaderboards import LEADERBOARD_CACHE_TIMEOUT, leaderboard_warmer
+
+
+class Command(BaseCommand):
+    help = 'Recompute recently requested leaderboards shortly before their cache entries expire'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds between refresh cycles (default: 5)'
+        )
+        parser.add_argument(
+            '--lead-time',
+            type=float,
+            default=30,
+            help='Refresh entries that go stale within this many seconds (default: 30)'
+        )
+        parser.add_argument(
+            '--window',
+            type=int,
+            default=2 * LEADERBOARD_CACHE_TIMEOUT,
+            help=f'Only keep warm what was requested in the last N seconds (default: {2 * LEADERBOARD_CACHE_TIMEOUT})'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Leaderboards recomputed at the same time (default: 4)'
+        )
+        parser.add_argument(
+            '--budget',
+            type=float,
+            default=2,
+            help='Seconds of recomputation allowed per cycle; the rest is skipped until the next one (default: 2)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single cycle and exit'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Warming leaderboards ahead of expiry...')
+
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    report = leaderboard_warmer.run_cycle(
+                        window=options['window'],
+                        lead_time=options['lead_time'],
+                        budget=options['budget'],
+                        concurrency=max(options['concurrency'], 1),
+                    )
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f'Refresh cycle failed: {e}'))
+                    if options['once']:
+                        raise
+                else:
+                    if report['due'] or options['once']:
+                        self.stdout.write(
+                            f'{report["due"]} due: {report["refreshed"]} refreshed, '
+                            f'{report["skipped"]} skipped, {report["failed"]} failed in {report["spent"]}s; '
+                            f'lag max {report["max_lag"]}s, mean {report["mean_lag"]}s'
+                        )
+                if options['once']:
+                    break
+                time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('Stopped warming leaderboards'))
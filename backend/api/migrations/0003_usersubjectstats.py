@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_quizsession_unique_together'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSubjectStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bidang', models.CharField(choices=[('AST', 'Astronomi'), ('BIO', 'Biologi'), ('EKO', 'Ekonomi'), ('FIS', 'Fisika'), ('GEO', 'Geografi'), ('INF', 'Informatika'), ('KBM', 'Kebumian'), ('KIM', 'Kimia'), ('MAT', 'Matematika')], max_length=3)),
+                ('total_score', models.IntegerField(default=0)),
+                ('quiz_count', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0, help_text='duration in seconds')),
+                ('average_score', models.FloatField(default=0)),
+                ('average_duration', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subject_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bidang', '-average_score', 'average_duration'], name='api_subjstats_rank_idx')],
+                'unique_together': {('user', 'bidang')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_bidang(apps, schema_editor):
+    Quiz = apps.get_model('api', 'Quiz')
+    QuizSession = apps.get_model('api', 'QuizSession')
+    quiz_bidang = Quiz.objects.filter(id=models.OuterRef('quiz_id')).values('bidang')[:1]
+    QuizSession.objects.update(bidang=models.Subquery(quiz_bidang))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_usersubjectstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizsession',
+            name='bidang',
+            field=models.CharField(choices=[('AST', 'Astronomi'), ('BIO', 'Biologi'), ('EKO', 'Ekonomi'), ('FIS', 'Fisika'), ('GEO', 'Geografi'), ('INF', 'Informatika'), ('KBM', 'Kebumian'), ('KIM', 'Kimia'), ('MAT', 'Matematika')], default='', editable=False, help_text='copied from quiz', max_length=3),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_bidang, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='quizsession',
+            index=models.Index(fields=['quiz', '-score', 'duration'], include=('id',), name='api_qs_quiz_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsession',
+            index=models.Index(fields=['bidang', 'user'], include=('score', 'duration', 'id'), name='api_qs_bidang_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsession',
+            index=models.Index(fields=['-user_end'], name='api_qs_user_end_idx'),
+        ),
+    ]
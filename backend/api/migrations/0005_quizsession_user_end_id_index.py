@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_quizsession_bidang_and_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='quizsession',
+            name='api_qs_user_end_idx',
+        ),
+        migrations.AddIndex(
+            model_name='quizsession',
+            index=models.Index(fields=['-user_end', '-id'], name='api_qs_user_end_id_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -25,19 +27,248 @@ class Quiz(models.Model):
         now = timezone.now()
         return self.start_date <= now <= self.end_date
 
+class QuizSessionQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Populate the denormalized bidang before inserting"""
+        objs = list(objs)
+        missing_quiz_ids = set()
+        for obj in objs:
+            if obj.bidang:
+                continue
+            if QuizSession.quiz.is_cached(obj):
+                obj.bidang = obj.quiz.bidang
+            else:
+                missing_quiz_ids.add(obj.quiz_id)
+
+        if missing_quiz_ids:
+            bidang_by_quiz = dict(
+                Quiz.objects.filter(id__in=missing_quiz_ids).values_list('id', 'bidang')
+            )
+            for obj in objs:
+                if not obj.bidang:
+                    obj.bidang = bidang_by_quiz.get(obj.quiz_id, '')
+
+        return super().bulk_create(objs, *args, **kwargs)
+
 class QuizSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_sessions')
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='sessions')
+    bidang = models.CharField(max_length=3, choices=Bidang.choices, editable=False, help_text="copied from quiz")
     score = models.IntegerField()
     duration = models.IntegerField(help_text="duration in seconds")
     user_start = models.DateTimeField()
     user_end = models.DateTimeField()
 
+    objects = QuizSessionQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'quiz')
+        indexes = [
+            models.Index(
+                fields=['quiz', '-score', 'duration'],
+                name='api_qs_quiz_rank_idx',
+                include=['id'],
+            ),
+            models.Index(
+                fields=['bidang', 'user'],
+                name='api_qs_bidang_user_idx',
+                include=['score', 'duration', 'id'],
+            ),
+            models.Index(fields=['-user_end', '-id'], name='api_qs_user_end_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.user_start and self.user_end:
             time_diff = self.user_end - self.user_start
             self.duration = int(time_diff.total_seconds())
-        super().save(*args, **kwargs)
+
+        if not self.bidang and self.quiz_id:
+            self.bidang = self.quiz.bidang
+
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                UserSubjectStats.record_sessions([self])
+
+class UserSubjectStats(models.Model):
+    """
+    Per-user per-subject aggregates, kept in sync with every QuizSession insert
+    so the subject leaderboard is an indexed read instead of a GROUP BY.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subject_stats')
+    bidang = models.CharField(max_length=3, choices=Bidang.choices)
+    total_score = models.IntegerField(default=0)
+    quiz_count = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0, help_text="duration in seconds")
+    average_score = models.FloatField(default=0)
+    average_duration = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'bidang')
+        indexes = [
+            models.Index(
+                fields=['bidang', '-average_score', 'average_duration'],
+                name='api_subjstats_rank_idx',
+            ),
+        ]
+
+    @classmethod
+    def record_sessions(cls, sessions):
+        """
+        Add newly inserted quiz sessions to the aggregates.
+
+        Must run in the same transaction as the inserts.
+        """
+        deltas = {}
+        for session in sessions:
+            key = (session.user_id, session.bidang)
+            total_score, quiz_count, total_duration = deltas.get(key, (0, 0, 0))
+            deltas[key] = (total_score + session.score, quiz_count + 1, total_duration + session.duration)
+
+        if len(deltas) > 1:
+            cls._apply_deltas(sorted(deltas.items()))
+            return
+
+        for (user_id, bidang), (total_score, quiz_count, total_duration) in deltas.items():
+            updated = cls._apply_delta(user_id, bidang, total_score, quiz_count, total_duration)
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        user_id=user_id,
+                        bidang=bidang,
+                        total_score=total_score,
+                        quiz_count=quiz_count,
+                        total_duration=total_duration,
+                        average_score=total_score / quiz_count,
+                        average_duration=total_duration / quiz_count,
+                    )
+            except IntegrityError:
+                # Another transaction created the row first
+                cls._apply_delta(user_id, bidang, total_score, quiz_count, total_duration)
+
+    @classmethod
+    def rebuild(cls, keys, chunk_size=500):
+        """
+        Recompute the aggregates of (user_id, bidang) pairs from their sessions.
+
+        Used when sessions move to another subject or are deleted. Rows are
+        updated in place so concurrent record_sessions() calls still apply;
+        pairs without sessions lose their row.
+        """
+        keys = sorted(set(keys))
+        with transaction.atomic():
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                match = Q()
+                for user_id, bidang in chunk:
+                    match |= Q(user_id=user_id, bidang=bidang)
+                list(
+                    cls.objects.filter(match)
+                    .order_by('user_id', 'bidang')
+                    .select_for_update()
+                    .values_list('id', flat=True)
+                )
+
+                aggregated = (
+                    QuizSession.objects.filter(match)
+                    .values('user_id', 'bidang')
+                    .annotate(total_score=Sum('score'), quiz_count=Count('id'), total_duration=Sum('duration'))
+                    .order_by()
+                )
+                rows = [
+                    cls(
+                        user_id=item['user_id'],
+                        bidang=item['bidang'],
+                        total_score=item['total_score'],
+                        quiz_count=item['quiz_count'],
+                        total_duration=item['total_duration'],
+                        average_score=item['total_score'] / item['quiz_count'],
+                        average_duration=item['total_duration'] / item['quiz_count'],
+                    )
+                    for item in aggregated
+                ]
+                cls.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=['user', 'bidang'],
+                    update_fields=[
+                        'total_score', 'quiz_count', 'total_duration', 'average_score', 'average_duration',
+                    ],
+                )
+
+                remaining = {(row.user_id, row.bidang) for row in rows}
+                empty = Q()
+                for user_id, bidang in chunk:
+                    if (user_id, bidang) not in remaining:
+                        empty |= Q(user_id=user_id, bidang=bidang)
+                if empty:
+                    cls.objects.filter(empty).delete()
+
+    @classmethod
+    def _apply_deltas(cls, items, chunk_size=500):
+        """
+        Apply many (user, bidang) deltas with a fixed number of queries per chunk.
+
+        Missing rows are inserted empty first, then every row in the chunk is
+        locked in key order and updated by a single CASE expression.
+        """
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, bidang=bidang) for (user_id, bidang), _ in chunk],
+                ignore_conflicts=True,
+            )
+
+            match = Q()
+            for (user_id, bidang), _ in chunk:
+                match |= Q(user_id=user_id, bidang=bidang)
+            list(
+                cls.objects.filter(match)
+                .order_by('user_id', 'bidang')
+                .select_for_update()
+                .values_list('id', flat=True)
+            )
+
+            def delta(position):
+                return Case(
+                    *[
+                        When(user_id=user_id, bidang=bidang, then=Value(values[position]))
+                        for (user_id, bidang), values in chunk
+                    ],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+
+            total_score, quiz_count, total_duration = delta(0), delta(1), delta(2)
+            cls.objects.filter(match).update(
+                total_score=F('total_score') + total_score,
+                quiz_count=F('quiz_count') + quiz_count,
+                total_duration=F('total_duration') + total_duration,
+                average_score=(
+                    Cast(F('total_score') + total_score, FloatField())
+                    / (F('quiz_count') + quiz_count)
+                ),
+                average_duration=(
+                    Cast(F('total_duration') + total_duration, FloatField())
+                    / (F('quiz_count') + quiz_count)
+                ),
+            )
+
+    @classmethod
+    def _apply_delta(cls, user_id, bidang, total_score, quiz_count, total_duration):
+        return cls.objects.filter(user_id=user_id, bidang=bidang).update(
+            total_score=F('total_score') + total_score,
+            quiz_count=F('quiz_count') + quiz_count,
+            total_duration=F('total_duration') + total_duration,
+            average_score=(
+                Cast(F('total_score') + total_score, FloatField())
+                / (F('quiz_count') + quiz_count)
+            ),
+            average_duration=(
+                Cast(F('total_duration') + total_duration, FloatField())
+                / (F('quiz_count') + quiz_count)
+            ),
+        )
@@ -1,219 +1,136 @@
+import json
 import logging
+import os
 from concurrent.futures import ThreadPoolExecutor
-from django.db.models import Count, Sum, Avg
 from django.core.cache import caches
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from caching import utils
+from caching.core import cache_stats
+from caching.responses import (
+    make_etag, not_modified_response, render_json, etag_matches, rendered_response,
+)
+from caching.ranking import quiz_rank_engine
+from websocket.outbox import outbox_stats
 
+from .leaderboards import (
+    QUIZ_LEADERBOARD_SIZE, get_database_leaderboard_page, get_database_session_position,
+    get_quiz_leaderboard_range, get_quiz_leaderboard_snapshot, get_subject_leaderboard,
+)
 from .models import Quiz, QuizSession, Bidang
+from .quiz_catalog import get_quiz_metadata
 
 logger = logging.getLogger(__name__)
 
-leaderboard_cache = caches['leaderboards']
 user_stats_cache = caches['user_stats']
 
+MAX_QUIZ_LEADERBOARD_PAGE_SIZE = 100
+DEFAULT_AROUND_ME_RADIUS = 5
+MAX_AROUND_ME_RADIUS = 50
+MAX_BULK_RANK_USERS = 200
+
 
 @api_view(['GET'])
 def optimized_subject_leaderboard_view(request):
     """
     Optimized leaderboard by subject using individual bidang caching
+
+    Cached bodies are served as-is with an ETag; `If-None-Match` gets a 304.
     """
     bidang = request.query_params.get('bidang')
     
     if bidang:
-        cache_key = utils.generate_leaderboard_cache_key(bidang)
-        
-        cached_data = leaderboard_cache.get(cache_key)
-        if cached_data is not None:
-            logger.info(f"Cache hit for subject leaderboard: {cache_key}")
-            response = Response(cached_data)
-            return response
-        
-        results = list(
-            QuizSession.objects
-            .filter(quiz__bidang=bidang)
-            .values('user__id', 'user__username', 'quiz__bidang')
-            .annotate(
-                total_score=Sum('score'),
-                quiz_count=Count('id'),
-                average_score=Avg('score'),
-                total_duration=Sum('duration'),
-                average_duration=Avg('duration'),
-            )
-            .order_by('-average_score', 'average_duration')
-        )[:20]
-        
-        leaderboard_data = []
-        bidang_name = dict(Bidang.choices).get(bidang, bidang)
-        
-        for rank, row in enumerate(results, 1):
-            leaderboard_data.append({
-                'rank': rank,
-                'user_id': row['user__id'],
-                'username': row['user__username'],
-                'bidang': row['quiz__bidang'],
-                'bidang_name': bidang_name,
-                'total_score': row['total_score'],
-                'quiz_count': row['quiz_count'],
-                'average_score': round(row['average_score'], 2) if row['average_score'] else 0,
-                'total_duration': row['total_duration'],
-                'average_duration': round(row['average_duration'], 2) if row['average_duration'] else 0
-            })
-        
-        response_data = {
-            'bidang': bidang,
+        return rendered_response(request, get_subject_leaderboard(bidang))
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        rendered = list(executor.map(get_subject_leaderboard, Bidang.values))
+    
+    # The combined ETag only depends on the subjects' ETags, so an unchanged
+    # poll is answered before anything is decoded or rendered
+    etag = make_etag(*(subject['etag'] for subject in rendered))
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    
+    response_data = {}
+    for (bidang_code, bidang_name), subject in zip(Bidang.choices, rendered):
+        subject_data = json.loads(subject['body'])
+        response_data[bidang_code] = {
             'bidang_name': bidang_name,
-            'total_participants': len(leaderboard_data),
-            'leaderboard': leaderboard_data
+            'total_participants': subject_data.get('total_participants', 0),
+            'leaderboard': subject_data['leaderboard']
         }
-        
-        leaderboard_cache.set(cache_key, response_data, 180)
-        logger.info(f"Cached subject leaderboard: {cache_key}")
-        
-        return Response(response_data)
-    
-    else:
-        def get_subject_leaderboard(bidang_choice):
-            bidang_code, bidang_name = bidang_choice
-            cache_key = utils.generate_leaderboard_cache_key(bidang_code)
-            
-            cached_subject_data = leaderboard_cache.get(cache_key)
-            if cached_subject_data is not None:
-                logger.info(f"Cache hit for subject {bidang_code}: {cache_key}")
-                return bidang_code, {
-                    'bidang_name': bidang_name,
-                    'total_participants': cached_subject_data.get('total_participants', 0),
-                    'leaderboard': cached_subject_data['leaderboard']
-                }
-
-            results = (
-                QuizSession.objects
-                .filter(quiz__bidang=bidang_code)
-                .values('user__id', 'user__username', 'quiz__bidang')
-                .annotate(
-                    total_score=Sum('score'),
-                    quiz_count=Count('id'),
-                    average_score=Avg('score'),
-                    total_duration=Sum('duration'),
-                    average_duration=Avg('duration'),
-                )
-                .order_by('-average_score', 'average_duration')[:20]
-            )
-            
-            formatted_data = []
-            for rank, row in enumerate(results, 1):
-                formatted_data.append({
-                    'rank': rank,
-                    'user_id': row['user__id'],
-                    'username': row['user__username'],
-                    'bidang': row['quiz__bidang'],
-                    'bidang_name': bidang_name,
-                    'total_score': row['total_score'],
-                    'quiz_count': row['quiz_count'],
-                    'average_score': round(row['average_score'], 2) if row['average_score'] else 0,
-                    'total_duration': row['total_duration'],
-                    'average_duration': round(row['average_duration'], 2) if row['average_duration'] else 0
-                })
-            
-            bidang_cache_data = {
-                'bidang': bidang_code,
-                'bidang_name': bidang_name,
-                'total_participants': len(formatted_data),
-                'leaderboard': formatted_data
-            }
-            leaderboard_cache.set(cache_key, bidang_cache_data, 180)
-            logger.info(f"Cached subject leaderboard for {bidang_code}: {cache_key}")
-            
-            return bidang_code, {
-                'bidang_name': bidang_name,
-                'total_participants': len(formatted_data),
-                'leaderboard': formatted_data
-            }
-        
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [executor.submit(get_subject_leaderboard, choice) for choice in Bidang.choices]
-            results = [future.result() for future in futures]
-        
-        response_data = {bidang_code: data for bidang_code, data in results}
     
-    response = Response(response_data)
-    return response
+    return rendered_response(request, {'body': render_json(response_data)['body'], 'etag': etag})
 
 
 @api_view(['GET'])
 def optimized_quiz_leaderboard_view(request, pk):
     """
     Optimized leaderboard by quiz using caching
+
+    Any rank range can be requested with `?offset=&limit=`; the top page is
+    served from a rendered copy that new sessions patch in place, and is
+    frozen once the quiz has ended. Other ranges are cached per leaderboard
+    version. Both come with an ETag.
     """
-    
-    cache_key = utils.generate_quiz_leaderboard_cache_key(pk)
-    
-    cached_data = leaderboard_cache.get(cache_key)
-    if cached_data is not None:
-        logger.info(f"Cache hit for quiz leaderboard: {cache_key}")
-        response = Response(cached_data)
-        return response
+    try:
+        offset = max(int(request.query_params.get('offset', 0)), 0)
+        limit = int(request.query_params.get('limit', QUIZ_LEADERBOARD_SIZE))
+    except ValueError:
+        return Response({'error': 'offset and limit must be integers'}, status=400)
+    limit = min(max(limit, 1), MAX_QUIZ_LEADERBOARD_PAGE_SIZE)
     
     try:
-        quiz = Quiz.objects.only('id', 'title').get(id=pk)
+        if offset == 0 and limit == QUIZ_LEADERBOARD_SIZE:
+            rendered = get_quiz_leaderboard_snapshot(pk)
+        else:
+            rendered = get_quiz_leaderboard_range(pk, offset, limit)
     except Quiz.DoesNotExist:
         return Response({'error': 'Quiz not found'}, status=404)
     
-    results = (
-        QuizSession.objects
-        .filter(quiz_id=pk)
-        .select_related('user')
-        .order_by('-score', 'duration')[:20]
-    )
-    
-    leaderboard_data = []
-    for rank, row in enumerate(results, 1):
-        leaderboard_data.append({
-            'rank': rank,
-            'session_id': row.id,
-            'user_id': row.user.id,
-            'username': row.user.username,
-            'score': row.score,
-            'duration': row.duration,
-            'user_start': row.user_start.isoformat() if row.user_start else None,
-            'user_end': row.user_end.isoformat() if row.user_end else None,
-        })
-    
-    response_data = {
-        'quiz_id': quiz.id,
-        'quiz_title': quiz.title,
-        'total_participants': len(leaderboard_data),
-        'leaderboard': leaderboard_data
-    }
-    
-    leaderboard_cache.set(cache_key, response_data, 180)
-    logger.info(f"Cached quiz leaderboard: {cache_key}")
+    return rendered_response(request, rendered)
+
+
+def get_session_rank(quiz_id, session):
+    """
+    Get the rank of a quiz session and the number of participants.
+
+    Sessions with the same score and duration share a rank.
+    """
+    rank_info = quiz_rank_engine.rank_and_total(quiz_id, session.score, session.duration)
+    if rank_info is not None:
+        return rank_info
     
-    response = Response(response_data)
-    return response
+    qs = QuizSession.objects.filter(quiz_id=quiz_id)
+    user_rank = (
+        qs.filter(
+            score__gt=session.score
+        ).count()
+        +
+        qs.filter(
+            score=session.score,
+            duration__lt=session.duration
+        ).count()
+        + 1
+    )
+    return user_rank, qs.count()
 
 
 @api_view(['GET'])
 def optimized_user_quiz_performance_view(request, pk):
     """
-    Optimized user performance using caching
+    Optimized user performance using the rank engine
+
+    Rank, percentile and total participants come from the quiz's score
+    histogram, so they are always current and are not cached per user.
     """
     if not request.user.is_authenticated:
         return Response({'error': 'Authentication required'}, status=401)
     
     user_id = request.user.id
-    cache_key = utils.generate_quiz_leaderboard_by_user_cache_key(pk, user_id)
-    
-    cached_data = user_stats_cache.get(cache_key)
-    if cached_data is not None:
-        logger.info(f"Cache hit for user performance: {cache_key}")
-        response = Response(cached_data)
-        return response
     
-    try:
-        quiz = Quiz.objects.only('id', 'title').get(id=pk)
-    except Quiz.DoesNotExist:
+    quiz = get_quiz_metadata(pk)
+    if quiz is None:
         return Response({'error': 'Quiz not found'}, status=404)
     
     try:
@@ -223,23 +140,11 @@ def optimized_user_quiz_performance_view(request, pk):
     except QuizSession.DoesNotExist:
         return Response({'error': 'No quiz session found'}, status=404)
     
-    qs = QuizSession.objects.filter(quiz_id=pk)
-    user_rank = (
-        qs.filter(
-            score__gt=user_session.score
-        ).count()
-        +
-        qs.filter(
-            score=user_session.score,
-            duration__lt=user_session.duration
-        ).count()
-        + 1
-    )
-    total_participants = qs.count()
+    user_rank, total_participants = get_session_rank(pk, user_session)
         
     response_data = {
-        'quiz_id': quiz.id,
-        'quiz_title': quiz.title,
+        'quiz_id': quiz['id'],
+        'quiz_title': quiz['title'],
         'user_performance': {
             'user_id': user_id,
             'username': request.user.username,
@@ -252,11 +157,183 @@ def optimized_user_quiz_performance_view(request, pk):
             },
             'rank': user_rank,
             'total_participants': total_participants,
+            'percentile': quiz_rank_engine.percentile(user_rank, total_participants),
         }
     }
     
-    user_stats_cache.set(cache_key, response_data, 3600)
-    logger.info(f"Cached user performance: {cache_key}")
-    
     response = Response(response_data)
     return response
+
+
+@api_view(['GET'])
+def optimized_user_quiz_around_me_view(request, pk):
+    """
+    Current user's rank with the sessions directly above and below them
+
+    `?radius=k` sets how many sessions are returned on each side.
+    """
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    try:
+        radius = int(request.query_params.get('radius', DEFAULT_AROUND_ME_RADIUS))
+    except ValueError:
+        return Response({'error': 'radius must be an integer'}, status=400)
+    radius = min(max(radius, 0), MAX_AROUND_ME_RADIUS)
+    
+    quiz = get_quiz_metadata(pk)
+    if quiz is None:
+        return Response({'error': 'Quiz not found'}, status=404)
+    
+    try:
+        user_session = QuizSession.objects.get(quiz_id=pk, user=request.user)
+    except QuizSession.DoesNotExist:
+        return Response({'error': 'No quiz session found'}, status=404)
+    
+    window = quiz_rank_engine.around(pk, user_session.id, radius)
+    if window is not None:
+        leaderboard_data, total_participants = window
+        user_rank = next(
+            entry['rank'] for entry in leaderboard_data
+            if entry['session_id'] == user_session.id
+        )
+    else:
+        # Centred on the session itself, not on the first session of its tie
+        user_rank, total_participants = get_session_rank(pk, user_session)
+        start = max(get_database_session_position(pk, user_session) - radius, 0)
+        leaderboard_data, _ = get_database_leaderboard_page(pk, start, 2 * radius + 1)
+    
+    for entry in leaderboard_data:
+        entry['is_current_user'] = entry['session_id'] == user_session.id
+    
+    response_data = {
+        'quiz_id': quiz['id'],
+        'quiz_title': quiz['title'],
+        'user_id': request.user.id,
+        'rank': user_rank,
+        'total_participants': total_participants,
+        'radius': radius,
+        'leaderboard': leaderboard_data,
+    }
+    
+    return Response(response_data)
+
+
+def get_user_ranks(quiz_id, user_ids):
+    """
+    Get rank, score, duration and percentile for many users of a quiz at once.
+
+    One query loads the sessions and one pipelined rank engine call ranks
+    them all; without Redis a single RANK() OVER query is used instead.
+    Users without a session for the quiz map to None.
+    """
+    sessions = list(
+        QuizSession.objects
+        .filter(quiz_id=quiz_id, user_id__in=user_ids)
+        .values('id', 'user_id', 'user__username', 'score', 'duration')
+    )
+    
+    result = quiz_rank_engine.ranks_and_total(
+        quiz_id, [(session['score'], session['duration']) for session in sessions]
+    )
+    if result is not None:
+        ranks, total_participants = result
+    else:
+        # The window has to run over the whole quiz before the user filter is
+        # applied, which the ORM cannot express without a raw subquery.
+        ranked = {
+            row.id: row
+            for row in QuizSession.objects.raw(
+                f"""
+                SELECT id, rank, total_participants FROM (
+                    SELECT id, user_id,
+                        RANK() OVER (ORDER BY score DESC, duration ASC) AS rank,
+                        COUNT(*) OVER () AS total_participants
+                    FROM {QuizSession._meta.db_table}
+                    WHERE quiz_id = %s
+                ) ranked
+                WHERE user_id IN ({', '.join(['%s'] * len(user_ids))})
+                """,
+                [quiz_id, *user_ids],
+            )
+        }
+        ranks = [ranked[session['id']].rank for session in sessions]
+        total_participants = next(iter(ranked.values())).total_participants if ranked else 0
+    
+    user_ranks = {user_id: None for user_id in user_ids}
+    for session, rank in zip(sessions, ranks):
+        user_ranks[session['user_id']] = {
+            'user_id': session['user_id'],
+            'username': session['user__username'],
+            'session_id': session['id'],
+            'score': session['score'],
+            'duration': session['duration'],
+            'rank': rank,
+            'total_participants': total_participants,
+            'percentile': quiz_rank_engine.percentile(rank, total_participants),
+        }
+    return user_ranks
+
+
+@api_view(['POST'])
+def optimized_bulk_user_rank_view(request, pk):
+    """
+    Rank, score, duration and percentile for a list of users on one quiz
+
+    Expects `{"user_ids": [...]}` with up to 200 IDs. Results are cached in one
+    entry per quiz leaderboard version that grows as new users are looked up.
+    """
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    user_ids = request.data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return Response({'error': 'user_ids must be a non-empty list'}, status=400)
+    if len(user_ids) > MAX_BULK_RANK_USERS:
+        return Response({'error': f'At most {MAX_BULK_RANK_USERS} user_ids are allowed'}, status=400)
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+    except (TypeError, ValueError):
+        return Response({'error': 'user_ids must be integers'}, status=400)
+    
+    quiz = get_quiz_metadata(pk)
+    if quiz is None:
+        return Response({'error': 'Quiz not found'}, status=404)
+    
+    version = quiz_rank_engine.version(pk)
+    cache_key = utils.generate_quiz_ranks_cache_key(pk, version) if version is not None else None
+    
+    cached_ranks = (user_stats_cache.get(cache_key) if cache_key else None) or {}
+    missing_user_ids = [user_id for user_id in user_ids if str(user_id) not in cached_ranks]
+    if missing_user_ids:
+        computed = get_user_ranks(pk, missing_user_ids)
+        cached_ranks.update({str(user_id): row for user_id, row in computed.items()})
+        if cache_key:
+            user_stats_cache.set(cache_key, cached_ranks, 300)
+            logger.info(f"Cached bulk ranks: {cache_key}")
+    else:
+        logger.info(f"Cache hit for bulk ranks: {cache_key}")
+    
+    results = [cached_ranks[str(user_id)] for user_id in user_ids]
+    
+    response_data = {
+        'quiz_id': quiz['id'],
+        'quiz_title': quiz['title'],
+        'version': version,
+        'results': [row for row in results if row is not None],
+        'missing_user_ids': [user_id for user_id, row in zip(user_ids, results) if row is None],
+    }
+    
+    return Response(response_data)
+
+
+@api_view(['GET'])
+def cache_stats_view(request):
+    """
+    Cache hit/miss counters per tier and WebSocket outbound queue depth and
+    drops for the process serving the request
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Staff access required'}, status=403)
+    
+    return Response({'pid': os.getpid(), 'caches': cache_stats(), 'websockets': outbox_stats()})
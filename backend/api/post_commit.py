@@ -0,0 +1,114 @@
+"""
+Side effects of committed writes, run off the request thread.
+
+run_after_commit() registers work with transaction.on_commit, so it never
+runs for an insert that is rolled back, and then hands it to a small thread
+pool so the response does not wait for Redis. The number of queued tasks is
+bounded: when the pool falls behind, the work runs on the committing thread
+instead, which slows writers down rather than dropping cache updates.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+POST_COMMIT_WORKERS = 4
+POST_COMMIT_MAX_PENDING = 1000
+
+
+class PostCommitExecutor:
+    """
+    Bounded thread pool for work that follows a commit.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._futures = set()
+
+    def _ensure_executor(self):
+        pid = os.getpid()
+        if self._executor_pid == pid:
+            return
+        with self._lock:
+            if self._executor_pid == pid:
+                return
+            # A forked child inherits the parent's pool but not its threads
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='post-commit')
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+            self._futures = set()
+            self._executor_pid = pid
+
+    def submit(self, func: Callable, *args):
+        """
+        Run func(*args) in the pool, or right away if too much work is queued.
+        """
+        self._ensure_executor()
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"Post-commit queue full, running {func.__name__} inline")
+            self._run(func, args)
+            return
+        try:
+            future = self._executor.submit(self._run_in_pool, func, args)
+        except RuntimeError:
+            # The pool is shutting down with the interpreter
+            self._slots.release()
+            self._run(func, args)
+            return
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+
+    @staticmethod
+    def _run(func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Post-commit {func.__name__} failed: {e}")
+
+    def _run_in_pool(self, func, args):
+        try:
+            self._run(func, args)
+        finally:
+            close_old_connections()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the queued work to finish.
+
+        Returns:
+            True if nothing is left running
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if not futures:
+            return True
+        _, not_done = wait(futures, timeout)
+        return not not_done
+
+
+post_commit_executor = PostCommitExecutor(POST_COMMIT_WORKERS, POST_COMMIT_MAX_PENDING)
+
+
+def run_after_commit(func: Callable, *args):
+    """
+    Run func(*args) in the background once the current transaction commits.
+
+    Without an open transaction the work is handed off immediately.
+    """
+    transaction.on_commit(lambda: post_commit_executor.submit(func, *args))
@@ -0,0 +1,109 @@
+"""
+Cached quiz metadata and schedule.
+
+Leaderboard views only need a quiz's title, subject and dates, so these are
+cached in the quiz_data cache instead of being read from the database on
+every request. Both entries are invalidated once a transaction that saved or
+deleted a quiz commits (see invalidate_quiz_on_change).
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from caching import utils
+from .models import Quiz
+
+QUIZ_METADATA_TIMEOUT = 1800
+QUIZ_SCHEDULE_TIMEOUT = 300
+# Leaderboards of an ended quiz are frozen once in-flight submissions had
+# this many seconds to complete
+QUIZ_FREEZE_GRACE = 60
+
+QUIZ_UPCOMING = 'upcoming'
+QUIZ_ACTIVE = 'active'
+QUIZ_ENDED = 'ended'
+
+quiz_data_cache = utils.quiz_data_cache
+
+
+def quiz_metadata(quiz: Quiz) -> dict:
+    return {
+        'id': quiz.id,
+        'title': quiz.title,
+        'bidang': quiz.bidang,
+        'start_date': quiz.start_date.isoformat(),
+        'end_date': quiz.end_date.isoformat(),
+    }
+
+
+def get_quiz_metadata(quiz_id: int) -> Optional[dict]:
+    """
+    Cached title, subject and dates of a quiz.
+
+    Returns:
+        Dict from quiz_metadata, or None if the quiz does not exist
+    """
+    def load():
+        quiz = Quiz.objects.filter(id=quiz_id).first()
+        return quiz_metadata(quiz) if quiz is not None else None
+
+    return quiz_data_cache.get_or_set(
+        utils.generate_quiz_cache_key(quiz_id), load, QUIZ_METADATA_TIMEOUT
+    )
+
+
+def get_quiz_schedule() -> list:
+    """
+    Cached metadata of every quiz that had not ended when it was loaded.
+    """
+    def load():
+        quizzes = Quiz.objects.filter(end_date__gte=timezone.now()).order_by('start_date')
+        return [quiz_metadata(quiz) for quiz in quizzes]
+
+    return quiz_data_cache.get_or_set(utils.QUIZ_SCHEDULE_CACHE_KEY, load, QUIZ_SCHEDULE_TIMEOUT)
+
+
+def _date(quiz: dict, field: str) -> datetime:
+    return parse_datetime(quiz[field])
+
+
+def quiz_phase(quiz: dict, now: Optional[datetime] = None) -> str:
+    """
+    Whether a quiz from get_quiz_metadata is upcoming, active or ended.
+    """
+    now = now or timezone.now()
+    if now < _date(quiz, 'start_date'):
+        return QUIZ_UPCOMING
+    if now > _date(quiz, 'end_date'):
+        return QUIZ_ENDED
+    return QUIZ_ACTIVE
+
+
+def is_quiz_final(quiz: dict, now: Optional[datetime] = None) -> bool:
+    """
+    Whether a quiz ended long enough ago for its leaderboard to be frozen.
+    """
+    now = now or timezone.now()
+    return now > _date(quiz, 'end_date') + timedelta(seconds=QUIZ_FREEZE_GRACE)
+
+
+def active_bidangs(now: Optional[datetime] = None) -> set:
+    """
+    Subjects with at least one quiz currently running.
+    """
+    now = now or timezone.now()
+    return {
+        quiz['bidang'] for quiz in get_quiz_schedule()
+        if quiz_phase(quiz, now) == QUIZ_ACTIVE
+    }
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def invalidate_quiz_on_change(sender, instance, **kwargs):
+    """Drop the cached metadata of an edited or deleted quiz after commit"""
+    quiz_id = instance.id
+    transaction.on_commit(lambda: utils.invalidate_quiz_catalog(quiz_id))
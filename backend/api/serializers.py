@@ -104,6 +104,23 @@ class QuizSessionCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class QuizSessionBatchItemSerializer(serializers.Serializer):
+    """
+    One row of a batch upload. Only checks the row itself; users, quizzes and
+    existing attempts are validated for the whole batch at once.
+    """
+    user = serializers.IntegerField(min_value=1)
+    quiz = serializers.IntegerField(min_value=1)
+    score = serializers.IntegerField()
+    user_start = serializers.DateTimeField()
+    user_end = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['user_start'] >= data['user_end']:
+            raise serializers.ValidationError("End time must be after start time")
+        return data
+
+
 class SubjectLeaderboardSerializer(serializers.Serializer):
     """Serializer for subject-based leaderboard (aggregated scores per user per subject)"""
     user_id = serializers.IntegerField()
@@ -0,0 +1,85 @@
+"""
+Keeps the subject copied onto quiz sessions and the per-subject aggregates in
+line with edits and deletions.
+
+QuizSession.bidang is copied from the quiz when a session is inserted and the
+per-subject aggregates in UserSubjectStats are built from it. Moving a quiz
+to another subject moves its sessions along and recomputes the aggregates of
+their users in both subjects once the quiz is saved. Deleting sessions,
+directly or together with their quiz, recomputes the aggregates they counted
+towards. Deleting a user deletes their aggregates along with their sessions.
+"""
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from caching import utils
+from .models import Quiz, QuizSession, UserSubjectStats
+
+
+def invalidate_subject_leaderboards_on_commit(bidangs):
+    bidangs = set(bidangs)
+
+    def invalidate_subject_leaderboards():
+        for bidang in bidangs:
+            utils.invalidate_leaderboard_caches(bidang)
+
+    transaction.on_commit(invalidate_subject_leaderboards)
+
+
+@receiver(pre_save, sender=Quiz)
+def remember_quiz_subject(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note the stored subject of a quiz that is about to be saved"""
+    instance._stored_bidang = None
+    if raw or instance.pk is None or (update_fields is not None and 'bidang' not in update_fields):
+        return
+    instance._stored_bidang = (
+        Quiz.objects.filter(pk=instance.pk).values_list('bidang', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Quiz)
+def move_sessions_with_quiz_subject(sender, instance, created, raw=False, **kwargs):
+    """Refile the sessions of a quiz whose subject changed"""
+    previous = getattr(instance, '_stored_bidang', None)
+    if created or raw or previous is None or previous == instance.bidang:
+        return
+
+    with transaction.atomic():
+        sessions = QuizSession.objects.filter(quiz_id=instance.id)
+        user_ids = list(sessions.values_list('user_id', flat=True))
+        sessions.update(bidang=instance.bidang)
+        UserSubjectStats.rebuild(
+            (user_id, bidang) for user_id in user_ids for bidang in (previous, instance.bidang)
+        )
+
+    invalidate_subject_leaderboards_on_commit((previous, instance.bidang))
+
+
+@receiver(pre_delete, sender=Quiz)
+def remember_quiz_session_stats(sender, instance, **kwargs):
+    """Note which aggregates the sessions of a quiz about to be deleted count towards"""
+    instance._session_stats_keys = set(
+        QuizSession.objects.filter(quiz_id=instance.id).values_list('user_id', 'bidang')
+    )
+
+
+@receiver(post_delete, sender=Quiz)
+def rebuild_stats_of_deleted_quiz(sender, instance, **kwargs):
+    """Take the sessions deleted along with a quiz out of the aggregates"""
+    keys = getattr(instance, '_session_stats_keys', None)
+    if keys:
+        UserSubjectStats.rebuild(keys)
+        invalidate_subject_leaderboards_on_commit(bidang for _, bidang in keys)
+
+
+@receiver(post_delete, sender=QuizSession)
+def rebuild_stats_of_deleted_session(sender, instance, origin=None, **kwargs):
+    """Take a deleted session out of the aggregates"""
+    # Quiz deletions are handled once per quiz above, and a user's aggregates
+    # are deleted together with the user
+    origin_model = origin._meta.model if isinstance(origin, Model) else getattr(origin, 'model', None)
+    if origin_model is not QuizSession:
+        return
+    UserSubjectStats.rebuild([(instance.user_id, instance.bidang)])
+    invalidate_subject_leaderboards_on_commit([instance.bidang])
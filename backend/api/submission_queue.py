@@ -0,0 +1,218 @@
+"""
+Write-behind queue for quiz session submissions.
+
+When QUIZ_SESSION_SUBMISSION_MODE is "queue", POST /api/quiz-sessions/ only
+appends the submission to a Redis Stream and answers with a ticket. Workers
+started with ``manage.py drain_submissions`` read the stream as members of one
+consumer group and insert what they read in batches through the same path as
+the batch upload endpoint, so the request never holds a database connection.
+"""
+import json
+import logging
+import uuid
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from .models import QuizSession
+from .post_commit import run_after_commit
+from .submissions import ingest_quiz_sessions, publish_quiz_sessions
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'submissions:quiz_sessions'
+CONSUMER_GROUP = 'quiz_session_drainers'
+TICKET_TTL = 60 * 60 * 24
+
+TICKET_QUEUED = 'queued'
+TICKET_CREATED = 'created'
+TICKET_REJECTED = 'rejected'
+
+
+class SubmissionQueue:
+    """
+    Redis Stream of pending quiz sessions plus one status hash per ticket.
+    """
+
+    def __init__(self, cache_alias: str = 'default'):
+        self.cache_alias = cache_alias
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_redis_connection(self.cache_alias)
+        return self._client
+
+    @staticmethod
+    def ticket_key(ticket: str) -> str:
+        return f"submissions:ticket:{ticket}"
+
+    def enqueue(self, row: dict) -> str:
+        """
+        Queue one validated submission.
+
+        Args:
+            row: Dict with user, quiz, score, user_start and user_end as JSON-safe values
+
+        Returns:
+            The ticket ID; raises on Redis errors so the caller can fall back
+        """
+        ticket = uuid.uuid4().hex
+        queued_at = timezone.now().isoformat()
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self.ticket_key(ticket), mapping={
+            'status': TICKET_QUEUED,
+            'queued_at': queued_at,
+        })
+        pipe.expire(self.ticket_key(ticket), TICKET_TTL)
+        # The quiz window is checked against when the submission arrived, not when it is drained
+        pipe.xadd(STREAM_KEY, {'ticket': ticket, 'queued_at': queued_at, 'payload': json.dumps(row)})
+        pipe.execute()
+        return ticket
+
+    def ticket_status(self, ticket: str):
+        """
+        Get the status of a ticket.
+
+        Returns:
+            Dict with status and either session_id or errors, or None if the
+            ticket is unknown or expired
+        """
+        data = self.client.hgetall(self.ticket_key(ticket))
+        if not data:
+            return None
+        data = {key.decode(): value.decode() for key, value in data.items()}
+        status = {'ticket': ticket, 'status': data['status'], 'queued_at': data.get('queued_at')}
+        if 'session_id' in data:
+            status['session_id'] = int(data['session_id'])
+        if 'errors' in data:
+            status['errors'] = json.loads(data['errors'])
+        return status
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read(self, consumer: str, count: int, block_ms: int, claim_idle_ms: int):
+        """
+        Get the next batch for a consumer.
+
+        Entries left pending by a consumer that died are claimed first.
+
+        Returns:
+            Tuple of (messages, redelivered) where messages is a list of
+            (message ID, fields)
+        """
+        _, claimed, *_ = self.client.xautoclaim(
+            STREAM_KEY, CONSUMER_GROUP, consumer, claim_idle_ms, start_id='0-0', count=count
+        )
+        if claimed:
+            return claimed, True
+
+        response = self.client.xreadgroup(
+            CONSUMER_GROUP, consumer, {STREAM_KEY: '>'}, count=count, block=block_ms
+        )
+        if not response:
+            return [], False
+        return response[0][1], False
+
+    def process(self, messages, redelivered: bool = False) -> dict:
+        """
+        Insert a batch of queued submissions and resolve their tickets.
+
+        Entries are only acknowledged after the batch is committed; if the
+        insert fails they stay pending and are claimed again later.
+
+        Returns:
+            Dict with created and rejected counts
+        """
+        message_ids = [message_id for message_id, _ in messages]
+        # Entries deleted while pending come back without fields
+        messages = [(message_id, fields) for message_id, fields in messages if fields]
+
+        tickets = []
+        rows = []
+        received_at = []
+        for _, fields in messages:
+            tickets.append(fields[b'ticket'].decode())
+            try:
+                rows.append(json.loads(fields[b'payload']))
+            except (KeyError, ValueError):
+                rows.append(None)
+            queued_at = fields.get(b'queued_at')
+            received_at.append(parse_datetime(queued_at.decode()) if queued_at else None)
+
+        close_old_connections()
+        created, errors = ingest_quiz_sessions(rows, received_at)
+
+        resolved = {index: session.id for index, session in created}
+        rejected = {error['index']: error['errors'] for error in errors}
+        if redelivered and rejected:
+            # A previous delivery may have been committed before its consumer
+            # died, possibly before its sessions were published
+            committed = self._find_committed(rows, rejected)
+            if committed:
+                resolved.update(committed)
+                rejected = {index: error for index, error in rejected.items() if index not in resolved}
+                sessions = QuizSession.objects.select_related('user', 'quiz').filter(id__in=committed.values())
+                run_after_commit(publish_quiz_sessions, list(sessions))
+
+        pipe = self.client.pipeline(transaction=False)
+        for index, ticket in enumerate(tickets):
+            key = self.ticket_key(ticket)
+            if index in resolved:
+                pipe.hset(key, mapping={'status': TICKET_CREATED, 'session_id': resolved[index]})
+            else:
+                pipe.hset(key, mapping={
+                    'status': TICKET_REJECTED,
+                    'errors': json.dumps(rejected.get(index, {})),
+                })
+            pipe.expire(key, TICKET_TTL)
+
+        pipe.xack(STREAM_KEY, CONSUMER_GROUP, *message_ids)
+        pipe.xdel(STREAM_KEY, *message_ids)
+        pipe.execute()
+
+        return {'created': len(resolved), 'rejected': len(tickets) - len(resolved)}
+
+    @staticmethod
+    def _find_committed(rows, rejected):
+        """Map rejected rows to identical sessions that are already stored"""
+        candidates = {
+            index: rows[index] for index in rejected
+            if isinstance(rows[index], dict) and 'user' in rows[index] and 'quiz' in rows[index]
+        }
+        if not candidates:
+            return {}
+
+        stored = {}
+        sessions = QuizSession.objects.filter(
+            user_id__in={row['user'] for row in candidates.values()},
+            quiz_id__in={row['quiz'] for row in candidates.values()},
+        ).values('id', 'user_id', 'quiz_id', 'score', 'user_start', 'user_end')
+        for session in sessions:
+            stored[(session['user_id'], session['quiz_id'])] = session
+
+        found = {}
+        for index, row in candidates.items():
+            session = stored.get((row['user'], row['quiz']))
+            if (
+                session
+                and session['score'] == row.get('score')
+                and session['user_start'] == parse_datetime(str(row.get('user_start')))
+                and session['user_end'] == parse_datetime(str(row.get('user_end')))
+            ):
+                found[index] = session['id']
+        return found
+
+    def pending_count(self) -> int:
+        """Number of submissions not yet inserted"""
+        return self.client.xlen(STREAM_KEY)
+
+
+submission_queue = SubmissionQueue()
@@ -0,0 +1,273 @@
+"""
+Batch ingest of quiz sessions.
+
+Rows are validated together with one query per kind of check, inserted with a
+single bulk insert, and the side effects of the insert (rank sets, caches and
+WebSocket notifications) run once per affected quiz or subject, in the
+background after the insert commits (see api.post_commit).
+"""
+import logging
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from .models import Quiz, QuizSession, UserSubjectStats
+from .serializers import QuizSessionBatchItemSerializer
+from .leaderboards import QUIZ_LEADERBOARD_SIZE, invalidate_subject_leaderboard_if_changed
+from .post_commit import run_after_commit
+from .quiz_catalog import is_quiz_final, quiz_metadata
+from caching import utils
+from caching.ranking import quiz_rank_engine
+from websocket.utils import websocket_notifier
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 5000
+# Validations of a batch before its conflicting rows are inserted one by one
+MAX_INGEST_ATTEMPTS = 3
+NON_FIELD_ERRORS = api_settings.NON_FIELD_ERRORS_KEY
+DUPLICATE_ATTEMPT_ERROR = "User has already attempted this quiz. Only one attempt per quiz is allowed."
+
+
+def validate_quiz_sessions(rows, received_at=None):
+    """
+    Validate a batch of raw session rows.
+
+    The quiz window is checked against the time each row was received, so
+    rows queued before a quiz ended stay valid however late they are inserted.
+
+    Args:
+        rows: List of dicts with user, quiz, score, user_start and user_end
+        received_at: Optional list with the receive time of each row (None
+            for rows received now)
+
+    Returns:
+        Tuple of (sessions, errors) where sessions is a list of
+        (index, unsaved QuizSession) and errors maps a row index to its
+        serializer-style error dict
+    """
+    errors = {}
+    valid = {}
+    for index, row in enumerate(rows):
+        serializer = QuizSessionBatchItemSerializer(data=row)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+
+    user_ids = {data['user'] for data in valid.values()}
+    quiz_ids = {data['quiz'] for data in valid.values()}
+    users = User.objects.only('id', 'username').in_bulk(user_ids) if user_ids else {}
+    quizzes = Quiz.objects.in_bulk(quiz_ids) if quiz_ids else {}
+    attempted = set(
+        QuizSession.objects
+        .filter(user_id__in=users.keys(), quiz_id__in=quizzes.keys())
+        .values_list('user_id', 'quiz_id')
+    ) if users and quizzes else set()
+
+    now = timezone.now()
+    sessions = []
+    for index, data in valid.items():
+        received = (received_at[index] if received_at else None) or now
+        user = users.get(data['user'])
+        quiz = quizzes.get(data['quiz'])
+        if user is None:
+            errors[index] = {'user': ["User does not exist"]}
+            continue
+        if quiz is None:
+            errors[index] = {'quiz': ["Quiz does not exist"]}
+            continue
+        if received < quiz.start_date:
+            errors[index] = {'quiz': ["Quiz has not started yet"]}
+            continue
+        if received > quiz.end_date:
+            errors[index] = {'quiz': ["Quiz has already ended"]}
+            continue
+        if data['user_start'] < quiz.start_date:
+            errors[index] = {NON_FIELD_ERRORS: ["Session start time cannot be before quiz start time"]}
+            continue
+        if data['user_end'] > quiz.end_date:
+            errors[index] = {NON_FIELD_ERRORS: ["Session end time cannot be after quiz end time"]}
+            continue
+        if (user.id, quiz.id) in attempted:
+            errors[index] = {NON_FIELD_ERRORS: [DUPLICATE_ATTEMPT_ERROR]}
+            continue
+
+        # Later rows for the same pair in this batch are duplicates
+        attempted.add((user.id, quiz.id))
+        sessions.append((index, QuizSession(
+            user=user,
+            quiz=quiz,
+            score=data['score'],
+            user_start=data['user_start'],
+            user_end=data['user_end'],
+            duration=int((data['user_end'] - data['user_start']).total_seconds()),
+        )))
+
+    return sessions, errors
+
+
+def create_quiz_sessions(sessions):
+    """
+    Insert validated sessions and their subject stats in one transaction.
+
+    Args:
+        sessions: Unsaved QuizSession instances
+    """
+    with transaction.atomic():
+        QuizSession.objects.bulk_create(sessions)
+        UserSubjectStats.record_sessions(sessions)
+
+
+def quiz_leaderboard_diffs(sessions, results):
+    """
+    Describe how new sessions change the top page of their quiz leaderboards.
+
+    Every diff carries the leaderboard version it produces and the new
+    total_participants. A session that makes the top page also carries its
+    row as 'entry' and its 1-based 'position'; it is inserted at that
+    position, moving the rows below it down and the last row off the page.
+    entry['rank'] is shared with sessions of the same score and duration, so
+    rows are renumbered the same way. Diffs flagged 'resync' cannot be applied
+    and the page has to be fetched again.
+
+    Args:
+        sessions: Saved QuizSession instances
+        results: Per-session results of quiz_rank_engine.add_sessions, or
+            None if it failed
+
+    Returns:
+        Dict of quiz_id -> diffs in version order (empty if every session of
+        the quiz was already recorded), or None for quizzes whose changes are
+        unknown
+    """
+    if results is None:
+        return {session.quiz_id: None for session in sessions}
+
+    diffs = {session.quiz_id: [] for session in sessions}
+    for session, result in zip(sessions, results):
+        if result['version'] is None:
+            continue
+        if result['rank'] is None:
+            diffs[session.quiz_id].append({'version': result['version'], 'resync': True})
+            continue
+        diff = {'version': result['version'], 'total_participants': result['total_participants']}
+        if result['position'] <= QUIZ_LEADERBOARD_SIZE:
+            diff['position'] = result['position']
+            diff['entry'] = {'rank': result['rank'], **quiz_rank_engine.session_entry(session)}
+        diffs[session.quiz_id].append(diff)
+    return diffs
+
+
+def publish_quiz_sessions(sessions):
+    """
+    Propagate newly inserted sessions to the rank sets, caches and WebSocket
+    clients, once per affected quiz and subject.
+
+    Cached quiz top pages are patched by the rank engine; a subject
+    leaderboard is only recomputed if the new stats can change it. The rank
+    engine ignores sessions it already recorded, so publishing the same
+    sessions again is safe.
+
+    Args:
+        sessions: Saved QuizSession instances with user and quiz loaded
+    """
+    if not sessions:
+        return
+
+    diffs = quiz_leaderboard_diffs(sessions, quiz_rank_engine.add_sessions(sessions))
+
+    sessions_by_quiz = defaultdict(list)
+    for session in sessions:
+        sessions_by_quiz[session.quiz_id].append(session)
+
+    users_by_bidang = defaultdict(set)
+    for session in sessions:
+        users_by_bidang[session.bidang].add(session.user_id)
+    for bidang, user_ids in users_by_bidang.items():
+        invalidate_subject_leaderboard_if_changed(bidang, user_ids)
+
+    # Submissions queued before a quiz ended can be drained after it was frozen
+    final_keys = [
+        utils.generate_final_quiz_leaderboard_cache_key(quiz_id)
+        for quiz_id, quiz_sessions in sessions_by_quiz.items()
+        if is_quiz_final(quiz_metadata(quiz_sessions[0].quiz))
+    ]
+    if final_keys:
+        utils.leaderboard_cache.delete_many(final_keys)
+
+    timestamp = timezone.now().isoformat()
+    for quiz_id, quiz_sessions in sessions_by_quiz.items():
+        websocket_notifier.send_leaderboard_updated({
+            'update_type': 'quiz_sessions_added',
+            'bidang': quiz_sessions[0].bidang,
+            'quiz_id': quiz_id,
+            'timestamp': timestamp,
+        })
+        quiz_diffs = diffs[quiz_id]
+        # Without new diffs clients still need the version to tell they are current
+        version = quiz_rank_engine.version(quiz_id) if quiz_diffs == [] else None
+        websocket_notifier.send_quiz_leaderboard_updated(quiz_id, timestamp, quiz_diffs, version)
+
+
+def publish_quiz_session(session):
+    """
+    Propagate a single uploaded session, also announcing the upload itself.
+
+    Args:
+        session: Saved QuizSession instance
+    """
+    websocket_notifier.send_quiz_session_uploaded({
+        'session_id': session.id,
+        'user_id': session.user_id,
+        'quiz_id': session.quiz_id,
+        'bidang': session.bidang,
+        'score': session.score,
+        'timestamp': timezone.now().isoformat(),
+    })
+    publish_quiz_sessions([session])
+
+
+def ingest_quiz_sessions(rows, received_at=None):
+    """
+    Validate, insert and publish a batch of quiz sessions.
+
+    Invalid rows are skipped and reported; they never fail the rest of the batch.
+
+    Args:
+        rows: List of raw session dicts
+        received_at: Optional receive time of each row (see validate_quiz_sessions)
+
+    Returns:
+        Tuple of (created, errors) where created is a list of
+        (index, QuizSession) and errors is a list of {'index', 'errors'} dicts
+        ordered by row index
+    """
+    for attempt in range(1, MAX_INGEST_ATTEMPTS + 1):
+        created, errors = validate_quiz_sessions(rows, received_at)
+        try:
+            create_quiz_sessions([session for _, session in created])
+            break
+        except IntegrityError:
+            # A concurrent upload inserted one of the same (user, quiz) pairs
+            # after validation; validate again against the committed rows
+            logger.warning(
+                f"Quiz session batch conflicted with a concurrent insert (attempt {attempt})"
+            )
+    else:
+        # Still conflicting: insert row by row and report the rows that lose
+        inserted = []
+        for index, session in created:
+            try:
+                create_quiz_sessions([session])
+                inserted.append((index, session))
+            except IntegrityError:
+                errors[index] = {NON_FIELD_ERRORS: [DUPLICATE_ATTEMPT_ERROR]}
+        created = inserted
+
+    run_after_commit(publish_quiz_sessions, [session for _, session in created])
+
+    return created, [
+        {'index': index, 'errors': errors[index]} for index in sorted(errors)
+    ]
@@ -1,3 +1,455 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q, Sum, Count
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import Quiz, QuizSession, UserSubjectStats, Bidang
+from caching.ranking import quiz_rank_engine
+from .leaderboards import build_quiz_leaderboard
+from .submissions import (
+    DUPLICATE_ATTEMPT_ERROR, MAX_INGEST_ATTEMPTS, NON_FIELD_ERRORS, ingest_quiz_sessions, publish_quiz_sessions,
+)
 
-# Create your tests here.
+
+class QuizSessionDenormalizationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.quiz = Quiz.objects.create(
+            title='Matematika Quiz Week 1',
+            bidang=Bidang.MAT,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        self.users = User.objects.bulk_create(
+            [User(username=f'student{i}') for i in range(3)]
+        )
+        self.user_start = now - timedelta(hours=1)
+
+    def test_save_copies_bidang_from_quiz(self):
+        session = QuizSession.objects.create(
+            user=self.users[0], quiz=self.quiz, score=80,
+            user_start=self.user_start, user_end=self.user_start + timedelta(minutes=10),
+        )
+        self.assertEqual(session.bidang, Bidang.MAT)
+
+    def test_bulk_create_copies_bidang_from_quiz(self):
+        QuizSession.objects.bulk_create([
+            QuizSession(
+                user=self.users[1], quiz=self.quiz, score=70, duration=600,
+                user_start=self.user_start, user_end=self.user_start + timedelta(minutes=10),
+            ),
+            QuizSession(
+                user_id=self.users[2].id, quiz_id=self.quiz.id, score=60, duration=600,
+                user_start=self.user_start, user_end=self.user_start + timedelta(minutes=10),
+            ),
+        ])
+        self.assertEqual(
+            set(QuizSession.objects.values_list('bidang', flat=True)), {Bidang.MAT}
+        )
+
+
+class QuizSubjectChangeTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.quiz = Quiz.objects.create(
+            title='Kebumian Quiz Week 1',
+            bidang=Bidang.KBM,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        self.other_quiz = Quiz.objects.create(
+            title='Geografi Quiz Week 1',
+            bidang=Bidang.GEO,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        self.users = User.objects.bulk_create(
+            [User(username=f'student{i}') for i in range(2)]
+        )
+        user_start = now - timedelta(hours=1)
+        for quiz, user, score in (
+            (self.quiz, self.users[0], 80),
+            (self.quiz, self.users[1], 60),
+            (self.other_quiz, self.users[0], 40),
+        ):
+            QuizSession.objects.create(
+                user=user, quiz=quiz, score=score,
+                user_start=user_start, user_end=user_start + timedelta(minutes=10),
+            )
+
+    def stats(self):
+        return {
+            (row.user_id, row.bidang): (row.total_score, row.quiz_count)
+            for row in UserSubjectStats.objects.all()
+        }
+
+    def test_subject_change_moves_sessions_and_stats(self):
+        with mock.patch('caching.utils.invalidate_leaderboard_caches') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.quiz.bidang = Bidang.GEO
+                self.quiz.save()
+
+        self.assertEqual(
+            set(QuizSession.objects.filter(quiz=self.quiz).values_list('bidang', flat=True)), {Bidang.GEO}
+        )
+        self.assertEqual(self.stats(), {
+            (self.users[0].id, Bidang.GEO): (120, 2),
+            (self.users[1].id, Bidang.GEO): (60, 1),
+        })
+        self.assertEqual(
+            {call.args[0] for call in invalidate.call_args_list}, {Bidang.KBM, Bidang.GEO}
+        )
+
+    def test_other_edits_leave_stats_alone(self):
+        before = self.stats()
+        with mock.patch.object(UserSubjectStats, 'rebuild') as rebuild:
+            self.quiz.title = 'Kebumian Quiz Week 1 (revised)'
+            self.quiz.save()
+        rebuild.assert_not_called()
+        self.assertEqual(self.stats(), before)
+
+
+class SubjectStatsDeletionTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.quizzes = [
+            Quiz.objects.create(
+                title=f'Ekonomi Quiz Week {week}',
+                bidang=Bidang.EKO,
+                start_date=now - timedelta(hours=2),
+                end_date=now + timedelta(hours=2),
+            )
+            for week in (1, 2)
+        ]
+        self.users = User.objects.bulk_create(
+            [User(username=f'student{i}') for i in range(2)]
+        )
+        user_start = now - timedelta(hours=1)
+        for quiz, user, score in (
+            (self.quizzes[0], self.users[0], 80),
+            (self.quizzes[0], self.users[1], 60),
+            (self.quizzes[1], self.users[0], 40),
+        ):
+            QuizSession.objects.create(
+                user=user, quiz=quiz, score=score,
+                user_start=user_start, user_end=user_start + timedelta(minutes=10),
+            )
+
+    def stats(self):
+        return {
+            row.user_id: (row.total_score, row.quiz_count, row.average_score)
+            for row in UserSubjectStats.objects.filter(bidang=Bidang.EKO)
+        }
+
+    def test_deleting_a_session_removes_it_from_stats(self):
+        with mock.patch('caching.utils.invalidate_leaderboard_caches') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                QuizSession.objects.get(user=self.users[0], quiz=self.quizzes[1]).delete()
+        self.assertEqual(self.stats(), {self.users[0].id: (80, 1, 80), self.users[1].id: (60, 1, 60)})
+        invalidate.assert_called_once_with(Bidang.EKO)
+
+        QuizSession.objects.filter(user=self.users[1]).delete()
+        self.assertEqual(self.stats(), {self.users[0].id: (80, 1, 80)})
+
+    def test_deleting_a_quiz_removes_its_sessions_from_stats(self):
+        with mock.patch('caching.utils.invalidate_leaderboard_caches') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.quizzes[0].delete()
+        self.assertEqual(self.stats(), {self.users[0].id: (40, 1, 40)})
+        invalidate.assert_called_once_with(Bidang.EKO)
+
+    def test_deleting_a_user_deletes_their_stats(self):
+        self.users[0].delete()
+        self.assertEqual(self.stats(), {self.users[1].id: (60, 1, 60)})
+
+
+class QuizCatalogInvalidationTests(TestCase):
+    def test_quiz_changes_invalidate_catalog_after_commit(self):
+        now = timezone.now()
+        with mock.patch('caching.utils.invalidate_quiz_catalog') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                quiz = Quiz.objects.create(
+                    title='Kimia Quiz Week 1',
+                    bidang=Bidang.KIM,
+                    start_date=now,
+                    end_date=now + timedelta(hours=2),
+                )
+                invalidate.assert_not_called()
+            invalidate.assert_called_once_with(quiz.id)
+
+            quiz_id = quiz.id
+            with self.captureOnCommitCallbacks(execute=True):
+                quiz.delete()
+            invalidate.assert_called_with(quiz_id)
+            self.assertEqual(invalidate.call_count, 2)
+
+
+class QuizLeaderboardETagTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz = Quiz.objects.create(
+                title='Fisika Quiz Week 2',
+                bidang=Bidang.FIS,
+                start_date=now - timedelta(hours=2),
+                end_date=now + timedelta(hours=2),
+            )
+        # Rank sets left behind by an earlier test database
+        quiz_rank_engine.client.delete(
+            quiz_rank_engine.key(self.quiz.id), quiz_rank_engine.histogram_key(self.quiz.id)
+        )
+        self.url = reverse('optimized-quiz-leaderboard', args=[self.quiz.id])
+        self.client = APIClient()
+
+    def test_rename_changes_top_page_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz.title = 'Fisika Quiz Week 2 (revised)'
+            self.quiz.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['quiz_title'], 'Fisika Quiz Week 2 (revised)')
+
+    def test_other_pages_are_cached_per_version(self):
+        user = User.objects.create(username='student0')
+        now = timezone.now()
+        session = QuizSession.objects.create(
+            user=user, quiz=self.quiz, score=70,
+            user_start=now - timedelta(minutes=10), user_end=now,
+        )
+        page = {'offset': 1, 'limit': 10}
+
+        with mock.patch('api.leaderboards.build_quiz_leaderboard', wraps=build_quiz_leaderboard) as build:
+            response = self.client.get(self.url, page)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertEqual(self.client.get(self.url, page, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(self.url, page).json(), response.json())
+            self.assertEqual(build.call_count, 1)
+
+            faster = QuizSession.objects.create(
+                user=User.objects.create(username='student1'), quiz=self.quiz, score=90,
+                user_start=now - timedelta(minutes=10), user_end=now,
+            )
+            publish_quiz_sessions([faster])
+
+            response = self.client.get(self.url, page, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual([row['session_id'] for row in response.json()['leaderboard']], [session.id])
+            self.assertEqual(build.call_count, 2)
+
+
+class IngestQuizSessionsTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.quiz = Quiz.objects.create(
+            title='Biologi Quiz Week 1',
+            bidang=Bidang.BIO,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        self.users = User.objects.bulk_create(
+            [User(username=f'student{i}') for i in range(2)]
+        )
+        self.user_start = now - timedelta(hours=1)
+        QuizSession.objects.create(
+            user=self.users[0], quiz=self.quiz, score=50,
+            user_start=self.user_start, user_end=self.user_start + timedelta(minutes=5),
+        )
+
+    def unchecked_sessions(self, rows, received_at=None):
+        """Validation that misses the committed session, like a racing upload"""
+        return [
+            (index, QuizSession(
+                user=user, quiz=self.quiz, score=90, duration=600,
+                user_start=self.user_start, user_end=self.user_start + timedelta(minutes=10),
+            ))
+            for index, user in enumerate(self.users)
+        ], {}
+
+    def test_persistent_conflict_is_reported_per_row(self):
+        with mock.patch('api.submissions.validate_quiz_sessions', side_effect=self.unchecked_sessions) as validate:
+            created, errors = ingest_quiz_sessions([{}, {}])
+
+        self.assertEqual(validate.call_count, MAX_INGEST_ATTEMPTS)
+        self.assertEqual([index for index, _ in created], [1])
+        self.assertEqual(errors, [{'index': 0, 'errors': {NON_FIELD_ERRORS: [DUPLICATE_ATTEMPT_ERROR]}}])
+        self.assertEqual(
+            QuizSession.objects.get(user=self.users[0], quiz=self.quiz).score, 50
+        )
+        self.assertTrue(QuizSession.objects.filter(user=self.users[1], quiz=self.quiz).exists())
+
+
+class QuizSessionKeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        quiz = Quiz.objects.create(
+            title='Informatika Quiz Week 1',
+            bidang=Bidang.INF,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        users = User.objects.bulk_create([User(username=f'student{i}') for i in range(8)])
+        user_start = now - timedelta(hours=1)
+        # Pairs of sessions end at the same moment, so pages split ties
+        QuizSession.objects.bulk_create([
+            QuizSession(
+                user=user, quiz=quiz, score=50, duration=60,
+                user_start=user_start, user_end=user_start + timedelta(minutes=i // 2),
+            )
+            for i, user in enumerate(users)
+        ])
+        cls.url = reverse('quiz-session-list-create')
+        cls.expected_ids = list(
+            QuizSession.objects.order_by('-user_end', '-id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def page_ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_next_links_walk_every_session_once_in_order(self):
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertIsNone(response.data['previous'])
+        self.assertNotIn('count', response.data)
+
+        pages = [self.page_ids(response)]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(self.page_ids(response))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([pk for page in pages for pk in page], self.expected_ids)
+
+    def test_previous_links_return_the_same_pages(self):
+        response = self.client.get(self.url, {'page_size': 3})
+        pages = [self.page_ids(response)]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(self.page_ids(response))
+
+        backwards = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            backwards.append(self.page_ids(response))
+
+        self.assertEqual(backwards, pages[-2::-1])
+        self.assertIsNone(response.data['previous'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('not-a-cursor', 'WyJub3QgYSBkYXRlIiwgMSwgMF0='):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_page_parameter_falls_back_to_page_numbers(self):
+        response = self.client.get(self.url, {'page': 2, 'page_size': 3})
+        self.assertEqual(response.data['count'], len(self.expected_ids))
+        self.assertEqual(self.page_ids(response), self.expected_ids[3:6])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN plans are PostgreSQL specific')
+class QuizSessionIndexPlanTests(TestCase):
+    """
+    Check that the hot leaderboard queries are served by the composite indexes.
+
+    Sequential and bitmap scans are disabled so the planner picks an index even
+    on a tiny test table. For covering queries plain index scans are disabled
+    too, which leaves an index-only scan as the only cheap plan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        quiz = Quiz.objects.create(
+            title='Fisika Quiz Week 1',
+            bidang=Bidang.FIS,
+            start_date=now - timedelta(hours=2),
+            end_date=now + timedelta(hours=2),
+        )
+        users = User.objects.bulk_create([User(username=f'student{i}') for i in range(50)])
+        user_start = now - timedelta(hours=1)
+        QuizSession.objects.bulk_create([
+            QuizSession(
+                user=user, quiz=quiz, score=i % 100, duration=60 + i,
+                user_start=user_start, user_end=user_start + timedelta(seconds=60 + i),
+            )
+            for i, user in enumerate(users)
+        ])
+        cls.quiz = quiz
+
+    def disable_scans(self, *scan_types):
+        with connection.cursor() as cursor:
+            for scan_type in ('seqscan', 'bitmapscan') + scan_types:
+                cursor.execute(f'SET LOCAL enable_{scan_type} = off')
+
+    def test_quiz_leaderboard_uses_rank_index(self):
+        self.disable_scans()
+        plan = (
+            QuizSession.objects
+            .filter(quiz_id=self.quiz.id)
+            .order_by('-score', 'duration')[:20]
+            .explain()
+        )
+        self.assertIn('api_qs_quiz_rank_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_rank_counts_are_index_only(self):
+        self.disable_scans('indexscan')
+        plan = (
+            QuizSession.objects
+            .filter(quiz_id=self.quiz.id, score=50, duration__lt=100)
+            .values_list('id', 'score', 'duration')
+            .explain()
+        )
+        self.assertIn('Index Only Scan using api_qs_quiz_rank_idx', plan)
+
+    def test_subject_aggregation_is_index_only(self):
+        self.disable_scans('indexscan')
+        plan = (
+            QuizSession.objects
+            .filter(bidang=Bidang.FIS)
+            .values('user_id', 'bidang')
+            .annotate(total_score=Sum('score'), quiz_count=Count('id'), total_duration=Sum('duration'))
+            .order_by()
+            .explain()
+        )
+        self.assertIn('Index Only Scan using api_qs_bidang_user_idx', plan)
+
+    def test_session_list_uses_user_end_index(self):
+        self.disable_scans()
+        plan = QuizSession.objects.order_by('-user_end', '-id')[:20].explain()
+        self.assertIn('api_qs_user_end_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_session_list_keyset_page_uses_user_end_index(self):
+        self.disable_scans()
+        last = QuizSession.objects.order_by('-user_end', '-id')[10]
+        plan = (
+            QuizSession.objects
+            .filter(
+                Q(user_end__lt=last.user_end) | Q(user_end=last.user_end, id__lt=last.id),
+                user_end__lte=last.user_end,
+            )
+            .order_by('-user_end', '-id')[:20]
+            .explain()
+        )
+        self.assertIn('api_qs_user_end_id_idx', plan)
+        self.assertNotIn('Sort', plan)
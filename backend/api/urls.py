@@ -1,12 +1,14 @@
 from django.urls import path
 from .views import (
     QuizListView, QuizDetailView,
-    QuizSessionListCreateView, QuizSessionDetailView,
+    QuizSessionListCreateView, QuizSessionDetailView, quiz_session_batch_create_view,
+    quiz_session_ticket_view,
     subject_leaderboard_view, quiz_leaderboard_view, user_quiz_performance_view
 )
 from .optimized_views import (
     optimized_subject_leaderboard_view, optimized_quiz_leaderboard_view,
-    optimized_user_quiz_performance_view
+    optimized_user_quiz_performance_view, optimized_user_quiz_around_me_view,
+    optimized_bulk_user_rank_view, cache_stats_view
 )
 
 urlpatterns = [
@@ -14,6 +16,8 @@ urlpatterns = [
     path('quizzes/', QuizListView.as_view(), name='quiz-list'),
     path('quizzes/<int:pk>/', QuizDetailView.as_view(), name='quiz-detail'),
     path('quiz-sessions/', QuizSessionListCreateView.as_view(), name='quiz-session-list-create'),
+    path('quiz-sessions/batch/', quiz_session_batch_create_view, name='quiz-session-batch-create'),
+    path('quiz-sessions/tickets/<str:ticket>/', quiz_session_ticket_view, name='quiz-session-ticket'),
     path('quiz-sessions/<int:pk>/', QuizSessionDetailView.as_view(), name='quiz-session-detail'),
     path('leaderboard/subject/', subject_leaderboard_view, name='subject-leaderboard'),
     path('leaderboard/quiz/<int:pk>/', quiz_leaderboard_view, name='quiz-leaderboard'),
@@ -23,4 +27,7 @@ urlpatterns = [
     path('cached/leaderboard/subject/', optimized_subject_leaderboard_view, name='optimized-subject-leaderboard'),
     path('cached/leaderboard/quiz/<int:pk>/', optimized_quiz_leaderboard_view, name='optimized-quiz-leaderboard'),
     path('cached/leaderboard/quiz/<int:pk>/user-performance/', optimized_user_quiz_performance_view, name='optimized-user-quiz-performance'),
+    path('cached/leaderboard/quiz/<int:pk>/around-me/', optimized_user_quiz_around_me_view, name='optimized-user-quiz-around-me'),
+    path('cached/leaderboard/quiz/<int:pk>/ranks/', optimized_bulk_user_rank_view, name='optimized-bulk-user-rank'),
+    path('cached/stats/', cache_stats_view, name='cache-stats'),
 ]
\ No newline at end of file
@@ -1,20 +1,27 @@
+import base64
+import json
+import logging
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Sum, Count, Avg
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q, Sum, Count, Avg
 from .models import Quiz, QuizSession, Bidang
 from .serializers import (
-    QuizSerializer, QuizSessionSerializer, QuizSessionCreateSerializer,
+    QuizSerializer, QuizSessionSerializer, QuizSessionCreateSerializer, QuizSessionBatchItemSerializer,
     SubjectLeaderboardSerializer, QuizLeaderboardSerializer
 )
-from caching.utils import (
-    invalidate_leaderboard_caches, 
-    invalidate_quiz_leaderboard_cache,
-    invalidate_quiz_leaderboard_by_user_cache,
-)
-from websocket.utils import websocket_notifier
+from .submissions import MAX_BATCH_SIZE, ingest_quiz_sessions, publish_quiz_session
+from .post_commit import run_after_commit
+from .submission_queue import submission_queue
+
+logger = logging.getLogger(__name__)
 
 class StandardResultsSetPagination(PageNumberPagination):
     """
@@ -25,6 +32,111 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class QuizSessionKeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination for quiz sessions ordered by (-user_end, -id).
+
+    Each page is a range scan on the (user_end, id) index that starts right
+    after the previous page, so deep pages cost the same as the first one and
+    no COUNT(*) is issued.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        user_end, pk, reverse = self.decode_cursor(request)
+
+        if user_end is None:
+            queryset = queryset.order_by('-user_end', '-id')
+        elif reverse:
+            queryset = queryset.filter(
+                Q(user_end__gt=user_end) | Q(user_end=user_end, id__gt=pk),
+                user_end__gte=user_end,
+            ).order_by('user_end', 'id')
+        else:
+            queryset = queryset.filter(
+                Q(user_end__lt=user_end) | Q(user_end=user_end, id__lt=pk),
+                user_end__lte=user_end,
+            ).order_by('-user_end', '-id')
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = None
+        self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = results[-1]
+            if (has_more and reverse) or (user_end is not None and not reverse):
+                self.previous_position = results[0]
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, None, False
+        try:
+            user_end, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            user_end = parse_datetime(user_end)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if user_end is None:
+            raise NotFound(self.invalid_cursor_message)
+        return user_end, pk, bool(reverse)
+
+    def encode_cursor(self, session, reverse):
+        payload = json.dumps([session.user_end.isoformat(), session.id, int(reverse)])
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
 class QuizListView(generics.ListAPIView):
     """
     Get list of all quizzes with pagination
@@ -94,9 +206,24 @@ class QuizDetailView(generics.RetrieveAPIView):
 class QuizSessionListCreateView(generics.ListCreateAPIView):
     """
     Get list of all quiz sessions or create a new one with pagination
+
+    Listing uses keyset pagination by default; pass `page` to opt in to
+    page-number pagination with a total count.
+
+    When QUIZ_SESSION_SUBMISSION_MODE is "queue", creating only queues the
+    submission and returns 202 with a ticket to poll.
     """
     queryset = QuizSession.objects.all()
-    pagination_class = StandardResultsSetPagination
+    pagination_class = QuizSessionKeysetPagination
+    
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if 'page' in self.request.query_params:
+                self._paginator = StandardResultsSetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -116,40 +243,91 @@ class QuizSessionListCreateView(generics.ListCreateAPIView):
         
         bidang = self.request.query_params.get('bidang')
         if bidang:
-            queryset = queryset.filter(quiz__bidang=bidang)
+            queryset = queryset.filter(bidang=bidang)
         
-        return queryset.order_by('-user_end')
+        return queryset.order_by('-user_end', '-id')
+    
+    def create(self, request, *args, **kwargs):
+        if settings.QUIZ_SESSION_SUBMISSION_MODE == 'queue':
+            response = self.enqueue(request)
+            if response is not None:
+                return response
+        return super().create(request, *args, **kwargs)
+    
+    def enqueue(self, request):
+        """
+        Queue a submission for the drain_submissions workers.
+        
+        Returns None when the queue is unavailable so the session is created
+        synchronously instead.
+        """
+        serializer = QuizSessionBatchItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            ticket = submission_queue.enqueue(dict(serializer.data))
+        except Exception as e:
+            logger.error(f"Failed to queue quiz session, creating it synchronously: {e}")
+            return None
+        
+        return Response({
+            'ticket': ticket,
+            'status': 'queued',
+            'status_url': request.build_absolute_uri(reverse('quiz-session-ticket', args=[ticket])),
+        }, status=202)
     
     def perform_create(self, serializer):
         """
-        Override to invalidate relevant caches and send WebSocket notifications 
-        when a new quiz session is created
+        Override to update cached leaderboards and send WebSocket notifications 
+        once the new quiz session is committed, without holding up the response
         """
         instance = serializer.save()
-        
-        invalidate_leaderboard_caches(instance.quiz.bidang)
-        invalidate_quiz_leaderboard_cache(instance.quiz.id)
-        invalidate_quiz_leaderboard_by_user_cache(instance.quiz.id, instance.user.id)
-        
-        quiz_session_data = {
-            'session_id': instance.id,
-            'user_id': instance.user.id,
-            'quiz_id': instance.quiz.id,
-            'score': instance.score,
-            'timestamp': timezone.now().isoformat()
-        }
-        websocket_notifier.send_quiz_session_uploaded(quiz_session_data)
+        run_after_commit(publish_quiz_session, instance)
 
-        timestamp = timezone.now().isoformat()
-        
-        leaderboard_data = {
-            'update_type': 'quiz_session_added',
-            'bidang': instance.quiz.bidang,
-            'quiz_id': instance.quiz.id,
-            'timestamp': timestamp
-        }
-        websocket_notifier.send_leaderboard_updated(leaderboard_data)
-        websocket_notifier.send_quiz_leaderboard_updated(instance.quiz.id, timestamp)
+@api_view(['POST'])
+def quiz_session_batch_create_view(request):
+    """
+    Upload many quiz sessions at once
+
+    Expects a list of `{user, quiz, score, user_start, user_end}` rows. Valid
+    rows are inserted together; invalid rows are reported by index and do not
+    fail the rest of the batch.
+    """
+    rows = request.data
+    if not isinstance(rows, list) or not rows:
+        return Response({'error': 'Request body must be a non-empty list of quiz sessions'}, status=400)
+    if len(rows) > MAX_BATCH_SIZE:
+        return Response({'error': f'At most {MAX_BATCH_SIZE} quiz sessions are allowed per batch'}, status=400)
+    
+    created, errors = ingest_quiz_sessions(rows)
+    
+    return Response({
+        'created_count': len(created),
+        'error_count': len(errors),
+        'created': [
+            {'index': index, 'id': session.id, 'duration': session.duration}
+            for index, session in created
+        ],
+        'errors': errors,
+    }, status=201 if created else 400)
+
+@api_view(['GET'])
+def quiz_session_ticket_view(request, ticket):
+    """
+    Status of a queued quiz session submission
+
+    `status` is `queued` until a drain_submissions worker has processed it,
+    then `created` with the `session_id`, or `rejected` with the validation
+    `errors`.
+    """
+    try:
+        ticket_status = submission_queue.ticket_status(ticket)
+    except Exception as e:
+        logger.error(f"Failed to read submission ticket {ticket}: {e}")
+        return Response({'error': 'Ticket status is temporarily unavailable'}, status=503)
+    
+    if ticket_status is None:
+        return Response({'error': 'Ticket not found'}, status=404)
+    return Response(ticket_status)
 
 class QuizSessionDetailView(generics.RetrieveAPIView):
     """
@@ -169,10 +347,10 @@ def subject_leaderboard_view(request):
     base_queryset = QuizSession.objects.select_related('user', 'quiz')
     
     if bidang:
-        base_queryset = base_queryset.filter(quiz__bidang=bidang)
+        base_queryset = base_queryset.filter(bidang=bidang)
         
         aggregated_data = base_queryset.values(
-            'user_id', 'user__username', 'quiz__bidang'
+            'user_id', 'user__username', 'bidang'
         ).annotate(
             total_score=Sum('score'),
             quiz_count=Count('id'),
@@ -186,8 +364,8 @@ def subject_leaderboard_view(request):
             leaderboard_data.append({
                 'user_id': item['user_id'],
                 'username': item['user__username'],
-                'bidang': item['quiz__bidang'],
-                'bidang_name': dict(Bidang.choices)[item['quiz__bidang']],
+                'bidang': item['bidang'],
+                'bidang_name': dict(Bidang.choices)[item['bidang']],
                 'total_score': item['total_score'],
                 'quiz_count': item['quiz_count'],
                 'average_score': round(item['average_score'], 2) if item['average_score'] else 0,
@@ -212,8 +390,8 @@ def subject_leaderboard_view(request):
             bidang_code = bidang_choice[0]
             bidang_name = bidang_choice[1]
             
-            subject_data = base_queryset.filter(quiz__bidang=bidang_code).values(
-                'user_id', 'user__username', 'quiz__bidang'
+            subject_data = base_queryset.filter(bidang=bidang_code).values(
+                'user_id', 'user__username', 'bidang'
             ).annotate(
                 total_score=Sum('score'),
                 quiz_count=Count('id'),
@@ -227,7 +405,7 @@ def subject_leaderboard_view(request):
                 formatted_data.append({
                     'user_id': item['user_id'],
                     'username': item['user__username'],
-                    'bidang': item['quiz__bidang'],
+                    'bidang': item['bidang'],
                     'bidang_name': bidang_name,
                     'total_score': item['total_score'],
                     'quiz_count': item['quiz_count'],
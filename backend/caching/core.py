@@ -6,16 +6,248 @@ all Django apps in the project.
 """
 
 import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
 from typing import Any, Optional, List
 import logging
 
 logger = logging.getLogger(__name__)
 
+# How long one caller may hold the right to recompute a key
+DEFAULT_LOCK_TIMEOUT = 10
+# How often callers waiting on another process's recomputation poll for it
+LOCK_POLL_INTERVAL = 0.05
+# How long the in-process tier stays off after failing to subscribe to invalidations
+SUBSCRIBE_RETRY_INTERVAL = 30
+# Generation counters expire when unused so Redis may evict them like any
+# other cache entry; reading or bumping one extends it
+GENERATION_TTL = 60 * 60 * 24
+
+_MISSING = object()
+
+_stats = {}
+_stats_lock = threading.Lock()
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+def _count(cache_alias: str, counter: str):
+    with _stats_lock:
+        _stats.setdefault(cache_alias, Counter())[counter] += 1
+
+
+def cache_stats() -> dict:
+    """
+    Hit/miss counters per cache alias and tier for this process.
+    
+    Returns:
+        Dict of alias -> counters, with the in-process tier's size when enabled
+    """
+    with _stats_lock:
+        stats = {alias: dict(counters) for alias, counters in _stats.items()}
+    with _local_caches_lock:
+        local_caches = dict(_local_caches)
+    for alias, local_cache in local_caches.items():
+        if local_cache is not None:
+            stats.setdefault(alias, {}).update(local_cache.info())
+    return stats
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU used as the first tier in front of a Redis cache.
+    
+    Entries are dropped when they expire, when the entry or byte limit is
+    exceeded, or when any process publishes an invalidation for their key.
+    Values are shared between callers and must not be mutated.
+    """
+    
+    def __init__(self, cache_alias: str, max_entries: int, max_bytes: int, timeout: float):
+        self.cache_alias = cache_alias
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.channel = f"cache-invalidation:{cache_alias}"
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._subscriber = None
+        self._subscriber_pid = None
+        self._sender_id = None
+        self._retry_subscribe_at = 0
+    
+    @property
+    def generation(self) -> int:
+        """Changes on every invalidation; see set()"""
+        return self._generation
+    
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any, timeout: Optional[float] = None, generation: Optional[int] = None):
+        """
+        Store a value for at most the tier's timeout.
+        
+        If `generation` is given and an invalidation arrived since it was read,
+        the value may already be outdated and is not stored.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        try:
+            size = len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return
+        
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._remove(key)
+            if timeout <= 0 or size > self.max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic() + timeout, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def delete_many(self, keys: List[str]):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._remove(key)
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+    
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+    
+    def info(self) -> dict:
+        with self._lock:
+            return {'l1_entries': len(self._entries), 'l1_bytes': self._bytes}
+    
+    def ensure_subscribed(self) -> bool:
+        """
+        Start listening for invalidations from other processes.
+        
+        Returns:
+            True if invalidations are being received and the tier can be used
+        """
+        pid = os.getpid()
+        if self._subscriber_pid == pid:
+            return True
+        
+        if time.monotonic() < self._retry_subscribe_at:
+            return False
+        
+        with self._lock:
+            if self._subscriber_pid == pid:
+                return True
+            try:
+                from django_redis import get_redis_connection
+                pubsub = get_redis_connection(self.cache_alias).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._on_message})
+                self._subscriber = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=self._on_subscriber_error
+                )
+            except Exception as e:
+                logger.error(f"Could not subscribe to {self.channel}, local cache disabled: {e}")
+                self._retry_subscribe_at = time.monotonic() + SUBSCRIBE_RETRY_INTERVAL
+                return False
+            # A forked child inherits the parent's entries but not its subscriber
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._sender_id = uuid.uuid4().hex
+            self._subscriber_pid = pid
+            return True
+    
+    def publish(self, keys: Optional[List[str]] = None):
+        """
+        Tell other processes to drop keys, or everything when keys is None.
+        """
+        try:
+            from django_redis import get_redis_connection
+            get_redis_connection(self.cache_alias).publish(
+                self.channel, json.dumps({'sender': self._sender_id, 'keys': keys})
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation on {self.channel}: {e}")
+    
+    def _on_message(self, message):
+        try:
+            payload = json.loads(message['data'])
+        except (TypeError, ValueError):
+            self.clear()
+            return
+        if payload.get('sender') == self._sender_id:
+            return
+        if payload.get('keys') is None:
+            self.clear()
+        else:
+            self.delete_many(payload['keys'])
+    
+    def _on_subscriber_error(self, error, pubsub, thread):
+        """
+        Disable the tier until ensure_subscribed() subscribes again.
+        
+        Invalidations may have been missed while disconnected, so the entries
+        are dropped and the broken subscriber is stopped rather than retried.
+        """
+        logger.error(f"Cache invalidation subscriber error on {self.channel}, local cache disabled: {error}")
+        with self._lock:
+            if self._subscriber is thread:
+                self._subscriber = None
+                self._subscriber_pid = None
+                self._retry_subscribe_at = time.monotonic() + SUBSCRIBE_RETRY_INTERVAL
+        thread.stop()
+        self.clear()
+
+
+def get_local_cache(cache_alias: str) -> Optional[LocalCache]:
+    """
+    Shared in-process tier for a cache alias, or None if LOCAL_CACHES does not enable one.
+    """
+    with _local_caches_lock:
+        if cache_alias not in _local_caches:
+            from django.conf import settings
+            config = getattr(settings, 'LOCAL_CACHES', {}).get(cache_alias)
+            _local_caches[cache_alias] = LocalCache(
+                cache_alias,
+                max_entries=config.get('MAX_ENTRIES', 1000),
+                max_bytes=config.get('MAX_BYTES', 16 * 1024 * 1024),
+                timeout=config.get('TIMEOUT', 5),
+            ) if config else None
+        return _local_caches[cache_alias]
+
+
 class CacheManager:
     def __init__(self, cache_alias: str = 'default'):
         """
         Initialize cache manager with specific cache backend.
         
+        Aliases listed in the LOCAL_CACHES setting get an in-process LRU tier
+        in front of Redis, kept coherent across processes over pub/sub.
+        
         Args:
             cache_alias: Which cache alias to use (from CACHES setting)
         """
@@ -26,6 +258,32 @@ class CacheManager:
         except Exception:
             from django.core.cache import cache as default_cache
             self._cache = default_cache
+        self._local = get_local_cache(cache_alias)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+    
+    @property
+    def local(self) -> Optional[LocalCache]:
+        """In-process tier, or None when it is disabled or not receiving invalidations"""
+        if self._local is not None and self._local.ensure_subscribed():
+            return self._local
+        return None
+    
+    def _local_timeout(self, value: Any) -> Optional[float]:
+        # Values stored by get_or_set are only kept locally while they are fresh
+        if isinstance(value, dict) and 'stale_timeout' in value:
+            return value['fresh_until'] - time.time()
+        return None
+    
+    def _invalidate_local(self, keys: Optional[List[str]] = None):
+        local = self.local
+        if local is None:
+            return
+        if keys is None:
+            local.clear()
+        else:
+            local.delete_many(keys)
+        local.publish(keys)
     
     def get(self, key: str, default: Any = None) -> Any:
         """
@@ -38,11 +296,28 @@ class CacheManager:
         Returns:
             Cached value or default
         """
+        local = self.local
+        if local is not None:
+            value = local.get(key)
+            if value is not _MISSING:
+                _count(self.cache_alias, 'l1_hits')
+                return value
+            _count(self.cache_alias, 'l1_misses')
+            generation = local.generation
+        
         try:
-            return self._cache.get(key, default)
+            value = self._cache.get(key, _MISSING)
         except Exception as e:
             logger.error(f"Cache get error for key '{key}': {e}")
             return default
+        
+        if value is _MISSING:
+            _count(self.cache_alias, 'l2_misses')
+            return default
+        _count(self.cache_alias, 'l2_hits')
+        if local is not None:
+            local.set(key, value, self._local_timeout(value), generation)
+        return value
     
     def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
         """
@@ -58,6 +333,7 @@ class CacheManager:
         """
         try:
             self._cache.set(key, value, timeout)
+            self._invalidate_local([key])
             return True
         except Exception as e:
             logger.error(f"Cache set error for key '{key}': {e}")
@@ -75,6 +351,7 @@ class CacheManager:
         """
         try:
             self._cache.delete(key)
+            self._invalidate_local([key])
             return True
         except Exception as e:
             logger.error(f"Cache delete error for key '{key}': {e}")
@@ -92,6 +369,7 @@ class CacheManager:
         """
         try:
             self._cache.delete_many(keys)
+            self._invalidate_local(list(keys))
             return True
         except Exception as e:
             logger.error(f"Cache delete_many error for keys {keys}: {e}")
@@ -106,75 +384,378 @@ class CacheManager:
         """
         try:
             self._cache.clear()
+            self._invalidate_local()
             return True
         except Exception as e:
             logger.error(f"Cache clear error: {e}")
             return False
     
-    def get_or_set(self, key: str, callable_func, timeout: Optional[int] = None) -> Any:
+    def get_or_set(
+        self,
+        key: str,
+        callable_func,
+        timeout: Optional[int] = None,
+        stale_timeout: int = 0,
+        lock_timeout: int = DEFAULT_LOCK_TIMEOUT,
+        stale_key: Optional[str] = None,
+    ) -> Any:
         """
         Get value from cache or set it using callable if not found.
         
+        Concurrent misses for the same key are collapsed: threads of this
+        process share one computation, and across processes only the caller
+        holding the key's lock computes while the others wait for its result.
+        A value older than `timeout` but within `stale_timeout` after it is
+        still returned to everyone except the one caller that refreshes it.
+        
+        Keys that embed a generation (see bump_generations) start out missing
+        after every bump; pass the unversioned key as `stale_key` to keep the
+        last computed value around to serve while the new one is computed.
+        
         Args:
             key: Cache key
             callable_func: Function to call if cache miss
-            timeout: Cache timeout in seconds
+            timeout: Seconds the value is fresh
+            stale_timeout: Extra seconds a stale value may be served while it is refreshed
+            lock_timeout: Seconds one caller may spend recomputing before others take over
+            stale_key: Key holding the last computed value of any generation
             
         Returns:
             Cached or newly computed value
         """
+        if timeout is None:
+            timeout = self._cache.default_timeout
+        
+        envelope = self._get_envelope(key)
+        if envelope is not None and envelope['fresh_until'] > time.time():
+            return envelope['value']
+        if envelope is None and stale_key is not None:
+            envelope = self._get_envelope(stale_key)
+        
+        store = self._store_for(key, timeout, stale_timeout, stale_key)
+        return self._single_flight(
+            key,
+            lambda: self._recompute(key, callable_func, store, lock_timeout, envelope),
+        )
+    
+    def fresh_for(self, key: str) -> Optional[float]:
+        """
+        Seconds until a value stored by get_or_set goes stale.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            Remaining seconds (negative once stale), or None if not cached
+        """
+        envelope = self._get_envelope(key, local=False)
+        if envelope is None:
+            return None
+        return envelope['fresh_until'] - time.time()
+    
+    def refresh(
+        self,
+        key: str,
+        callable_func,
+        timeout: Optional[int] = None,
+        stale_timeout: int = 0,
+        lock_timeout: int = DEFAULT_LOCK_TIMEOUT,
+        stale_key: Optional[str] = None,
+    ) -> bool:
+        """
+        Recompute a value served by get_or_set before it goes stale.
+        
+        Takes the same arguments as get_or_set. Nothing is computed if
+        another caller already holds the key's lock.
+        
+        Returns:
+            True if the value was recomputed and stored, False otherwise
+        """
+        if timeout is None:
+            timeout = self._cache.default_timeout
+        
+        lock_key = f"{key}:lock"
         try:
-            value = self._cache.get(key)
-            if value is None:
-                value = callable_func()
-                self._cache.set(key, value, timeout)
+            if not self._cache.add(lock_key, 1, lock_timeout):
+                return False
+        except Exception as e:
+            logger.error(f"Cache lock error for key '{key}': {e}")
+            return False
+        
+        try:
+            self._store_for(key, timeout, stale_timeout, stale_key)(callable_func())
+            return True
+        finally:
+            self.delete(lock_key)
+    
+    def peek(self, key: str, default: Any = None) -> Any:
+        """
+        Get a value stored by get_or_set, fresh or stale, without computing it.
+
+        Args:
+            key: Cache key
+            default: Default value if key not found
+
+        Returns:
+            Cached value or default
+        """
+        envelope = self._get_envelope(key)
+        if envelope is None:
+            return default
+        return envelope['value']
+
+    def expire(self, key: str) -> bool:
+        """
+        Mark a value stored by get_or_set as stale without deleting it.
+        
+        Readers keep getting the stale value while exactly one of them
+        recomputes it; values stored without a stale period are deleted.
+        
+        Args:
+            key: Cache key to expire
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        return self.expire_many([key])
+    
+    def expire_many(self, keys: List[str]) -> bool:
+        """
+        Mark several values stale (see expire) in two round trips.
+        
+        All envelopes are read with one MGET and rewritten or deleted in one
+        pipeline, however many keys there are.
+        
+        Args:
+            keys: Cache keys to expire
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            envelopes = self._cache.get_many(keys)
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                envelope = envelopes.get(key)
+                stale_for = 0
+                if isinstance(envelope, dict) and 'stale_timeout' in envelope:
+                    stale_for = int(min(envelope['stale_until'] - now, envelope['stale_timeout']))
+                redis_key = self._cache.make_key(key)
+                if stale_for <= 0:
+                    pipe.delete(redis_key)
+                else:
+                    envelope['fresh_until'] = 0
+                    envelope['stale_until'] = now + stale_for
+                    pipe.set(redis_key, self._cache.client.encode(envelope), ex=stale_for)
+            pipe.execute()
+            self._invalidate_local(list(keys))
+            return True
+        except Exception as e:
+            logger.error(f"Cache expire error for keys {keys}: {e}")
+            return False
+    
+    def _get_envelope(self, key: str, local: bool = True) -> Optional[dict]:
+        envelope = self.get(key) if local else self._cache.get(key)
+        if isinstance(envelope, dict) and 'stale_timeout' in envelope:
+            return envelope
+        return None
+    
+    def _set_envelope(self, key: str, value: Any, timeout: int, stale_timeout: int):
+        now = time.time()
+        envelope = {
+            'value': value,
+            'fresh_until': now + timeout,
+            'stale_until': now + timeout + stale_timeout,
+            'stale_timeout': stale_timeout,
+        }
+        self.set(key, envelope, timeout + stale_timeout)
+    
+    def _store_for(self, key: str, timeout: int, stale_timeout: int, stale_key: Optional[str]):
+        def store(value):
+            self._set_envelope(key, value, timeout, stale_timeout)
+            if stale_key is not None:
+                self._set_envelope(stale_key, value, 0, timeout + stale_timeout)
+        return store
+    
+    def _single_flight(self, key: str, compute) -> Any:
+        """Run compute once per key at a time in this process and share its result"""
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            value = compute()
+            future.set_result(value)
             return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+    
+    def _recompute(self, key, callable_func, store, lock_timeout, stale_envelope):
+        lock_key = f"{key}:lock"
+        try:
+            acquired = self._cache.add(lock_key, 1, lock_timeout)
+        except Exception as e:
+            logger.error(f"Cache lock error for key '{key}': {e}")
+            acquired = None
+        
+        # None means the cache backend is unavailable, so there is nothing to wait for
+        if acquired or acquired is None:
+            try:
+                value = callable_func()
+                store(value)
+                return value
+            finally:
+                if acquired:
+                    self.delete(lock_key)
+        
+        if stale_envelope is not None:
+            return stale_envelope['value']
+        
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            envelope = self._get_envelope(key)
+            if envelope is not None:
+                return envelope['value']
+        
+        logger.warning(f"Timed out waiting for another process to compute '{key}'")
+        value = callable_func()
+        store(value)
+        return value
+    
+    @property
+    def client(self):
+        """Raw Redis client behind this cache alias"""
+        from django_redis import get_redis_connection
+        return get_redis_connection(self.cache_alias)
+    
+    @staticmethod
+    def _generation_key(namespace: str) -> str:
+        return f"generation:{namespace}"
+    
+    def generations(self, *namespaces: str) -> List[int]:
+        """
+        Current generation of each namespace.
+        
+        Keys built with a namespace's generation are all invalidated at once by
+        bumping it. Generations are seeded from the clock, so a counter lost
+        from Redis never comes back at a value that was already used.
+        
+        Args:
+            *namespaces: Namespaces such as 'quiz:12' or 'bidang:MAT'
+            
+        Returns:
+            List of generations in the same order, all 0 if Redis is unavailable
+        """
+        keys = [self._generation_key(namespace) for namespace in namespaces]
+        values = [None] * len(keys)
+        
+        local = self.local
+        if local is not None:
+            for index, key in enumerate(keys):
+                value = local.get(key)
+                if value is not _MISSING:
+                    values[index] = value
+            local_generation = local.generation
+        
+        missing = [index for index, value in enumerate(values) if value is None]
+        if not missing:
+            _count(self.cache_alias, 'generation_l1_hits')
+            return values
+        
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            seed = int(time.time() * 1000)
+            for index in missing:
+                redis_key = self._cache.make_key(keys[index])
+                pipe.set(redis_key, seed, nx=True, ex=GENERATION_TTL)
+                pipe.getex(redis_key, ex=GENERATION_TTL)
+            results = pipe.execute()
         except Exception as e:
-            logger.error(f"Cache get_or_set error for key '{key}': {e}")
-            return callable_func()
+            logger.error(f"Cache generation read error for {namespaces}: {e}")
+            return [0] * len(keys)
+        
+        for position, index in enumerate(missing):
+            values[index] = int(results[position * 2 + 1])
+            if local is not None:
+                local.set(keys[index], values[index], None, local_generation)
+        return values
     
-    def invalidate_pattern(self, pattern: str) -> bool:
+    def bump_generations(self, *namespaces: str) -> bool:
         """
-        Invalidate all cache keys matching a pattern.
+        Invalidate every key built with these namespaces' generations.
+        
+        One pipelined INCR per namespace, however many keys were derived;
+        orphaned keys age out under their TTL.
         
         Args:
-            pattern: Pattern to match (e.g., "user_*", "*leaderboard*")
+            *namespaces: Namespaces to bump
             
         Returns:
             True if successful, False otherwise
         """
+        keys = [self._generation_key(namespace) for namespace in namespaces]
         try:
-            keys = self._cache.keys(f"*{pattern}*")
-            if keys:
-                self._cache.delete_many(keys)
+            pipe = self.client.pipeline(transaction=False)
+            seed = int(time.time() * 1000)
+            for key in keys:
+                redis_key = self._cache.make_key(key)
+                pipe.set(redis_key, seed, nx=True)
+                pipe.incr(redis_key)
+                pipe.expire(redis_key, GENERATION_TTL)
+            pipe.execute()
+            self._invalidate_local(keys)
             return True
         except Exception as e:
-            logger.error(f"Cache pattern invalidation error for pattern '{pattern}': {e}")
+            logger.error(f"Cache generation bump error for {namespaces}: {e}")
             return False
 
-def invalidate_cache(*patterns: str, cache_alias: str = 'default'):
+def invalidate_cache(*namespaces: str, cache_alias: str = 'default'):
     """
-    Decorator to invalidate cache patterns after function execution.
+    Decorator to invalidate generation namespaces after function execution.
+    
+    Namespaces may refer to the function's arguments by name. Every key built
+    with their generations (see CacheManager.generations) is invalidated by
+    one pipelined INCR, without looking for the keys themselves.
     
     Args:
-        *patterns: Cache patterns to invalidate
+        *namespaces: Generation namespaces to bump
         cache_alias: Cache backend alias
         
     Usage:
-        @invalidate_cache('user_*', 'leaderboard_*')
-        def update_user_score(user_id, score):
+        @invalidate_cache('quiz:{quiz_id}', 'bidang:{bidang}')
+        def update_quiz_scores(quiz_id, bidang):
             # Update logic here
             pass
     """
     def decorator(func):
+        signature = inspect.signature(func)
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
             
-            # Invalidate cache patterns
-            cache_manager = CacheManager(cache_alias)
-            for pattern in patterns:
-                cache_manager.invalidate_pattern(pattern)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            resolved = []
+            for namespace in namespaces:
+                try:
+                    resolved.append(namespace.format_map(bound.arguments))
+                except (KeyError, IndexError, ValueError) as e:
+                    logger.error(f"Could not resolve cache namespace '{namespace}' for {func.__name__}: {e}")
+            if resolved:
+                CacheManager(cache_alias).bump_generations(*resolved)
             
             return result
         return wrapper
@@ -0,0 +1,806 @@
+"""
+Redis sorted-set rank engine for quiz leaderboards.
+
+Every quiz gets one sorted set whose members are quiz session IDs. The member
+score is a composite of the session score (descending) and duration
+(ascending), so ZREVRANGE returns sessions in leaderboard order and a rank
+lookup is a single ZCOUNT instead of several COUNT(*) queries.
+
+Leaderboard rows are kept next to the sorted set in a hash of session ID to
+entry payload. Sessions never change after insert, so these entries never need
+invalidating and any rank range can be served from Redis alone.
+
+Scores are small bounded integers, so each quiz also keeps a histogram of
+score -> number of sessions. A rank is the prefix sum of the buckets above the
+session's score plus the sessions with the same score and a shorter duration,
+which is a range count inside that score's band of the sorted set.
+
+Sessions with the same score and duration share a rank everywhere: in pages,
+windows, rank lookups and the patched top page. Within a tie, rows are still
+listed in sorted set order.
+"""
+
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Durations are folded into the low digits of the composite score. Ten million
+# seconds (~115 days) is far longer than any quiz window.
+DURATION_SPAN = 10_000_000
+
+RANK_KEY_TTL = 60 * 60 * 24
+REBUILD_LOCK_TTL = 30
+REBUILD_CHUNK_SIZE = 5000
+
+# Versions are seeded from the clock so that a version key lost to eviction
+# or expiry never restarts below a version that may still be cached.
+# KEYS: version
+# ARGV: seed (milliseconds since epoch), TTL
+BUMP_VERSION_LUA = """
+local function bump_version(key, seed, ttl)
+    local version = tonumber(seed)
+    if redis.call('EXISTS', key) == 1 then
+        version = redis.call('INCR', key)
+    else
+        redis.call('SET', key, seed)
+    end
+    redis.call('EXPIRE', key, ttl)
+    return version
+end
+"""
+
+# The top page of a quiz is cached as its rendered JSON document. New sessions
+# patch it in place: the entry is inserted if it makes the page, ranks are
+# renumbered and total_participants goes up, all in the same script that adds
+# the session to the sorted set. Rows are ordered like ZREVRANGE, by composite
+# score and then session ID as a string; rows with the same composite score
+# share the rank of the first of them.
+# KEYS: top page
+# ARGV: composite score, session ID, entry payload, duration span, version
+PATCH_TOP_LUA = """
+local function patch_top(key, composite, member, entry, span, version)
+    local body = redis.call('HGET', key, 'body')
+    if not body then
+        return
+    end
+    local function row_composite(row)
+        return row['score'] * span + (span - 1 - math.min(math.max(row['duration'], 0), span - 1))
+    end
+    local doc = cjson.decode(body)
+    local board = doc['leaderboard']
+    local position = #board + 1
+    for index, row in ipairs(board) do
+        local current = row_composite(row)
+        if current < composite or (current == composite and tostring(row['session_id']) < member) then
+            position = index
+            break
+        end
+    end
+    if position <= doc['limit'] then
+        table.insert(board, position, cjson.decode(entry))
+        if #board > doc['limit'] then
+            table.remove(board)
+        end
+        for index, row in ipairs(board) do
+            if index > 1 and row_composite(row) == row_composite(board[index - 1]) then
+                row['rank'] = board[index - 1]['rank']
+            else
+                row['rank'] = doc['offset'] + index
+            end
+        end
+    end
+    doc['total_participants'] = doc['total_participants'] + 1
+    doc['version'] = version
+    redis.call('HSET', key, 'body', cjson.encode(doc), 'version', version)
+end
+"""
+
+# A cached top page is only patched while the sorted set is loaded; otherwise
+# it is dropped together with the set and rebuilt on the next read.
+# Returns {status, version, position, rank, total participants}: status is 1
+# if added to the loaded set, 2 if queued behind a rebuild and 0 if the set is
+# not loaded; version is 0 if the session was already recorded, and position,
+# rank and total are only known for status 1.
+# KEYS: members, entries, histogram, rebuild lock, pending, version, top page
+# ARGV: composite score, session ID, entry payload, score, version seed, duration span, TTL
+ADD_SESSION_SCRIPT = BUMP_VERSION_LUA + PATCH_TOP_LUA + """
+if redis.call('EXISTS', KEYS[1], KEYS[3]) == 2 then
+    local version = 0
+    if redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2]) == 1 then
+        redis.call('HINCRBY', KEYS[3], ARGV[4], 1)
+        version = bump_version(KEYS[6], ARGV[5], ARGV[7])
+        patch_top(KEYS[7], tonumber(ARGV[1]), ARGV[2], ARGV[3], tonumber(ARGV[6]), version)
+    end
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+    -- A busy quiz keeps its set loaded, and the set, histogram and entries
+    -- expire together
+    redis.call('EXPIRE', KEYS[1], ARGV[7])
+    redis.call('EXPIRE', KEYS[2], ARGV[7])
+    redis.call('EXPIRE', KEYS[3], ARGV[7])
+    return {
+        1,
+        version,
+        redis.call('ZREVRANK', KEYS[1], ARGV[2]) + 1,
+        redis.call('ZCOUNT', KEYS[1], '(' .. ARGV[1], '+inf') + 1,
+        redis.call('ZCARD', KEYS[1]),
+    }
+end
+redis.call('DEL', KEYS[7])
+local version = bump_version(KEYS[6], ARGV[5], ARGV[7])
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    redis.call('RPUSH', KEYS[5], cjson.encode(ARGV))
+    redis.call('EXPIRE', KEYS[5], redis.call('TTL', KEYS[4]))
+    return {2, version, 0, 0, 0}
+end
+return {0, version, 0, 0, 0}
+"""
+
+# Cache a freshly built top page unless a session was added while building it.
+# KEYS: top page, version
+# ARGV: body, version the page was built at, TTL
+STORE_TOP_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'body', ARGV[1], 'version', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# The rebuild lock holds a token unique to its holder, so a rebuild whose lock
+# expired cannot extend or release the lock of the one that took over.
+# KEYS: rebuild lock
+# ARGV: token, TTL
+EXTEND_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+
+# KEYS: rebuild lock
+# ARGV: token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+# Swap freshly built keys in and replay sessions added while rebuilding.
+# Nothing is swapped if the rebuild no longer holds the lock.
+# KEYS: members, histogram, new members, new histogram, entries, pending, rebuild lock, top page
+# ARGV: TTL, lock token
+FINISH_REBUILD_SCRIPT = """
+if redis.call('GET', KEYS[7]) ~= ARGV[2] then
+    return false
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[8])
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RENAME', KEYS[3], KEYS[1])
+    redis.call('RENAME', KEYS[4], KEYS[2])
+end
+for _, item in ipairs(redis.call('LRANGE', KEYS[6], 0, -1)) do
+    local args = cjson.decode(item)
+    if redis.call('ZADD', KEYS[1], args[1], args[2]) == 1 then
+        redis.call('HINCRBY', KEYS[2], args[4], 1)
+    end
+    redis.call('HSET', KEYS[5], args[2], args[3])
+end
+redis.call('DEL', KEYS[6], KEYS[7])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[5], ARGV[1])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Editing a quiz changes its rendered pages without adding a session, so the
+# top page is dropped and the version bumped to give the rebuilt page a new
+# ETag and tell clients holding the old page to fetch it again.
+# KEYS: version, top page
+# ARGV: version seed, TTL
+BUMP_VERSION_SCRIPT = BUMP_VERSION_LUA + """
+redis.call('DEL', KEYS[2])
+return bump_version(KEYS[1], ARGV[1], ARGV[2])
+"""
+
+# The rank of the first row is the number of sessions with a higher composite
+# score; the rest follow from the scores inside the range.
+PAGE_SCRIPT = """
+local members = redis.call('ZREVRANGE', KEYS[1], ARGV[1], ARGV[2], 'WITHSCORES')
+local first_rank = 0
+if #members > 0 then
+    first_rank = redis.call('ZCOUNT', KEYS[1], '(' .. members[2], '+inf') + 1
+end
+return {first_rank, redis.call('ZCARD', KEYS[1]), members}
+"""
+
+AROUND_SESSION_SCRIPT = """
+local position = redis.call('ZREVRANK', KEYS[1], ARGV[1])
+if not position then
+    return false
+end
+local radius = tonumber(ARGV[2])
+local start = math.max(position - radius, 0)
+local members = redis.call('ZREVRANGE', KEYS[1], start, position + radius, 'WITHSCORES')
+local first_rank = redis.call('ZCOUNT', KEYS[1], '(' .. members[2], '+inf') + 1
+return {start, first_rank, redis.call('ZCARD', KEYS[1]), members}
+"""
+
+
+class QuizRankEngine:
+    def __init__(self, cache_alias: str = 'leaderboards'):
+        """
+        Initialize rank engine on top of a django-redis cache connection.
+
+        Args:
+            cache_alias: Which cache alias to use (from CACHES setting)
+        """
+        self.cache_alias = cache_alias
+        self._redis = None
+        self._add_session_script = None
+        self._finish_rebuild_script = None
+        self._extend_lock_script = None
+        self._release_lock_script = None
+        self._page_script = None
+        self._around_session_script = None
+        self._store_top_script = None
+        self._bump_version_script = None
+
+    @property
+    def client(self):
+        if self._redis is None:
+            from django_redis import get_redis_connection
+            self._redis = get_redis_connection(self.cache_alias)
+        return self._redis
+
+    @property
+    def add_session_script(self):
+        if self._add_session_script is None:
+            self._add_session_script = self.client.register_script(ADD_SESSION_SCRIPT)
+        return self._add_session_script
+
+    @property
+    def finish_rebuild_script(self):
+        if self._finish_rebuild_script is None:
+            self._finish_rebuild_script = self.client.register_script(FINISH_REBUILD_SCRIPT)
+        return self._finish_rebuild_script
+
+    @property
+    def extend_lock_script(self):
+        if self._extend_lock_script is None:
+            self._extend_lock_script = self.client.register_script(EXTEND_LOCK_SCRIPT)
+        return self._extend_lock_script
+
+    @property
+    def release_lock_script(self):
+        if self._release_lock_script is None:
+            self._release_lock_script = self.client.register_script(RELEASE_LOCK_SCRIPT)
+        return self._release_lock_script
+
+    @property
+    def page_script(self):
+        if self._page_script is None:
+            self._page_script = self.client.register_script(PAGE_SCRIPT)
+        return self._page_script
+
+    @property
+    def around_session_script(self):
+        if self._around_session_script is None:
+            self._around_session_script = self.client.register_script(AROUND_SESSION_SCRIPT)
+        return self._around_session_script
+
+    @property
+    def store_top_script(self):
+        if self._store_top_script is None:
+            self._store_top_script = self.client.register_script(STORE_TOP_SCRIPT)
+        return self._store_top_script
+
+    @property
+    def bump_version_script(self):
+        if self._bump_version_script is None:
+            self._bump_version_script = self.client.register_script(BUMP_VERSION_SCRIPT)
+        return self._bump_version_script
+
+    @staticmethod
+    def composite_score(score: int, duration: int) -> int:
+        """
+        Fold score and duration into a single sortable number.
+
+        Higher scores rank first; for equal scores, shorter durations rank first.
+        """
+        duration = min(max(duration, 0), DURATION_SPAN - 1)
+        return score * DURATION_SPAN + (DURATION_SPAN - 1 - duration)
+
+    @staticmethod
+    def key(quiz_id: int) -> str:
+        return f"rank:quiz:{quiz_id}"
+
+    @staticmethod
+    def entries_key(quiz_id: int) -> str:
+        return f"rank:quiz:{quiz_id}:entries"
+
+    @staticmethod
+    def histogram_key(quiz_id: int) -> str:
+        return f"rank:quiz:{quiz_id}:histogram"
+
+    @staticmethod
+    def version_key(quiz_id: int) -> str:
+        return f"rank:quiz:{quiz_id}:version"
+
+    @staticmethod
+    def top_key(quiz_id: int) -> str:
+        return f"rank:quiz:{quiz_id}:top"
+
+    @staticmethod
+    def percentile(rank: int, total_participants: int) -> float:
+        """
+        Share of participants ranked at or below the given rank, in percent.
+        """
+        if total_participants <= 0:
+            return 0
+        return round((1 - (rank - 1) / total_participants) * 100, 2)
+
+    @staticmethod
+    def session_entry(session) -> dict:
+        """
+        Build the leaderboard row for a quiz session (without its rank).
+
+        Args:
+            session: QuizSession instance with its user loaded
+        """
+        return {
+            'session_id': session.id,
+            'user_id': session.user_id,
+            'username': session.user.username,
+            'score': session.score,
+            'duration': session.duration,
+            'user_start': session.user_start.isoformat() if session.user_start else None,
+            'user_end': session.user_end.isoformat() if session.user_end else None,
+        }
+
+    def rebuild(self, quiz_id: int) -> bool:
+        """
+        Load every session of a quiz from the database into its sorted set
+        and score histogram.
+
+        Only one process rebuilds a given quiz at a time; the others return
+        False and callers fall back to querying the database directly. The
+        lock is extended after every chunk, and a rebuild that lost it anyway
+        gives up instead of swapping in its keys.
+        Sessions added while the rebuild runs are queued and replayed once the
+        new keys are swapped in.
+
+        Args:
+            quiz_id: Quiz ID
+
+        Returns:
+            True if the sorted set is loaded, False otherwise
+        """
+        from api.models import QuizSession
+
+        key = self.key(quiz_id)
+        histogram_key = self.histogram_key(quiz_id)
+        new_key = f"{key}:rebuild:members"
+        new_histogram_key = f"{histogram_key}:rebuild"
+        lock_key = f"{key}:rebuild"
+        token = uuid.uuid4().hex
+        try:
+            if not self.client.set(lock_key, token, nx=True, ex=REBUILD_LOCK_TTL):
+                return False
+            try:
+                self.client.delete(new_key, new_histogram_key)
+                rows = (
+                    QuizSession.objects
+                    .filter(quiz_id=quiz_id)
+                    .values_list('id', 'score', 'duration')
+                    .iterator(chunk_size=REBUILD_CHUNK_SIZE)
+                )
+                histogram = Counter()
+                chunk = {}
+                for session_id, score, duration in rows:
+                    chunk[session_id] = self.composite_score(score, duration)
+                    histogram[score] += 1
+                    if len(chunk) >= REBUILD_CHUNK_SIZE:
+                        self.client.zadd(new_key, chunk)
+                        chunk = {}
+                        if not self.extend_lock_script(keys=[lock_key], args=[token, REBUILD_LOCK_TTL]):
+                            raise RuntimeError("rebuild lock lost")
+                if chunk:
+                    self.client.zadd(new_key, chunk)
+                if histogram:
+                    self.client.hset(new_histogram_key, mapping=histogram)
+
+                loaded = self.finish_rebuild_script(
+                    keys=[
+                        key, histogram_key, new_key, new_histogram_key,
+                        self.entries_key(quiz_id), f"{key}:rebuild:pending", lock_key,
+                        self.top_key(quiz_id),
+                    ],
+                    args=[RANK_KEY_TTL, token],
+                )
+                if loaded is None:
+                    raise RuntimeError("rebuild lock lost")
+            except Exception:
+                self.release_lock_script(keys=[lock_key], args=[token])
+                raise
+            logger.info(f"Rebuilt rank set for quiz: {quiz_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to rebuild rank set for quiz {quiz_id}: {e}")
+            return False
+
+    @staticmethod
+    def version_seed() -> int:
+        return int(time.time() * 1000)
+
+    def version(self, quiz_id: int) -> Optional[int]:
+        """
+        Get the leaderboard version of a quiz.
+
+        The version increases every time a session is added to the quiz, so
+        it can be embedded in cache keys and change notifications.
+
+        Args:
+            quiz_id: Quiz ID
+
+        Returns:
+            Current version, or None if unavailable
+        """
+        try:
+            key = self.version_key(quiz_id)
+            version = self.client.get(key)
+            if version is None:
+                self.client.set(key, self.version_seed(), nx=True, ex=RANK_KEY_TTL)
+                version = self.client.get(key)
+            return int(version)
+        except Exception as e:
+            logger.error(f"Leaderboard version lookup error for quiz {quiz_id}: {e}")
+            return None
+
+    def bump_version(self, quiz_id: int) -> Optional[int]:
+        """
+        Drop the cached top page of a quiz and move its version on.
+
+        Used when the quiz itself is edited, since the rendered pages embed
+        its title.
+
+        Args:
+            quiz_id: Quiz ID
+
+        Returns:
+            New version, or None on failure
+        """
+        try:
+            return int(self.bump_version_script(
+                keys=[self.version_key(quiz_id), self.top_key(quiz_id)],
+                args=[self.version_seed(), RANK_KEY_TTL],
+            ))
+        except Exception as e:
+            logger.error(f"Failed to bump leaderboard version for quiz {quiz_id}: {e}")
+            return None
+
+    def ensure_loaded(self, quiz_id: int) -> bool:
+        """
+        Make sure the sorted set for a quiz exists, rebuilding it on a miss.
+
+        Args:
+            quiz_id: Quiz ID
+
+        Returns:
+            True if the sorted set can be read, False otherwise
+        """
+        try:
+            if self.client.exists(self.key(quiz_id), self.histogram_key(quiz_id)) == 2:
+                return True
+        except Exception as e:
+            logger.error(f"Rank set lookup error for quiz {quiz_id}: {e}")
+            return False
+        return self.rebuild(quiz_id)
+
+    def add_session(self, session) -> Optional[dict]:
+        """
+        Record a newly inserted quiz session.
+
+        Sessions are only added to sets that are already loaded; a missing set
+        is rebuilt from the database on the next read. A cached top page is
+        patched in place rather than dropped.
+
+        Args:
+            session: QuizSession instance with its user loaded
+
+        Returns:
+            Result as described in add_sessions, or None on failure
+        """
+        results = self.add_sessions([session])
+        return results[0] if results else None
+
+    def add_sessions(self, sessions) -> Optional[List[dict]]:
+        """
+        Record newly inserted quiz sessions in one pipelined round trip.
+
+        Args:
+            sessions: QuizSession instances with their users loaded
+
+        Returns:
+            One dict per session with the leaderboard 'version' it produced
+            (None if it was already recorded), and its 1-based 'position' in
+            leaderboard order, its shared 'rank' and the 'total_participants'
+            after it (None unless the set was loaded); None on failure
+        """
+        if not sessions:
+            return []
+        try:
+            version_seed = self.version_seed()
+            pipe = self.client.pipeline(transaction=False)
+            for session in sessions:
+                key = self.key(session.quiz_id)
+                self.add_session_script(
+                    keys=[
+                        key, self.entries_key(session.quiz_id), self.histogram_key(session.quiz_id),
+                        f"{key}:rebuild", f"{key}:rebuild:pending", self.version_key(session.quiz_id),
+                        self.top_key(session.quiz_id),
+                    ],
+                    args=[
+                        self.composite_score(session.score, session.duration),
+                        session.id,
+                        json.dumps(self.session_entry(session)),
+                        session.score,
+                        version_seed,
+                        DURATION_SPAN,
+                        RANK_KEY_TTL,
+                    ],
+                    client=pipe,
+                )
+            return [
+                {
+                    'version': version or None,
+                    'position': position or None,
+                    'rank': rank or None,
+                    'total_participants': total or None,
+                }
+                for _, version, position, rank, total in pipe.execute()
+            ]
+        except Exception as e:
+            session_ids = [session.id for session in sessions]
+            logger.error(f"Failed to add sessions {session_ids} to rank sets: {e}")
+            return None
+
+    def top_document(self, quiz_id: int) -> Optional[Tuple[str, int]]:
+        """
+        Get the cached top page of a quiz leaderboard.
+
+        Args:
+            quiz_id: Quiz ID
+
+        Returns:
+            (JSON body, version it is current at), or None if not cached or
+            unavailable
+        """
+        try:
+            body, version = self.client.hmget(self.top_key(quiz_id), ['body', 'version'])
+        except Exception as e:
+            logger.error(f"Top page lookup error for quiz {quiz_id}: {e}")
+            return None
+        if body is None or version is None:
+            return None
+        return body.decode(), int(version)
+
+    def store_top_document(self, quiz_id: int, body: str, version: int) -> bool:
+        """
+        Cache the top page of a quiz leaderboard so new sessions can patch it.
+
+        The page is discarded if the version moved on while it was built.
+
+        Args:
+            quiz_id: Quiz ID
+            body: Rendered JSON with offset, limit, total_participants and leaderboard
+            version: Leaderboard version read before building the page
+
+        Returns:
+            True if stored, False otherwise
+        """
+        try:
+            return bool(self.store_top_script(
+                keys=[self.top_key(quiz_id), self.version_key(quiz_id)],
+                args=[body, version, RANK_KEY_TTL],
+            ))
+        except Exception as e:
+            logger.error(f"Failed to store top page for quiz {quiz_id}: {e}")
+            return False
+
+    def entries(self, quiz_id: int, session_ids: List[int]) -> List[dict]:
+        """
+        Get leaderboard rows for sessions, loading missing ones from the database.
+
+        Args:
+            quiz_id: Quiz ID
+            session_ids: Quiz session IDs
+
+        Returns:
+            Leaderboard rows in the order of session_ids
+        """
+        from api.models import QuizSession
+
+        if not session_ids:
+            return []
+
+        entries_key = self.entries_key(quiz_id)
+        cached = self.client.hmget(entries_key, session_ids)
+        entries = {
+            session_id: json.loads(payload)
+            for session_id, payload in zip(session_ids, cached)
+            if payload is not None
+        }
+
+        missing = [session_id for session_id in session_ids if session_id not in entries]
+        if missing:
+            sessions = QuizSession.objects.select_related('user').in_bulk(missing)
+            loaded = {
+                session_id: self.session_entry(session)
+                for session_id, session in sessions.items()
+            }
+            if loaded:
+                pipe = self.client.pipeline(transaction=False)
+                pipe.hset(entries_key, mapping={
+                    session_id: json.dumps(entry) for session_id, entry in loaded.items()
+                })
+                pipe.expire(entries_key, RANK_KEY_TTL)
+                pipe.execute()
+            entries.update(loaded)
+
+        return [entries[session_id] for session_id in session_ids if session_id in entries]
+
+    def page(self, quiz_id: int, offset: int, limit: int) -> Optional[Tuple[List[dict], int]]:
+        """
+        Get a range of the leaderboard for a quiz, in constant time per row.
+
+        Rows are ranked like rank_and_total: sessions with the same score and
+        duration share a rank, also across the start of the range.
+
+        Args:
+            quiz_id: Quiz ID
+            offset: Number of leaderboard positions to skip
+            limit: Number of rows to return
+
+        Returns:
+            (ranked rows in leaderboard order, total_participants), or None if
+            unavailable
+        """
+        if not self.ensure_loaded(quiz_id):
+            return None
+        try:
+            first_rank, total, members = self.page_script(
+                keys=[self.key(quiz_id)],
+                args=[offset, offset + limit - 1],
+            )
+            return self.ranked_entries(quiz_id, members, offset, first_rank), total
+        except Exception as e:
+            logger.error(f"Rank set range error for quiz {quiz_id}: {e}")
+            return None
+
+    def rank_and_total(self, quiz_id: int, score: int, duration: int) -> Optional[Tuple[int, int]]:
+        """
+        Get the rank of a score/duration pair and the number of participants.
+
+        Computed from prefix sums over the score histogram plus a range count
+        inside the score's own band for the duration tie-break. Sessions with
+        the same score and duration share a rank.
+
+        Args:
+            quiz_id: Quiz ID
+            score: Session score
+            duration: Session duration in seconds
+
+        Returns:
+            (rank, total_participants), or None if unavailable
+        """
+        result = self.ranks_and_total(quiz_id, [(score, duration)])
+        if result is None:
+            return None
+        ranks, total_participants = result
+        return ranks[0], total_participants
+
+    def ranks_and_total(self, quiz_id: int, performances: List[Tuple[int, int]]) -> Optional[Tuple[List[int], int]]:
+        """
+        Get the ranks of many score/duration pairs in a single round trip.
+
+        Args:
+            quiz_id: Quiz ID
+            performances: (score, duration) pairs
+
+        Returns:
+            (ranks in the order of performances, total_participants), or None
+            if unavailable
+        """
+        if not self.ensure_loaded(quiz_id):
+            return None
+        try:
+            key = self.key(quiz_id)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hgetall(self.histogram_key(quiz_id))
+            for score, duration in performances:
+                pipe.zcount(
+                    key,
+                    f"({self.composite_score(score, duration)}",
+                    self.composite_score(score, 0),
+                )
+            histogram, *faster_same_score = pipe.execute()
+
+            counts = sorted(
+                ((int(bucket_score), int(count)) for bucket_score, count in histogram.items()),
+                reverse=True,
+            )
+            total_participants = sum(count for _, count in counts)
+
+            ranks = []
+            for (score, _), faster in zip(performances, faster_same_score):
+                higher_scores = sum(count for bucket_score, count in counts if bucket_score > score)
+                ranks.append(higher_scores + faster + 1)
+            return ranks, total_participants
+        except Exception as e:
+            logger.error(f"Rank lookup error for quiz {quiz_id}: {e}")
+            return None
+
+    def around(self, quiz_id: int, session_id: int, radius: int) -> Optional[Tuple[List[dict], int]]:
+        """
+        Get the leaderboard rows directly above and below a session.
+
+        Rows are ranked like rank_and_total: sessions with the same score and
+        duration share a rank.
+
+        Args:
+            quiz_id: Quiz ID
+            session_id: Quiz session ID to center the window on
+            radius: Number of rows to return on each side of the session
+
+        Returns:
+            (ranked rows in leaderboard order, total_participants), or None if
+            unavailable
+        """
+        if not self.ensure_loaded(quiz_id):
+            return None
+        try:
+            result = self.around_session_script(
+                keys=[self.key(quiz_id)],
+                args=[session_id, radius],
+            )
+            if not result:
+                return None
+            start, first_rank, total, members = result
+            return self.ranked_entries(quiz_id, members, start, first_rank), total
+        except Exception as e:
+            logger.error(f"Rank window error for quiz {quiz_id}, session {session_id}: {e}")
+            return None
+
+    def ranked_entries(self, quiz_id: int, members: list, start: int, first_rank: int) -> List[dict]:
+        """
+        Get ranked leaderboard rows for a ZREVRANGE ... WITHSCORES range.
+
+        Args:
+            quiz_id: Quiz ID
+            members: Flat member, score list as returned by Redis
+            start: Zero-based position of the first member
+            first_rank: Rank of the first member
+
+        Returns:
+            Rows in the order of members, each with its shared 'rank'
+        """
+        ranks = {}
+        rank, previous_score = first_rank, None
+        for position, (member, score) in enumerate(zip(members[::2], members[1::2]), start + 1):
+            if previous_score is not None and score != previous_score:
+                rank = position
+            ranks[int(member)] = rank
+            previous_score = score
+
+        entries = self.entries(quiz_id, list(ranks))
+        return [{'rank': ranks[entry['session_id']], **entry} for entry in entries]
+
+
+quiz_rank_engine = QuizRankEngine()
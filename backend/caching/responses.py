@@ -0,0 +1,83 @@
+"""
+Pre-rendered JSON responses with ETag support.
+
+Cached views store the final JSON body together with its ETag, so a cache hit
+is served without re-serializing or re-rendering anything, and a client that
+already has the current body gets an empty 304 Not Modified.
+"""
+
+import hashlib
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+
+def make_etag(*parts: str) -> str:
+    """
+    Build a strong ETag from one or more strings.
+
+    Args:
+        *parts: Response body, or the ETags of the parts a response is made of
+
+    Returns:
+        Quoted ETag value
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def render_json(data) -> dict:
+    """
+    Render data the same way a DRF Response would, for caching.
+
+    Args:
+        data: JSON-serializable response data
+
+    Returns:
+        Dict with the rendered 'body' and its 'etag'
+    """
+    body = JSONRenderer().render(data).decode()
+    return {'body': body, 'etag': make_etag(body)}
+
+
+def etag_matches(request, etag: str) -> bool:
+    """
+    Check If-None-Match against an ETag using weak comparison.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in (tag.removeprefix('W/') for tag in etags)
+
+
+def not_modified_response(etag: str) -> HttpResponseNotModified:
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def rendered_response(request, rendered: dict) -> HttpResponse:
+    """
+    Serve a body from render_json, or 304 if the client already has it.
+
+    Clients are told to revalidate on every use, so polling costs a 304 until
+    the data changes.
+
+    Args:
+        request: Incoming request
+        rendered: Dict with 'body' and 'etag'
+
+    Returns:
+        HttpResponse with the JSON body, or HttpResponseNotModified
+    """
+    if etag_matches(request, rendered['etag']):
+        return not_modified_response(rendered['etag'])
+
+    response = HttpResponse(rendered['body'], content_type='application/json')
+    response['ETag'] = rendered['etag']
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -1,28 +1,78 @@
-from django.core.cache import caches
 from typing import Optional
 import logging
+from .core import CacheManager
+from .ranking import quiz_rank_engine
+from .warming import RefreshAhead
 
 logger = logging.getLogger(__name__)
 
-# Get specific cache backends
-leaderboard_cache = caches['leaderboards']
-user_stats_cache = caches['user_stats']
+# Shared so that concurrent recomputations in this process are collapsed
+leaderboard_cache = CacheManager('leaderboards')
+# Recomputes recently requested leaderboards before they expire
+leaderboard_warmer = RefreshAhead(leaderboard_cache)
+quiz_data_cache = CacheManager('quiz_data')
 
-def generate_leaderboard_cache_key(bidang: Optional[str] = None) -> str:
+QUIZ_SCHEDULE_CACHE_KEY = 'quiz:schedule'
+
+# Generation namespace covering every subject at once
+SUBJECTS_NAMESPACE = 'subjects'
+
+def bidang_namespace(bidang: str) -> str:
+    """Generation namespace for entries derived from a subject's sessions"""
+    return f"bidang:{bidang}"
+
+def generate_leaderboard_cache_key(bidang: Optional[str] = None, versioned: bool = True) -> str:
     """
     Generate cache key for subject leaderboard.
     
+    The key embeds the generations of all subjects and of this subject, so
+    bumping either one invalidates it.
+    
     Args:
         bidang: Subject code (optional, defaults to 'all')
+        versioned: Embed the current generations (False gives the stable base key)
+        
+    Returns:
+        Cache key string
+    """
+    key = f"leaderboard:subject:{bidang or 'all'}"
+    if not versioned:
+        return key
+    subjects_generation, bidang_generation = leaderboard_cache.generations(
+        SUBJECTS_NAMESPACE, bidang_namespace(bidang or 'all')
+    )
+    return f"{key}:g{subjects_generation}.{bidang_generation}"
+
+def generate_final_quiz_leaderboard_cache_key(quiz_id: int) -> str:
+    """
+    Generate cache key for the frozen leaderboard of an ended quiz.
+    
+    Args:
+        quiz_id: Quiz ID
+        
+    Returns:
+        Cache key string
+    """
+    return f"leaderboard:quiz:{quiz_id}:final"
+
+def generate_quiz_leaderboard_page_cache_key(quiz_id: int, version: int, offset: int, limit: int) -> str:
+    """
+    Generate cache key for a rank range of a quiz leaderboard version.
+    
+    Args:
+        quiz_id: Quiz ID
+        version: Leaderboard version from the rank engine
+        offset: Number of leaderboard positions skipped
+        limit: Number of rows
         
     Returns:
         Cache key string
     """
-    return f"leaderboard:subject:{bidang or 'all'}"
+    return f"leaderboard:quiz:{quiz_id}:v{version}:{offset}:{limit}"
 
-def generate_quiz_leaderboard_cache_key(quiz_id: int) -> str:
+def generate_quiz_cache_key(quiz_id: int) -> str:
     """
-    Generate cache key for quiz-specific leaderboard.
+    Generate cache key for quiz metadata.
     
     Args:
         quiz_id: Quiz ID
@@ -30,75 +80,60 @@ def generate_quiz_leaderboard_cache_key(quiz_id: int) -> str:
     Returns:
         Cache key string
     """
-    return f"leaderboard:quiz:{quiz_id}"
+    return f"quiz:{quiz_id}"
 
-def generate_quiz_leaderboard_by_user_cache_key(quiz_id: int, user_id: int) -> str:
+def generate_quiz_ranks_cache_key(quiz_id: int, version: int) -> str:
     """
-    Generate cache key for quiz and user specific leaderboard.
+    Generate cache key for bulk rank lookups of a quiz leaderboard version.
     
     Args:
         quiz_id: Quiz ID
-        user_id: User ID
+        version: Leaderboard version from the rank engine
         
     Returns:
         Cache key string
     """
-    return f"user_performance:quiz:{quiz_id}:user:{user_id}"
+    return f"ranks:quiz:{quiz_id}:v{version}"
 
 def invalidate_leaderboard_caches(bidang: Optional[str] = None):
     """
     Invalidate leaderboard caches for a specific subject or all subjects.
     
+    A single generation bump invalidates every entry derived from the subject
+    (or from all subjects); readers keep being served the last computed
+    leaderboard while one of them recomputes it.
+    
     Args:
         bidang: Subject code to invalidate (optional, invalidates all if None)
     """
     try:
         if bidang:
-            cache_key = generate_leaderboard_cache_key(bidang)
-            leaderboard_cache.delete(cache_key)
+            leaderboard_cache.bump_generations(bidang_namespace(bidang))
             logger.info(f"Invalidated leaderboard cache for subject: {bidang}")
         else:
-            # Invalidate individual subject caches only (no "all subjects" cache)
-            from api.models import Bidang
-            
-            for bidang_choice in Bidang.choices:
-                subject_key = generate_leaderboard_cache_key(bidang_choice[0])
-                leaderboard_cache.delete(subject_key)
-            
+            leaderboard_cache.bump_generations(SUBJECTS_NAMESPACE)
             logger.info("Invalidated all individual subject leaderboard caches")
             
     except Exception as e:
         logger.error(f"Failed to invalidate leaderboard caches: {e}")
 
 
-def invalidate_quiz_leaderboard_cache(quiz_id: int):
+def invalidate_quiz_catalog(quiz_id: int):
     """
-    Invalidate leaderboard cache for a specific quiz.
+    Invalidate cached metadata of a quiz after it was edited or deleted.
     
-    Args:
-        quiz_id: Quiz ID to invalidate cache for
-    """
-    try:
-        cache_key = generate_quiz_leaderboard_cache_key(quiz_id)
-        leaderboard_cache.delete(cache_key)
-        logger.info(f"Invalidated leaderboard cache for quiz: {quiz_id}")
-        
-    except Exception as e:
-        logger.error(f"Failed to invalidate quiz leaderboard cache: {e}")
-
-
-def invalidate_quiz_leaderboard_by_user_cache(quiz_id: int, user_id: int):
-    """
-    Invalidate leaderboard cache for a specific quiz and user.
+    Also drops its rendered leaderboards, which embed the quiz title, and the
+    schedule, which may have moved. The leaderboard version is bumped so the
+    rebuilt top page goes out under a new ETag.
     
     Args:
-        quiz_id: Quiz ID to invalidate user performance caches for
-        user_id: User ID to invalidate cache for
+        quiz_id: Quiz ID
     """
     try:
-        cache_key = generate_quiz_leaderboard_by_user_cache_key(quiz_id, user_id)
-        user_stats_cache.delete(cache_key)
-        logger.info(f"Invalidated user: {user_id}'s performance cache for quiz: {quiz_id}")
-
+        quiz_data_cache.delete_many([generate_quiz_cache_key(quiz_id), QUIZ_SCHEDULE_CACHE_KEY])
+        leaderboard_cache.delete(generate_final_quiz_leaderboard_cache_key(quiz_id))
+        quiz_rank_engine.bump_version(quiz_id)
+        logger.info(f"Invalidated quiz catalog cache for quiz: {quiz_id}")
+        
     except Exception as e:
-        logger.error(f"Failed to invalidate user performance cache: {e}")
+        logger.error(f"Failed to invalidate quiz catalog cache: {e}")
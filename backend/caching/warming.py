@@ -0,0 +1,160 @@
+"""
+Refresh-ahead warming for cached values served through get_or_set.
+
+Functions that serve a cached value register how to build it under a name.
+Every time one is served, the (name, args) pair is recorded in a Redis sorted
+set scored by request time, at most once per TOUCH_INTERVAL per process.
+``manage.py warm_leaderboards`` then periodically recomputes the recently
+requested values that are about to go stale, so hot keys never expire under
+a user request.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from django.db import connections
+
+from .core import CacheManager
+
+logger = logging.getLogger(__name__)
+
+# How often one process records the same request again
+TOUCH_INTERVAL = 10
+# The request log is dropped once nothing was requested for this long
+REQUESTS_TTL = 60 * 60 * 24
+
+
+class RefreshAhead:
+    """
+    Registry of warmable cached values plus the requests made for them.
+    """
+
+    def __init__(self, cache_manager: CacheManager):
+        self.cache_manager = cache_manager
+        self.requests_key = f"refresh-ahead:{cache_manager.cache_alias}:requested"
+        self._specs: Dict[str, Callable[..., dict]] = {}
+        self._touched = {}
+        self._touched_lock = threading.Lock()
+
+    def register(self, name: str):
+        """
+        Register a function returning the get_or_set arguments of a value.
+
+        The function takes the value's JSON-serializable identifying args and
+        returns a dict with key, callable_func, timeout and optionally
+        stale_timeout and stale_key.
+
+        Example:
+            @leaderboard_warmer.register('subject_leaderboard')
+            def subject_leaderboard_spec(bidang):
+                return {'key': ..., 'callable_func': ..., 'timeout': 180}
+        """
+        def decorator(spec):
+            self._specs[name] = spec
+            return spec
+        return decorator
+
+    def get(self, name: str, *args) -> Any:
+        """
+        Serve a registered value through get_or_set and record the request.
+        """
+        self.touch(name, *args)
+        return self.cache_manager.get_or_set(**self._specs[name](*args))
+
+    def touch(self, name: str, *args):
+        member = json.dumps([name, list(args)])
+        now = time.time()
+        with self._touched_lock:
+            if now - self._touched.get(member, 0) < TOUCH_INTERVAL:
+                return
+            self._touched[member] = now
+        try:
+            pipe = self.cache_manager.client.pipeline(transaction=False)
+            pipe.zadd(self.requests_key, {member: now})
+            pipe.expire(self.requests_key, REQUESTS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record request for {member}: {e}")
+
+    def requested(self, window: int) -> list:
+        """
+        Get the (name, args) pairs requested within the last `window` seconds.
+
+        Older requests are forgotten.
+        """
+        client = self.cache_manager.client
+        client.zremrangebyscore(self.requests_key, '-inf', time.time() - window)
+        requested = []
+        for member in client.zrange(self.requests_key, 0, -1):
+            name, args = json.loads(member)
+            if name in self._specs:
+                requested.append((name, tuple(args)))
+        return requested
+
+    def run_cycle(self, window: int, lead_time: float, budget: float, concurrency: int) -> dict:
+        """
+        Recompute the recently requested values that go stale within `lead_time`.
+
+        The most urgent values are refreshed first, `concurrency` at a time.
+        Once the recomputations of this cycle have used `budget` seconds in
+        total, the remaining values are skipped until the next cycle.
+
+        Returns:
+            Report with due, refreshed, skipped and failed counts and the
+            max/mean refresh lag, i.e. how long after `lead_time` before
+            expiry a value was refreshed (0 when on time)
+        """
+        due = []
+        for name, args in self.requested(window):
+            spec = self._specs[name](*args)
+            fresh_for = self.cache_manager.fresh_for(spec['key'])
+            if fresh_for is None or fresh_for <= lead_time:
+                due.append((fresh_for if fresh_for is not None else float('-inf'), name, args, spec))
+        due.sort(key=lambda item: item[0])
+
+        lock = threading.Lock()
+        report = {'due': len(due), 'refreshed': 0, 'skipped': 0, 'failed': 0, 'lags': []}
+        spent = [0.0]
+        started_at = time.time()
+
+        def refresh(item):
+            fresh_for, name, args, spec = item
+            with lock:
+                if spent[0] >= budget:
+                    report['skipped'] += 1
+                    return
+            start = time.monotonic()
+            try:
+                refreshed = self.cache_manager.refresh(**spec)
+            except Exception as e:
+                logger.error(f"Failed to refresh {name}{args}: {e}")
+                refreshed = None
+            finally:
+                connections.close_all()
+            elapsed = time.monotonic() - start
+            with lock:
+                spent[0] += elapsed
+                if refreshed is None:
+                    report['failed'] += 1
+                elif not refreshed:
+                    # Someone else is already recomputing it
+                    report['skipped'] += 1
+                else:
+                    report['refreshed'] += 1
+                    if fresh_for != float('-inf'):
+                        finished_in = time.time() - started_at
+                        report['lags'].append(max(0.0, finished_in - (fresh_for - lead_time)))
+
+        if due:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(refresh, due))
+
+        lags = report.pop('lags')
+        report['max_lag'] = round(max(lags), 3) if lags else 0
+        report['mean_lag'] = round(sum(lags) / len(lags), 3) if lags else 0
+        report['spent'] = round(spent[0], 3)
+        return report
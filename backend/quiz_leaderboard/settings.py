@@ -241,6 +241,22 @@ CACHES = {
     }
 }
 
+# In-process LRU tier in front of the Redis caches above, per alias. Entries are
+# dropped on invalidation via Redis pub/sub; TIMEOUT caps how long an entry is
+# served without asking Redis in case an invalidation message is missed.
+LOCAL_CACHES = {
+    'leaderboards': {
+        'MAX_ENTRIES': 1000,
+        'MAX_BYTES': 32 * 1024 * 1024,
+        'TIMEOUT': 10,
+    },
+    'quiz_data': {
+        'MAX_ENTRIES': 1000,
+        'MAX_BYTES': 4 * 1024 * 1024,
+        'TIMEOUT': 10,
+    },
+}
+
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_AGE = 1800
@@ -260,12 +276,17 @@ CORS_ALLOWED_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'if-none-match',
     'origin',
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
 ]
 
+CORS_EXPOSE_HEADERS = [
+    'etag',
+]
+
 CORS_ALLOWED_METHODS = [
     'DELETE',
     'GET',
@@ -290,3 +311,16 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Seconds over which leaderboard notifications are batched into one summary
+# message per group; 0 sends one message per update
+WEBSOCKET_NOTIFY_WINDOW = float(os.getenv("WEBSOCKET_NOTIFY_WINDOW", "0.25"))
+
+# How WebSocket broadcasts reach sockets: "hub" subscribes each ASGI process
+# once per group over Redis pub/sub and fans out in memory (see
+# websocket.hub), "channel_layer" makes every socket a channel layer group member
+WEBSOCKET_GROUP_BACKEND = os.getenv("WEBSOCKET_GROUP_BACKEND", "hub")
+
+# How POST /api/quiz-sessions/ stores submissions: "sync" inserts during the
+# request, "queue" appends to a Redis Stream drained by `manage.py drain_submissions`
+QUIZ_SESSION_SUBMISSION_MODE = os.getenv("QUIZ_SESSION_SUBMISSION_MODE", "sync")
@@ -1,13 +1,21 @@
 import json
 import logging
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from api.models import Quiz
+from api.leaderboards import get_quiz_leaderboard_snapshot
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from .hub import get_broadcast_hub
+from .outbox import Outbox, coalesce_key
 
 logger = logging.getLogger(__name__)
 
+# Quizzes one subscribe_quiz message may subscribe to
+MAX_QUIZ_SUBSCRIPTIONS = 50
+
 
 class LeaderboardConsumer(AsyncWebsocketConsumer):
     """
@@ -21,7 +29,8 @@ class LeaderboardConsumer(AsyncWebsocketConsumer):
     
     async def connect(self):
         """Handle WebSocket connection"""
-        token = self.scope['query_string'].decode().split('token=')[-1] if 'token=' in self.scope['query_string'].decode() else None
+        query = parse_qs(self.scope['query_string'].decode())
+        token = query.get('token', [None])[0]
         
         if token:
             try:
@@ -37,21 +46,28 @@ class LeaderboardConsumer(AsyncWebsocketConsumer):
         else:
             self.user = None
         
+        # Broadcasts are queued here and sent by the outbox's own task;
+        # clients connecting with ?ack=1 answer pings and get flow control
+        self.outbox = Outbox(self._send_frame, self.close, acks=query.get('ack') == ['1'])
         self.general_group_name = 'leaderboard_general'
-        await self.channel_layer.group_add(
-            self.general_group_name,
-            self.channel_name
-        )
+        await self._join_group(self.general_group_name)
         
         await self.accept()
+        self.outbox.start()
         logger.info(f"WebSocket connected: {self.channel_name}, user: {self.user}")
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        await self.channel_layer.group_discard(
-            self.general_group_name,
-            self.channel_name
-        )
+        if getattr(self, 'outbox', None) is not None:
+            self.outbox.stop()
+        hub = get_broadcast_hub()
+        if hub is not None:
+            await hub.leave_all(self)
+        else:
+            await self.channel_layer.group_discard(
+                self.general_group_name,
+                self.channel_name
+            )
         logger.info(f"WebSocket disconnected: {self.channel_name}, code: {close_code}")
     
     async def receive(self, text_data):
@@ -61,9 +77,24 @@ class LeaderboardConsumer(AsyncWebsocketConsumer):
             message_type = data.get('type')
 
             if message_type == 'subscribe_quiz':
-                await self.subscribe_to_quiz(data.get('quiz_id'))
+                if 'quiz_ids' in data:
+                    await self.subscribe_to_quizzes(data['quiz_ids'])
+                else:
+                    await self.subscribe_to_quiz(data.get('quiz_id'))
+            elif message_type == 'pong':
+                if getattr(self, 'outbox', None) is not None:
+                    self.outbox.ack(data.get('seq'))
             elif message_type == 'unsubscribe_quiz':
-                await self.unsubscribe_from_quiz(data.get('quiz_id'))
+                if 'quiz_ids' in data:
+                    for quiz_id in data['quiz_ids'] if isinstance(data['quiz_ids'], list) else []:
+                        await self._leave_group(f'leaderboard_quiz_{quiz_id}')
+                    await self.send(text_data=json.dumps({
+                        'type': 'unsubscription_confirmed',
+                        'quiz_ids': data['quiz_ids'],
+                        'message': 'Unsubscribed from quiz leaderboard updates'
+                    }))
+                else:
+                    await self.unsubscribe_from_quiz(data.get('quiz_id'))
             else:
                 await self.send(text_data=json.dumps({
                     'type': 'error',
@@ -79,45 +110,170 @@ class LeaderboardConsumer(AsyncWebsocketConsumer):
     async def subscribe_to_quiz(self, quiz_id):
         """Subscribe to quiz-specific leaderboard updates"""
         if quiz_id:
-            group_name = f'leaderboard_quiz_{quiz_id}'
-            await self.channel_layer.group_add(group_name, self.channel_name)
+            subscribed = await self._subscribe_with_snapshots([quiz_id])
+            if subscribed:
+                # Queued behind the snapshot
+                await self.outbox.put(json.dumps({
+                    'type': 'subscription_confirmed',
+                    'quiz_id': quiz_id,
+                    'message': f'Subscribed to quiz {quiz_id} leaderboard updates'
+                }))
+    
+    async def subscribe_to_quizzes(self, quiz_ids):
+        """Subscribe to the leaderboard updates of several quizzes at once"""
+        if not isinstance(quiz_ids, list) or len(quiz_ids) > MAX_QUIZ_SUBSCRIPTIONS:
             await self.send(text_data=json.dumps({
-                'type': 'subscription_confirmed',
-                'quiz_id': quiz_id,
-                'message': f'Subscribed to quiz {quiz_id} leaderboard updates'
+                'type': 'error',
+                'message': f'quiz_ids must be a list of at most {MAX_QUIZ_SUBSCRIPTIONS} quiz IDs'
+            }))
+            return
+        subscribed = await self._subscribe_with_snapshots(quiz_ids)
+        if subscribed is None:
+            return
+        # Queued behind the snapshots
+        await self.outbox.put(json.dumps({
+            'type': 'subscription_confirmed',
+            'quiz_ids': subscribed,
+            'message': f'Subscribed to {len(subscribed)} quiz leaderboards'
+        }))
+    
+    async def _subscribe_with_snapshots(self, quiz_ids):
+        """
+        Join the groups of these quizzes and send each one's current top page.
+
+        Groups are joined before the pages are read, so every diff newer
+        than a page's version reaches the client. Each page is queued in the
+        outbox as a `quiz_leaderboard_snapshot` frame built from the cached
+        body, replacing the quiz's queued diffs it already includes, so
+        clients need no HTTP request to show the leaderboard.
+
+        Returns:
+            IDs of the quizzes subscribed to, or None if the IDs are invalid;
+            unknown quizzes are reported in an error
+        """
+        try:
+            quiz_ids = list(dict.fromkeys(int(quiz_id) for quiz_id in quiz_ids))
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Quiz IDs must be integers'
+            }))
+            return None
+        
+        for quiz_id in quiz_ids:
+            await self._join_group(f'leaderboard_quiz_{quiz_id}')
+        snapshots = await self.get_quiz_snapshots(quiz_ids)
+        
+        unknown = [quiz_id for quiz_id in quiz_ids if snapshots.get(quiz_id, '') is None]
+        for quiz_id in unknown:
+            await self._leave_group(f'leaderboard_quiz_{quiz_id}')
+        if unknown:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Quiz not found',
+                'quiz_ids': unknown
             }))
+        
+        for quiz_id in quiz_ids:
+            body = snapshots.get(quiz_id)
+            if body is not None:
+                await self.outbox.put_snapshot(
+                    '{"type": "quiz_leaderboard_snapshot", "data": ' + body + '}',
+                    coalesce_key('quiz_leaderboard_updated', {'quiz_id': quiz_id}),
+                )
+        return [quiz_id for quiz_id in quiz_ids if quiz_id not in unknown]
     
     async def unsubscribe_from_quiz(self, quiz_id):
         """Unsubscribe from quiz-specific leaderboard updates"""
         if quiz_id:
             group_name = f'leaderboard_quiz_{quiz_id}'
-            await self.channel_layer.group_discard(group_name, self.channel_name)
+            await self._leave_group(group_name)
             await self.send(text_data=json.dumps({
                 'type': 'unsubscription_confirmed',
                 'quiz_id': quiz_id,
                 'message': f'Unsubscribed from quiz {quiz_id} leaderboard updates'
             }))
     
+    async def _join_group(self, group_name):
+        """
+        Join a broadcast group.
+
+        With the broadcast hub, this process subscribes once per group and
+        fans messages out to its own sockets; otherwise the socket becomes a
+        channel layer group member.
+        """
+        hub = get_broadcast_hub()
+        if hub is not None:
+            await hub.join(group_name, self)
+        else:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+    
+    async def _leave_group(self, group_name):
+        """Leave a broadcast group"""
+        hub = get_broadcast_hub()
+        if hub is not None:
+            await hub.leave(group_name, self)
+        else:
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+    
+    async def _send_frame(self, text):
+        await self.send(text_data=text)
+    
+    async def _forward_frame(self, event):
+        """
+        Queue the frame of a group event for this socket.
+
+        The notifier encodes the frame once per broadcast (see
+        WebSocketNotifier._event), so it is forwarded as is. Frames wait in
+        the outbox, where newer leaderboard updates replace queued ones.
+        """
+        text = event.get('text')
+        key = event.get('key')
+        if text is None:
+            # Event sent by a notifier that does not pre-encode frames
+            text = json.dumps({
+                'type': event['type'],
+                'data': event['data']
+            })
+            key = coalesce_key(event['type'], event['data'])
+        await self.outbox.put(text, key)
+    
     async def quiz_session_uploaded(self, event):
         """Handle quiz session upload notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'quiz_session_uploaded',
-            'data': event['data']
-        }))
+        await self._forward_frame(event)
     
     async def leaderboard_updated(self, event):
         """Handle leaderboard update notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'leaderboard_updated',
-            'data': event['data']
-        }))
+        await self._forward_frame(event)
     
     async def quiz_leaderboard_updated(self, event):
-        """Handle quiz leaderboard update notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'quiz_leaderboard_updated',
-            'data': event['data']
-        }))
+        """
+        Handle quiz leaderboard update notification
+
+        Carries the versioned diffs of the top page when they are known, so
+        clients only refetch it when they miss a version.
+        """
+        await self._forward_frame(event)
+    
+    @database_sync_to_async
+    def get_quiz_snapshots(self, quiz_ids):
+        """
+        Get the rendered top page of each quiz.
+
+        Returns:
+            Dict of quiz_id -> JSON body, None for unknown quizzes; quizzes
+            whose page could not be read are left out and clients fetch them
+            over HTTP
+        """
+        snapshots = {}
+        for quiz_id in quiz_ids:
+            try:
+                snapshots[quiz_id] = get_quiz_leaderboard_snapshot(quiz_id)['body']
+            except Quiz.DoesNotExist:
+                snapshots[quiz_id] = None
+            except Exception as e:
+                logger.error(f"Failed to read leaderboard snapshot of quiz {quiz_id}: {e}")
+        return snapshots
     
     @database_sync_to_async
     def get_user(self, user_id):
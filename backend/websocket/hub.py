@@ -0,0 +1,217 @@
+"""
+Per-process broadcast hub for WebSocket groups.
+
+With channel layer groups, every socket is a group member, so one
+group_send makes channels_redis push a copy of the message into Redis for
+every connection. The hub subscribes each ASGI process once per group to a
+Redis pub/sub channel instead and fans the message out in memory to the
+process's own consumers, so a broadcast costs one Redis message per
+process no matter how many sockets are connected.
+
+Pub/sub does not buffer: messages published while a process is
+disconnected from Redis are lost. Quiz leaderboard diffs are versioned, so
+clients notice the gap and refetch.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from channels.exceptions import StopConsumer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'websocket:group:'
+
+
+class BroadcastHub:
+    """
+    Local group memberships of one process plus its pub/sub subscriber.
+
+    join/leave/leave_all are called from the consumers' event loop. The
+    SUBSCRIBE and UNSUBSCRIBE round trips they cause run on one worker
+    thread, in the order they were requested, so a slow Redis never stalls
+    the loop. The subscriber thread only hands received messages over to
+    that loop, where a single dispatcher task delivers them in the order they
+    were published.
+    """
+
+    def __init__(self, redis_alias: str = 'default'):
+        self.redis_alias = redis_alias
+        self._groups = {}
+        self._memberships = {}
+        # Group -> future of its SUBSCRIBE, awaited by every joining member
+        self._subscriptions = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='websocket-hub')
+        self._lock = threading.Lock()
+        self._pubsub = None
+        self._subscriber = None
+        self._subscriber_pid = None
+        self._loop = None
+        self._queue = None
+        self._dispatcher = None
+
+    @staticmethod
+    def channel(group: str) -> str:
+        return f"{CHANNEL_PREFIX}{group}"
+
+    def publish(self, group: str, event: dict):
+        """
+        Send a group event to the consumers of every process.
+
+        Raises:
+            redis.RedisError: If the event could not be published
+        """
+        self.publish_many([(group, event)])
+
+    def publish_many(self, messages):
+        """
+        Send several (group, event) pairs in one pipelined round trip.
+
+        Raises:
+            redis.RedisError: If the events could not be published
+        """
+        from django_redis import get_redis_connection
+        pipe = get_redis_connection(self.redis_alias).pipeline(transaction=False)
+        for group, event in messages:
+            pipe.publish(self.channel(group), json.dumps(event))
+        pipe.execute()
+
+    async def join(self, group: str, consumer):
+        """
+        Add a consumer to a group of this process.
+
+        Raises:
+            redis.RedisError: If this is the group's first local member and
+                the process could not subscribe to it
+        """
+        self._ensure_dispatcher()
+        members = self._groups.get(group)
+        if members is None:
+            members = self._groups[group] = set()
+            self._subscriptions[group] = self._loop.run_in_executor(self._executor, self._subscribe, group)
+        subscription = self._subscriptions[group]
+        # Registered before waiting, so a member leaving meanwhile does not
+        # unsubscribe the group under this one
+        members.add(consumer)
+        self._memberships.setdefault(consumer, set()).add(group)
+        try:
+            await asyncio.shield(subscription)
+        except BaseException:
+            await self.leave(group, consumer)
+            raise
+
+    async def leave(self, group: str, consumer):
+        groups = self._memberships.get(consumer)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self._memberships[consumer]
+        members = self._groups.get(group)
+        if members is not None:
+            members.discard(consumer)
+            if not members:
+                del self._groups[group]
+                del self._subscriptions[group]
+                await self._loop.run_in_executor(self._executor, self._unsubscribe, group)
+
+    async def leave_all(self, consumer):
+        for group in list(self._memberships.get(consumer, ())):
+            await self.leave(group, consumer)
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Memberships belong to the loop that served their sockets
+        self._groups.clear()
+        self._memberships.clear()
+        self._subscriptions.clear()
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._dispatcher = loop.create_task(self._dispatch(self._queue))
+
+    def _ensure_pubsub(self):
+        pid = os.getpid()
+        if self._subscriber_pid == pid:
+            return self._pubsub
+        from django_redis import get_redis_connection
+        # A forked child inherits the parent's connection but not its thread
+        self._pubsub = get_redis_connection(self.redis_alias).pubsub(ignore_subscribe_messages=True)
+        self._subscriber = None
+        self._subscriber_pid = pid
+        return self._pubsub
+
+    def _subscribe(self, group: str):
+        with self._lock:
+            pubsub = self._ensure_pubsub()
+            pubsub.subscribe(**{self.channel(group): self._on_message})
+            if self._subscriber is None:
+                self._subscriber = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=self._on_subscriber_error
+                )
+
+    def _unsubscribe(self, group: str):
+        with self._lock:
+            if self._pubsub is None:
+                return
+            try:
+                self._pubsub.unsubscribe(self.channel(group))
+            except Exception as e:
+                logger.error(f"Could not unsubscribe from WebSocket group {group}: {e}")
+
+    def _on_message(self, message):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        loop, queue = self._loop, self._queue
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(queue.put_nowait, (channel[len(CHANNEL_PREFIX):], message['data']))
+
+    def _on_subscriber_error(self, error, pubsub, thread):
+        # redis-py resubscribes on reconnect; what was published meanwhile is lost
+        logger.error(f"WebSocket hub subscriber error: {error}")
+        time.sleep(1)
+
+    async def _dispatch(self, queue: asyncio.Queue):
+        while True:
+            group, data = await queue.get()
+            members = self._groups.get(group)
+            if not members:
+                continue
+            try:
+                event = json.loads(data)
+            except (TypeError, ValueError):
+                logger.error(f"Dropped malformed event for WebSocket group {group}")
+                continue
+            for consumer in list(members):
+                try:
+                    await consumer.dispatch(event)
+                except StopConsumer:
+                    pass
+                except Exception as e:
+                    logger.error(f"Failed to deliver {event.get('type')} to a consumer of {group}: {e}")
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_broadcast_hub() -> Optional[BroadcastHub]:
+    """
+    The process's hub, or None when WEBSOCKET_GROUP_BACKEND uses channel layer groups.
+    """
+    global _hub
+    from django.conf import settings
+    if getattr(settings, 'WEBSOCKET_GROUP_BACKEND', 'channel_layer') != 'hub':
+        return None
+    with _hub_lock:
+        if _hub is None:
+            _hub = BroadcastHub()
+        return _hub
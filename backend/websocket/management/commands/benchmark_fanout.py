@@ -0,0 +1,108 @@
+import asyncio
+import time
+from django.core.management.base import BaseCommand
+from websocket.consumers import LeaderboardConsumer
+from websocket.outbox import Outbox
+from websocket.utils import WebSocketNotifier
+
+
+def sample_event(diff_count):
+    """A quiz_leaderboard_updated event carrying `diff_count` top-page diffs"""
+    diffs = [
+        {
+            'version': 1000 + i,
+            'total_participants': 5000 + i,
+            'entry': {
+                'rank': i % 20 + 1,
+                'session_id': 90000 + i,
+                'user_id': 700 + i,
+                'username': f'student{700 + i}',
+                'score': 95 - i % 20,
+                'duration': 600 + i,
+                'user_start': '2026-01-01T08:00:00+00:00',
+                'user_end': '2026-01-01T08:10:00+00:00',
+            },
+        }
+        for i in range(diff_count)
+    ]
+    data = WebSocketNotifier._quiz_leaderboard_data(1, '2026-01-01T08:10:00+00:00', diffs, diff_count)
+    return WebSocketNotifier._event('quiz_leaderboard_updated', data), data
+
+
+class Command(BaseCommand):
+    help = 'Measure the CPU time of delivering one group message to many WebSocket consumers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumers',
+            type=int,
+            nargs='+',
+            default=[1000, 10000, 50000],
+            help='Group sizes to measure (default: 1000 10000 50000)'
+        )
+        parser.add_argument(
+            '--diffs',
+            type=int,
+            default=5,
+            help='Leaderboard diffs carried by the message (default: 5)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Messages delivered per measurement; the fastest run is reported (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        encoded, data = sample_event(options['diffs'])
+        # What the notifier sent before frames were pre-encoded
+        legacy = {'type': encoded['type'], 'data': data}
+        self.stdout.write(f'Frame size: {len(encoded["text"])} bytes')
+
+        for count in options['consumers']:
+            consumers = [self.consumer() for _ in range(count)]
+            per_consumer = self.measure(consumers, legacy, options['repeat'])
+            pre_encoded = self.measure(consumers, encoded, options['repeat'])
+            self.stdout.write(
+                f'{count} consumers: encode per consumer {per_consumer * 1000:.1f}ms '
+                f'({per_consumer / count * 1e6:.2f}us each), '
+                f'pre-encoded {pre_encoded * 1000:.1f}ms '
+                f'({pre_encoded / count * 1e6:.2f}us each), '
+                f'{per_consumer / pre_encoded:.1f}x less CPU per message'
+            )
+
+    @staticmethod
+    def consumer():
+        consumer = LeaderboardConsumer()
+
+        async def base_send(message):
+            pass
+
+        consumer.base_send = base_send
+        return consumer
+
+    @staticmethod
+    def measure(consumers, event, repeat):
+        """Fastest CPU time in seconds to hand one message to every consumer and send it"""
+        async def fan_out():
+            for consumer in consumers:
+                consumer.outbox = Outbox(consumer._send_frame, consumer.close)
+                consumer.outbox.start()
+            # Let the sender tasks start waiting for frames
+            await asyncio.sleep(0)
+
+            best = None
+            for _ in range(max(repeat, 1)):
+                started = time.process_time()
+                for consumer in consumers:
+                    await consumer.quiz_leaderboard_updated(event)
+                while any(consumer.outbox.depth for consumer in consumers):
+                    await asyncio.sleep(0)
+                spent = time.process_time() - started
+                best = spent if best is None else min(best, spent)
+
+            for consumer in consumers:
+                consumer.outbox.stop()
+            return best
+
+        return asyncio.run(fan_out())
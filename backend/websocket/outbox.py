@@ -0,0 +1,306 @@
+"""
+Bounded outbound queues for WebSocket consumers.
+
+Consumers hand every broadcast frame to their Outbox and return right away,
+so one slow socket never holds up the hub's fan-out or lets its channel
+layer channel fill up. A sender task per socket writes the queued frames in
+order.
+
+Frames wait in the outbox until the sender gets to them, and those that
+only describe the latest state are coalesced meanwhile: a queued
+`leaderboard_updated` absorbs newer ones, and a queued
+`quiz_leaderboard_updated` absorbs newer ones for the same quiz, merging
+their diffs. Other frames are dropped once the queue is full. The snapshot
+sent when a client subscribes to a quiz goes through the same queue and
+takes the place of the quiz's queued diffs it already includes.
+
+The ASGI server does not push back on sends: daphne writes every frame to
+the Twisted transport straight away and buffers whatever the client has not
+read. Clients that opt in to acknowledgements are therefore sent a `ping`
+frame every ACK_EVERY_FRAMES frames, which they answer with a `pong`
+carrying the same `seq`, and are not sent more once MAX_UNACKED_FRAMES
+frames are unacknowledged, so frames wait (and coalesce) in the outbox
+instead of the transport. A socket whose oldest unanswered ping is
+SLOW_CONSUMER_TIMEOUT seconds old while frames wait is closed; the client
+reconnects and starts over from a fresh snapshot. Other clients are only
+bounded by the size of the outbox.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Frames queued per socket before new ones are dropped
+OUTBOX_MAX_FRAMES = 100
+# Frames sent to a socket that the client has not acknowledged yet, at most
+MAX_UNACKED_FRAMES = 32
+# Frames sent between two acknowledgement requests
+ACK_EVERY_FRAMES = 16
+# How long a ping may go unanswered while frames wait before the socket is closed
+SLOW_CONSUMER_TIMEOUT = 30
+# Close code sent to sockets that fell too far behind
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# Beyond this many merged diffs clients are better off refetching the page
+MAX_COALESCED_DIFFS = 100
+
+_stats = Counter()
+_outboxes = set()
+_outboxes_lock = threading.Lock()
+_unique_keys = itertools.count()
+
+
+def coalesce_key(message_type: str, data: dict) -> Optional[str]:
+    """
+    Key under which a frame replaces an older queued one, or None if it never does.
+    """
+    if message_type == 'leaderboard_updated':
+        return message_type
+    if message_type == 'quiz_leaderboard_updated':
+        return f"{message_type}:{data.get('quiz_id')}"
+    return None
+
+
+def _merge_leaderboard_updated(old: dict, new: dict) -> dict:
+    merged = dict(new)
+    merged['affected_quiz_ids'] = sorted(
+        set(old.get('affected_quiz_ids', [])) | set(new.get('affected_quiz_ids', []))
+        | {data['affected_quiz_id'] for data in (old, new) if data.get('affected_quiz_id') is not None}
+    )
+    merged['affected_bidangs'] = sorted(
+        set(old.get('affected_bidangs', [])) | set(new.get('affected_bidangs', []))
+        | {data['affected_bidang'] for data in (old, new) if data.get('affected_bidang')}
+    )
+    merged.pop('affected_quiz_id', None)
+    merged.pop('affected_bidang', None)
+    merged['update_count'] = old.get('update_count', 1) + new.get('update_count', 1)
+    return merged
+
+
+def _merge_quiz_leaderboard_updated(old: dict, new: dict) -> dict:
+    merged = dict(new)
+    merged['update_count'] = old.get('update_count', 1) + new.get('update_count', 1)
+    diffs = None
+    if 'diffs' in old and 'diffs' in new:
+        by_version = {diff['version']: diff for diff in old['diffs'] + new['diffs']}
+        if len(by_version) <= MAX_COALESCED_DIFFS:
+            diffs = [by_version[version] for version in sorted(by_version)]
+    if diffs is not None:
+        merged['diffs'] = diffs
+        merged['version'] = max(old['version'], new['version'])
+    else:
+        # Without every diff the client has to refetch anyway
+        merged.pop('diffs', None)
+        merged.pop('version', None)
+    return merged
+
+
+def merge_frames(old_text: str, new_text: str) -> str:
+    """
+    Combine a queued frame with a newer one under the same coalesce_key.
+    """
+    old, new = json.loads(old_text), json.loads(new_text)
+    if new['type'] == 'leaderboard_updated':
+        data = _merge_leaderboard_updated(old['data'], new['data'])
+    else:
+        data = _merge_quiz_leaderboard_updated(old['data'], new['data'])
+    return json.dumps({'type': new['type'], 'data': data})
+
+
+def _without_diffs_up_to(text: str, version: Optional[int]) -> Optional[str]:
+    """
+    A quiz_leaderboard_updated frame without the diffs a snapshot at
+    `version` includes, or None if nothing is left.
+    """
+    message = json.loads(text)
+    data = message['data']
+    if version is None or 'diffs' not in data:
+        # Frames that ask for a refetch might be newer than the snapshot
+        return text
+    diffs = [diff for diff in data['diffs'] if diff['version'] > version]
+    if not diffs and data['version'] <= version:
+        return None
+    data['diffs'] = diffs
+    return json.dumps(message)
+
+
+class Outbox:
+    """
+    Frames waiting to be sent to one socket.
+
+    put() is called from the consumer's handlers and ack() when the client
+    answers a ping; the task started by start() sends what is queued. Pings
+    are only sent, and unacknowledged frames only limited, with `acks`.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable],
+        close: Callable[[int], Awaitable],
+        max_frames: int = OUTBOX_MAX_FRAMES,
+        max_unacked: int = MAX_UNACKED_FRAMES,
+        slow_timeout: float = SLOW_CONSUMER_TIMEOUT,
+        acks: bool = False,
+    ):
+        self._send = send
+        self._close = close
+        self.acks = acks
+        self.max_frames = max_frames
+        self.max_unacked = max_unacked
+        self.slow_timeout = slow_timeout
+        self._frames = OrderedDict()
+        self._ready = asyncio.Event()
+        self._acked_event = asyncio.Event()
+        # Frames sent and acknowledged so far; pings carry the former as seq
+        self._sent = 0
+        self._acked = 0
+        # (seq, monotonic time sent) of unanswered pings
+        self._pings = deque()
+        self._closing = False
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    @property
+    def unacked(self) -> int:
+        return self._sent - self._acked if self.acks else 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        with _outboxes_lock:
+            _outboxes.add(self)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._frames.clear()
+        with _outboxes_lock:
+            _outboxes.discard(self)
+
+    async def put(self, text: str, key: Optional[str] = None):
+        """
+        Queue a frame, replacing the queued one with the same key.
+        """
+        if self._closing:
+            return
+        if key is not None and key in self._frames:
+            self._frames[key] = merge_frames(self._frames[key], text)
+            _stats['coalesced'] += 1
+            return
+        if len(self._frames) >= self.max_frames:
+            _stats['dropped'] += 1
+            return
+        self._frames[key if key is not None else next(_unique_keys)] = text
+        self._ready.set()
+
+    async def put_snapshot(self, text: str, key: str):
+        """
+        Queue a frame with the full state behind `key`, in place of the
+        queued frame under `key`.
+
+        Diffs of the queued frame up to the snapshot's version are part of
+        the snapshot and are dropped; newer ones stay queued behind it for
+        the client to apply on top.
+        """
+        if self._closing:
+            return
+        snapshot_key = f'snapshot:{key}'
+        if len(self._frames) - (key in self._frames) - (snapshot_key in self._frames) >= self.max_frames:
+            _stats['dropped'] += 1
+            return
+        # An older snapshot of the same state is superseded too
+        self._frames.pop(snapshot_key, None)
+        queued = self._frames.pop(key, None)
+        self._frames[snapshot_key] = text
+        self._ready.set()
+        if queued is None:
+            return
+        queued = _without_diffs_up_to(queued, json.loads(text)['data'].get('version'))
+        if queued is None:
+            _stats['coalesced'] += 1
+        elif len(self._frames) >= self.max_frames:
+            # The client sees the version gap and refetches
+            _stats['dropped'] += 1
+        else:
+            self._frames[key] = queued
+
+    def ack(self, seq):
+        """
+        Record the client's answer to the ping carrying `seq`.
+        """
+        if not isinstance(seq, int) or not self._acked < seq <= self._sent:
+            return
+        self._acked = seq
+        while self._pings and self._pings[0][0] <= seq:
+            self._pings.popleft()
+        self._acked_event.set()
+
+    async def _wait_for_ack(self) -> bool:
+        """Wait until the client acknowledges more frames; False if it is too slow"""
+        self._acked_event.clear()
+        sent_at = self._pings[0][1] if self._pings else time.monotonic()
+        remaining = sent_at + self.slow_timeout - time.monotonic()
+        if remaining > 0:
+            try:
+                await asyncio.wait_for(self._acked_event.wait(), remaining)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def _disconnect(self):
+        self._closing = True
+        _stats['slow_disconnects'] += 1
+        logger.warning(f"Closing WebSocket that left a ping unanswered for {self.slow_timeout}s")
+        self._frames.clear()
+        with _outboxes_lock:
+            _outboxes.discard(self)
+        await self._close(SLOW_CONSUMER_CLOSE_CODE)
+
+    async def _run(self):
+        while True:
+            if not self._frames:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            if self.acks and self.unacked >= self.max_unacked:
+                if not await self._wait_for_ack():
+                    await self._disconnect()
+                    return
+                continue
+            _, text = self._frames.popitem(last=False)
+            try:
+                await self._send(text)
+                _stats['sent'] += 1
+                self._sent += 1
+                if self.acks and (self._sent % ACK_EVERY_FRAMES == 0 or self.unacked >= self.max_unacked):
+                    await self._send(json.dumps({'type': 'ping', 'seq': self._sent}))
+                    self._pings.append((self._sent, time.monotonic()))
+            except Exception as e:
+                logger.info(f"Stopped sending to closed WebSocket: {e}")
+                return
+
+
+def outbox_stats() -> dict:
+    """
+    Queue depth, unacknowledged frames and send/coalesce/drop counters of
+    this process's sockets.
+    """
+    with _outboxes_lock:
+        depths = [(outbox.depth, outbox.unacked) for outbox in _outboxes]
+    return {
+        'consumers': len(depths),
+        'queued': sum(depth for depth, _ in depths),
+        'max_queued': max((depth for depth, _ in depths), default=0),
+        'unacked': sum(unacked for _, unacked in depths),
+        **{counter: _stats[counter] for counter in ('sent', 'coalesced', 'dropped', 'slow_disconnects')},
+    }
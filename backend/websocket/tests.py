@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+from django.test import SimpleTestCase
+from .outbox import SLOW_CONSUMER_CLOSE_CODE, Outbox, coalesce_key
+from .utils import CoalescingNotifier, WebSocketNotifier
+
+
+def frame(message_type, **data):
+    return json.dumps({'type': message_type, 'data': data}), coalesce_key(message_type, data)
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.frames = []
+        self.close_codes = []
+
+    async def send(self, text):
+        self.frames.append(json.loads(text))
+
+    async def close(self, code):
+        self.close_codes.append(code)
+
+    def types(self):
+        return [message['type'] for message in self.frames]
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+class OutboxTests(SimpleTestCase):
+    def outbox(self, **kwargs):
+        self.socket = RecordingSocket()
+        return Outbox(self.socket.send, self.socket.close, **kwargs)
+
+    async def test_latest_state_frames_are_coalesced(self):
+        outbox = self.outbox()
+        await outbox.put(*frame('leaderboard_updated', affected_quiz_id=1, affected_bidang='MAT'))
+        await outbox.put(*frame('leaderboard_updated', affected_quiz_id=2, affected_bidang='FIS'))
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=5, diffs=[{'version': 5}]))
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=6, diffs=[{'version': 6}]))
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=2, version=3, diffs=[{'version': 3}]))
+        self.assertEqual(outbox.depth, 3)
+
+        outbox.start()
+        await settle()
+        outbox.stop()
+
+        general, quiz, other_quiz = self.socket.frames
+        self.assertEqual(general['data']['affected_quiz_ids'], [1, 2])
+        self.assertEqual(general['data']['affected_bidangs'], ['FIS', 'MAT'])
+        self.assertEqual(general['data']['update_count'], 2)
+        self.assertEqual(quiz['data']['version'], 6)
+        self.assertEqual([diff['version'] for diff in quiz['data']['diffs']], [5, 6])
+        self.assertEqual(other_quiz['data']['quiz_id'], 2)
+
+    async def test_full_queue_drops_new_frames_but_still_coalesces(self):
+        outbox = self.outbox(max_frames=2)
+        await outbox.put(*frame('leaderboard_updated', affected_quiz_id=1))
+        await outbox.put(*frame('quiz_session_uploaded', session_id=1))
+        await outbox.put(*frame('quiz_session_uploaded', session_id=2))
+        await outbox.put(*frame('leaderboard_updated', affected_quiz_id=2))
+        self.assertEqual(outbox.depth, 2)
+
+        outbox.start()
+        await settle()
+        outbox.stop()
+
+        self.assertEqual(self.socket.types(), ['leaderboard_updated', 'quiz_session_uploaded'])
+        self.assertEqual(self.socket.frames[0]['data']['affected_quiz_ids'], [1, 2])
+        self.assertEqual(self.socket.frames[1]['data']['session_id'], 1)
+
+    async def test_clients_without_acks_get_no_pings(self):
+        outbox = self.outbox(max_unacked=4, slow_timeout=0.01)
+        outbox.start()
+        for session_id in range(40):
+            await outbox.put(*frame('quiz_session_uploaded', session_id=session_id))
+            await settle()
+        await asyncio.sleep(0.05)
+        outbox.stop()
+
+        self.assertEqual(self.socket.types(), ['quiz_session_uploaded'] * 40)
+        self.assertEqual(outbox.unacked, 0)
+        self.assertEqual(self.socket.close_codes, [])
+
+    async def test_acks_hold_frames_back_until_answered(self):
+        outbox = self.outbox(acks=True, max_unacked=4)
+        outbox.start()
+        for session_id in range(6):
+            await outbox.put(*frame('quiz_session_uploaded', session_id=session_id))
+        await settle()
+
+        self.assertEqual(self.socket.types(), ['quiz_session_uploaded'] * 4 + ['ping'])
+        self.assertEqual(self.socket.frames[-1]['seq'], 4)
+        self.assertEqual(outbox.depth, 2)
+
+        outbox.ack(4)
+        await settle()
+        outbox.stop()
+
+        self.assertEqual(self.socket.types()[5:], ['quiz_session_uploaded'] * 2)
+        self.assertEqual(outbox.unacked, 2)
+
+    async def test_unanswered_ping_closes_the_socket(self):
+        outbox = self.outbox(acks=True, max_unacked=2, slow_timeout=0.05)
+        outbox.start()
+        for session_id in range(4):
+            await outbox.put(*frame('quiz_session_uploaded', session_id=session_id))
+        await asyncio.sleep(0.2)
+
+        self.assertEqual(self.socket.close_codes, [SLOW_CONSUMER_CLOSE_CODE])
+        self.assertEqual(outbox.depth, 0)
+        await outbox.put(*frame('quiz_session_uploaded', session_id=5))
+        self.assertEqual(outbox.depth, 0)
+        outbox.stop()
+
+    async def test_snapshot_replaces_the_diffs_it_includes(self):
+        outbox = self.outbox()
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=4, diffs=[{'version': 4}]))
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=2, version=7, diffs=[{'version': 7}]))
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=6, diffs=[{'version': 5}, {'version': 6}]))
+        await outbox.put_snapshot(
+            json.dumps({'type': 'quiz_leaderboard_snapshot', 'data': {'quiz_id': 1, 'version': 5}}),
+            coalesce_key('quiz_leaderboard_updated', {'quiz_id': 1}),
+        )
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=7, diffs=[{'version': 7}]))
+
+        outbox.start()
+        await settle()
+        outbox.stop()
+
+        other_quiz, snapshot, newer = self.socket.frames
+        self.assertEqual(other_quiz['data']['quiz_id'], 2)
+        self.assertEqual(snapshot['type'], 'quiz_leaderboard_snapshot')
+        self.assertEqual(newer['data']['quiz_id'], 1)
+        self.assertEqual([diff['version'] for diff in newer['data']['diffs']], [6, 7])
+
+    async def test_snapshot_drops_diffs_it_covers_entirely(self):
+        outbox = self.outbox(acks=True, max_unacked=1)
+        outbox.start()
+        await outbox.put(*frame('quiz_session_uploaded', session_id=1))
+        await settle()
+        await outbox.put(*frame('quiz_leaderboard_updated', quiz_id=1, version=3, diffs=[{'version': 3}]))
+        await outbox.put_snapshot(
+            json.dumps({'type': 'quiz_leaderboard_snapshot', 'data': {'quiz_id': 1, 'version': 3}}),
+            coalesce_key('quiz_leaderboard_updated', {'quiz_id': 1}),
+        )
+        self.assertEqual(outbox.depth, 1)
+
+        outbox.ack(1)
+        await settle()
+        outbox.stop()
+
+        self.assertEqual(self.socket.types(), ['quiz_session_uploaded', 'ping', 'quiz_leaderboard_snapshot', 'ping'])
+
+
+class RecordingHub:
+    def __init__(self, failures=0):
+        self.messages = []
+        self.failures = failures
+
+    def publish(self, group, event):
+        self.publish_many([(group, event)])
+
+    def publish_many(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('redis is down')
+        self.messages.extend((group, json.loads(event['text'])) for group, event in messages)
+
+
+class NotifierTests(SimpleTestCase):
+    def test_session_upload_is_only_announced_to_the_general_group(self):
+        notifier = WebSocketNotifier()
+        notifier.hub = RecordingHub()
+        notifier.send_quiz_session_uploaded({'session_id': 1, 'quiz_id': 7, 'bidang': 'MAT', 'score': 90})
+
+        self.assertEqual(
+            [(group, message['type']) for group, message in notifier.hub.messages],
+            [('leaderboard_general', 'quiz_session_uploaded')],
+        )
+
+    def test_failed_flush_keeps_the_summaries_for_the_next_window(self):
+        notifier = CoalescingNotifier(window=60)
+        notifier.hub = RecordingHub(failures=1)
+        # Flush by hand instead of from the background thread
+        notifier._flusher_pid = os.getpid()
+
+        notifier.send_quiz_leaderboard_updated(7, 't1', [{'version': 1}])
+        notifier.flush()
+        self.assertEqual(notifier.hub.messages, [])
+
+        notifier.send_quiz_leaderboard_updated(7, 't2', [{'version': 2}])
+        notifier.flush()
+
+        [(group, message)] = notifier.hub.messages
+        self.assertEqual(group, 'leaderboard_quiz_7')
+        self.assertEqual([diff['version'] for diff in message['data']['diffs']], [1, 2])
+        self.assertEqual(message['data']['update_count'], 2)
+        self.assertEqual(message['data']['timestamp'], 't2')
@@ -1,6 +1,12 @@
 import json
 import logging
+import os
+import threading
+import time
 from asgiref.sync import async_to_sync
+from django.conf import settings
+from .hub import get_broadcast_hub
+from .outbox import coalesce_key
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +18,7 @@ class WebSocketNotifier:
     
     def __init__(self):
         self.channel_layer = None
+        self.hub = get_broadcast_hub()
         self._initialize_channel_layer()
     
     def _initialize_channel_layer(self):
@@ -29,6 +36,70 @@ class WebSocketNotifier:
             self._initialize_channel_layer()
         return self.channel_layer is not None
     
+    def _can_send(self):
+        """Whether group events can be sent, through the hub or the channel layer"""
+        return self.hub is not None or self._ensure_channel_layer()
+    
+    def _group_send(self, group, event):
+        """Send an event to every socket in a group"""
+        if self.hub is not None:
+            self.hub.publish(group, event)
+        else:
+            async_to_sync(self.channel_layer.group_send)(group, event)
+    
+    def _group_send_many(self, messages):
+        """Send (group, event) pairs together, in one round trip with the hub"""
+        if self.hub is not None:
+            self.hub.publish_many(messages)
+            return
+
+        async def send_all():
+            for group, event in messages:
+                await self.channel_layer.group_send(group, event)
+
+        async_to_sync(send_all)()
+    
+    def flush(self):
+        """Send buffered notifications; this notifier does not buffer"""
+    
+    @staticmethod
+    def _event(message_type, data):
+        """
+        Build the group event of a server -> client message.
+
+        The frame text is encoded here, once per broadcast, and consumers
+        forward it verbatim instead of encoding the data once per socket.
+        `key` tells a consumer's outbox which queued frame it supersedes.
+        """
+        return {
+            'type': message_type,
+            'text': json.dumps({'type': message_type, 'data': data}),
+            'key': coalesce_key(message_type, data),
+        }
+
+    @staticmethod
+    def _quiz_leaderboard_data(quiz_id, timestamp, diffs, update_count=None, version=None):
+        """
+        Payload of a quiz_leaderboard_updated frame.
+
+        Diffs are only included together with the version they bring the top
+        page to. An empty list with a version says the page is unchanged at
+        that version; without diffs clients have to refetch the page.
+        """
+        data = {
+            'message': 'Quiz leaderboard updated',
+            'quiz_id': quiz_id,
+            'timestamp': timestamp,
+        }
+        if update_count is not None:
+            data['update_count'] = update_count
+        if diffs:
+            version = max(diffs[-1]['version'], version or 0)
+        if diffs is not None and version is not None:
+            data['version'] = version
+            data['diffs'] = diffs
+        return data
+    
     def send_quiz_session_uploaded(self, quiz_session_data):
         """
         Send notification when a new quiz session is uploaded
@@ -36,41 +107,25 @@ class WebSocketNotifier:
         Args:
             quiz_session_data: Dictionary containing quiz session information
         """
-        if not self._ensure_channel_layer():
+        if not self._can_send():
             logger.warning("Channel layer not available, skipping WebSocket notification")
             return
             
         try:
-            async_to_sync(self.channel_layer.group_send)(
+            # The quiz group learns about the session from the versioned diff
+            # sent by send_quiz_leaderboard_updated
+            self._group_send(
                 'leaderboard_general',
-                {
-                    'type': 'quiz_session_uploaded',
-                    'data': {
-                        'message': 'New quiz session uploaded',
-                        'session_id': quiz_session_data.get('session_id'),
-                        'user_id': quiz_session_data.get('user_id'),
-                        'quiz_id': quiz_session_data.get('quiz_id'),
-                        'bidang': quiz_session_data.get('bidang'),
-                        'timestamp': quiz_session_data.get('timestamp')
-                    }
-                }
+                self._event('quiz_session_uploaded', {
+                    'message': 'New quiz session uploaded',
+                    'session_id': quiz_session_data.get('session_id'),
+                    'user_id': quiz_session_data.get('user_id'),
+                    'quiz_id': quiz_session_data.get('quiz_id'),
+                    'bidang': quiz_session_data.get('bidang'),
+                    'timestamp': quiz_session_data.get('timestamp')
+                })
             )
             
-            if quiz_session_data.get('quiz_id'):
-                async_to_sync(self.channel_layer.group_send)(
-                    f"leaderboard_quiz_{quiz_session_data['quiz_id']}",
-                    {
-                        'type': 'quiz_session_uploaded',
-                        'data': {
-                            'message': f"New session for quiz {quiz_session_data['quiz_id']}",
-                            'session_id': quiz_session_data.get('session_id'),
-                            'user_id': quiz_session_data.get('user_id'),
-                            'score': quiz_session_data.get('score'),
-                            'timestamp': quiz_session_data.get('timestamp')
-                        }
-                    }
-                )
-            
             logger.info(f"WebSocket notification sent for quiz session upload: {quiz_session_data.get('session_id')}")
             
         except Exception as e:
@@ -83,22 +138,19 @@ class WebSocketNotifier:
         Args:
             leaderboard_data: Dictionary containing leaderboard update information
         """
-        if not self._ensure_channel_layer():
+        if not self._can_send():
             logger.warning("Channel layer not available, skipping WebSocket notification")
             return
             
         try:
-            async_to_sync(self.channel_layer.group_send)(
+            self._group_send(
                 'leaderboard_general',
-                {
-                    'type': 'leaderboard_updated',
-                    'data': {
-                        'message': 'Leaderboard updated',
-                        'affected_bidang': leaderboard_data.get('bidang'),
-                        'affected_quiz_id': leaderboard_data.get('quiz_id'),
-                        'timestamp': leaderboard_data.get('timestamp')
-                    }
-                }
+                self._event('leaderboard_updated', {
+                    'message': 'Leaderboard updated',
+                    'affected_bidang': leaderboard_data.get('bidang'),
+                    'affected_quiz_id': leaderboard_data.get('quiz_id'),
+                    'timestamp': leaderboard_data.get('timestamp')
+                })
             )
             
             logger.info(f"WebSocket notification sent for leaderboard update: {leaderboard_data.get('update_type')}")
@@ -106,29 +158,28 @@ class WebSocketNotifier:
         except Exception as e:
             logger.error(f"Failed to send leaderboard update notification: {e}")
     
-    def send_quiz_leaderboard_updated(self, quiz_id, timestamp):
+    def send_quiz_leaderboard_updated(self, quiz_id, timestamp, diffs=None, version=None):
         """
         Send notification when quiz-specific leaderboard is updated
         
         Args:
             quiz_id: Quiz ID
             timestamp: Timestamp of the update
+            diffs: Versioned changes to the top page (see
+                api.submissions.quiz_leaderboard_diffs); clients refetch
+                the leaderboard when they are missing
+            version: Current leaderboard version, needed when diffs is empty
         """
-        if not self._ensure_channel_layer():
+        if not self._can_send():
             logger.warning("Channel layer not available, skipping WebSocket notification")
             return
             
         try:
-            async_to_sync(self.channel_layer.group_send)(
+            self._group_send(
                 f'leaderboard_quiz_{quiz_id}',
-                {
-                    'type': 'quiz_leaderboard_updated',
-                    'data': {
-                        'message': 'Quiz leaderboard updated',
-                        'quiz_id': quiz_id,
-                        'timestamp': timestamp
-                    }
-                }
+                self._event('quiz_leaderboard_updated', self._quiz_leaderboard_data(
+                    quiz_id, timestamp, diffs, version=version
+                ))
             )
             
             logger.info(f"WebSocket notification sent for quiz leaderboard update: {quiz_id}")
@@ -136,4 +187,164 @@ class WebSocketNotifier:
         except Exception as e:
             logger.error(f"Failed to send quiz leaderboard update notification: {e}")
 
-websocket_notifier = WebSocketNotifier()
+
+
+class CoalescingNotifier(WebSocketNotifier):
+    """
+    Notifier that batches updates per group and sends one summary per window.
+
+    Every send_* call only records which quizzes and subjects changed. A
+    background thread sends whatever was recorded at most once per `window`
+    seconds per group: a `leaderboard_updated` summary to
+    leaderboard_general, and a `quiz_leaderboard_updated` summary to each
+    affected quiz group. The number of frames per client is bounded by the
+    window instead of growing with the submission rate. The diffs of every
+    update in the window are sent together, in version order.
+    """
+
+    def __init__(self, window: float):
+        super().__init__()
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._flusher_pid = None
+
+    @staticmethod
+    def _merge(summary, quiz_ids=(), bidangs=(), update_count=1, timestamp=None, diffs=(), version=None):
+        summary['quiz_ids'].update(quiz_ids)
+        summary['bidangs'].update(bidangs)
+        summary['update_count'] += update_count
+        if timestamp is not None and (summary['timestamp'] is None or timestamp > summary['timestamp']):
+            summary['timestamp'] = timestamp
+        # Once one update's diffs are unknown, the window's diffs are incomplete
+        if diffs is None or summary['diffs'] is None:
+            summary['diffs'] = None
+        else:
+            summary['diffs'].extend(diffs)
+        if version is not None and (summary['version'] is None or version > summary['version']):
+            summary['version'] = version
+
+    def _pending_summary(self, group):
+        return self._pending.setdefault(group, {
+            'quiz_ids': set(), 'bidangs': set(), 'update_count': 0, 'timestamp': None,
+            'diffs': [], 'version': None,
+        })
+
+    def _record(self, group, quiz_id=None, bidang=None, timestamp=None, diffs=(), version=None):
+        with self._lock:
+            self._merge(
+                self._pending_summary(group),
+                () if quiz_id is None else (quiz_id,),
+                () if bidang is None else (bidang,),
+                timestamp=timestamp, diffs=diffs, version=version,
+            )
+        self._ensure_flusher()
+        self._wakeup.set()
+
+    def _requeue(self, pending):
+        """Put summaries that could not be sent back, ahead of anything recorded since"""
+        with self._lock:
+            for group, summary in pending.items():
+                newer = self._pending.pop(group, None)
+                if newer is not None:
+                    self._merge(
+                        summary, newer['quiz_ids'], newer['bidangs'], newer['update_count'],
+                        newer['timestamp'], newer['diffs'], newer['version'],
+                    )
+                self._pending[group] = summary
+        # Retry in the next window
+        self._wakeup.set()
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            # A forked child inherits the parent's state but not its thread
+            self._flusher_pid = pid
+            threading.Thread(target=self._run, name='websocket-notifier', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush WebSocket notifications: {e}")
+            time.sleep(max(self.window - (time.monotonic() - started), 0))
+
+    def flush(self):
+        """Send the summaries recorded so far"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        if not self._can_send():
+            logger.warning(f"Channel layer not available, keeping notifications for {len(pending)} groups")
+            self._requeue(pending)
+            return
+
+        messages = []
+        for group, summary in pending.items():
+            if group == 'leaderboard_general':
+                message = self._event('leaderboard_updated', {
+                    'message': 'Leaderboards updated',
+                    'affected_quiz_ids': sorted(summary['quiz_ids']),
+                    'affected_bidangs': sorted(summary['bidangs']),
+                    'update_count': summary['update_count'],
+                    'timestamp': summary['timestamp'],
+                })
+            else:
+                diffs = summary['diffs']
+                message = self._event('quiz_leaderboard_updated', self._quiz_leaderboard_data(
+                    next(iter(summary['quiz_ids'])),
+                    summary['timestamp'],
+                    sorted(diffs, key=lambda diff: diff['version']) if diffs is not None else None,
+                    summary['update_count'],
+                    summary['version'],
+                ))
+            messages.append((group, message))
+
+        try:
+            self._group_send_many(messages)
+        except Exception as e:
+            logger.error(f"Failed to send coalesced notifications to {len(messages)} groups, retrying: {e}")
+            self._requeue(pending)
+            return
+
+        logger.info(f"WebSocket notifications sent to {len(pending)} groups")
+
+    def send_quiz_session_uploaded(self, quiz_session_data):
+        # The quiz group learns about the session from its diff
+        self._record(
+            'leaderboard_general',
+            quiz_session_data.get('quiz_id'),
+            quiz_session_data.get('bidang'),
+            quiz_session_data.get('timestamp'),
+        )
+
+    def send_leaderboard_updated(self, leaderboard_data):
+        self._record(
+            'leaderboard_general',
+            leaderboard_data.get('quiz_id'),
+            leaderboard_data.get('bidang'),
+            leaderboard_data.get('timestamp'),
+        )
+
+    def send_quiz_leaderboard_updated(self, quiz_id, timestamp, diffs=None, version=None):
+        self._record(f'leaderboard_quiz_{quiz_id}', quiz_id, timestamp=timestamp, diffs=diffs, version=version)
+
+
+def _create_notifier():
+    window = getattr(settings, 'WEBSOCKET_NOTIFY_WINDOW', 0)
+    if window > 0:
+        return CoalescingNotifier(window)
+    return WebSocketNotifier()
+
+
+websocket_notifier = _create_notifier()
@@ -56,9 +56,10 @@ function LeaderboardPageContent() {
   useEffect(() => {
     if (lastMessage) {
       const shouldRefresh =
-        lastMessage.type === "leaderboard_updated" ||
-        lastMessage.type === "quiz_session_uploaded" ||
-        lastMessage.type === "quiz_leaderboard_updated";
+        (lastMessage.type === "leaderboard_updated" &&
+          (!lastMessage.data?.affected_bidangs ||
+            lastMessage.data.affected_bidangs.includes(selectedSubject))) ||
+        lastMessage.type === "quiz_session_uploaded";
 
       if (shouldRefresh) {
         // Invalidate and refetch leaderboard data
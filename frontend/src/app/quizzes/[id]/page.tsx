@@ -1,6 +1,6 @@
 "use client";
 
-import { use, useEffect, useState } from "react";
+import { use, useCallback, useEffect, useRef, useState } from "react";
 import Cookies from "js-cookie";
 import { useQuery, useQueryClient } from "@tanstack/react-query";
 import { useRouter } from "next/navigation";
@@ -8,8 +8,19 @@ import { quizAPI, leaderboardAPI } from "@/lib/api";
 import { Card, CardBody, CardHeader } from "@/components/ui/Card";
 import Button from "@/components/ui/Button";
 import ProtectedRoute from "@/components/ProtectedRoute";
-import { Quiz, QuizLeaderboard, UserPerformance } from "@/types";
+import {
+  Quiz,
+  QuizLeaderboard,
+  QuizLeaderboardDiff,
+  UserPerformance,
+} from "@/types";
 import { useWebSocket } from "@/contexts/WebSocketContext";
+import { applyQuizLeaderboardDiffs } from "@/lib/leaderboardDiffs";
+
+// How long diffs for later versions wait for a missing one before refetching
+const DIFF_GAP_TIMEOUT_MS = 1000;
+// How long to wait for the snapshot sent on subscribing before fetching over HTTP
+const SNAPSHOT_TIMEOUT_MS = 2000;
 
 interface QuizPageProps {
   params: Promise<{
@@ -32,13 +43,20 @@ function QuizPageContent({ params }: QuizPageProps) {
       quizAPI.getQuizById(resolvedParams.id).then((res) => res.data),
   });
 
-  const { data: leaderboardData, isLoading: leaderboardLoading } =
+  const fetchLeaderboard = useCallback(
+    () =>
+      leaderboardAPI
+        .getQuizLeaderboard(resolvedParams.id)
+        .then((res) => res.data),
+    [resolvedParams.id]
+  );
+
+  // While connected, the leaderboard arrives as a snapshot when subscribing
+  const { data: leaderboardData, isPending: leaderboardLoading } =
     useQuery<QuizLeaderboard>({
       queryKey: ["leaderboard", "quiz", resolvedParams.id],
-      queryFn: () =>
-        leaderboardAPI
-          .getQuizLeaderboard(resolvedParams.id)
-          .then((res) => res.data),
+      queryFn: fetchLeaderboard,
+      enabled: !isConnected,
     });
 
   const { data: userPerformance, isLoading: userPerformanceLoading } =
@@ -49,9 +67,10 @@ function QuizPageContent({ params }: QuizPageProps) {
       enabled: quiz?.already_attempted || false,
     });
 
-  // Subscribe to quiz-specific updates when component mounts
+  // Subscribe to quiz-specific updates when component mounts; the
+  // subscription is renewed whenever the socket reconnects
   useEffect(() => {
-    if (resolvedParams.id && isConnected) {
+    if (resolvedParams.id) {
       subscribeToQuiz(resolvedParams.id);
     }
 
@@ -60,34 +79,149 @@ function QuizPageContent({ params }: QuizPageProps) {
         unsubscribeFromQuiz(resolvedParams.id);
       }
     };
-  }, [resolvedParams.id, isConnected, subscribeToQuiz, unsubscribeFromQuiz]);
+  }, [resolvedParams.id, subscribeToQuiz, unsubscribeFromQuiz]);
 
-  // Handle WebSocket messages for auto-refresh
+  const pendingDiffs = useRef<QuizLeaderboardDiff[]>([]);
+  // Latest version announced by the server, with or without diffs
+  const announcedVersion = useRef<number | null>(null);
+  const gapTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+
+  const refetchLeaderboard = useCallback(() => {
+    pendingDiffs.current = [];
+    if (gapTimer.current) {
+      clearTimeout(gapTimer.current);
+      gapTimer.current = null;
+    }
+    queryClient
+      .fetchQuery({
+        queryKey: ["leaderboard", "quiz", resolvedParams.id],
+        queryFn: fetchLeaderboard,
+      })
+      .catch((error) => console.error("Failed to fetch leaderboard:", error));
+    queryClient.invalidateQueries({
+      queryKey: ["userPerformance", "quiz", resolvedParams.id],
+    });
+  }, [queryClient, resolvedParams.id, fetchLeaderboard]);
+
+  // Fall back to HTTP if no snapshot arrives after (re)connecting
   useEffect(() => {
-    if (lastMessage) {
-      const shouldRefresh =
-        lastMessage.type === "quiz_leaderboard_updated" ||
-        lastMessage.type === "quiz_session_uploaded" ||
-        (lastMessage.type === "leaderboard_updated" &&
-          lastMessage.data?.quiz_id === resolvedParams.id);
+    if (!isConnected) {
+      return;
+    }
+    const timer = setTimeout(() => {
+      if (
+        !queryClient.getQueryData(["leaderboard", "quiz", resolvedParams.id])
+      ) {
+        refetchLeaderboard();
+      }
+    }, SNAPSHOT_TIMEOUT_MS);
+    return () => clearTimeout(timer);
+  }, [isConnected, queryClient, resolvedParams.id, refetchLeaderboard]);
 
-      if (shouldRefresh) {
-        // Invalidate and refetch both leaderboard and user performance data
-        queryClient.invalidateQueries({
-          queryKey: ["leaderboard", "quiz", resolvedParams.id],
-        });
-        queryClient.invalidateQueries({
-          queryKey: ["userPerformance", "quiz", resolvedParams.id],
-        });
-        setLastUpdate(new Date());
+  useEffect(() => {
+    return () => {
+      if (gapTimer.current) {
+        clearTimeout(gapTimer.current);
+      }
+    };
+  }, []);
+
+  // Take snapshots and apply leaderboard diffs pushed over WebSocket;
+  // refetch only on a version gap
+  useEffect(() => {
+    if (
+      !lastMessage ||
+      (lastMessage.type !== "quiz_leaderboard_updated" &&
+        lastMessage.type !== "quiz_leaderboard_snapshot") ||
+      String(lastMessage.data?.quiz_id) !== resolvedParams.id
+    ) {
+      return;
+    }
+    setLastUpdate(new Date());
+
+    const leaderboardKey = ["leaderboard", "quiz", resolvedParams.id];
+    let board = queryClient.getQueryData<QuizLeaderboard>(leaderboardKey);
+    let diffs: QuizLeaderboardDiff[] | undefined = lastMessage.data?.diffs;
+    if (
+      diffs &&
+      lastMessage.data.version != null &&
+      lastMessage.data.version > (announcedVersion.current ?? -Infinity)
+    ) {
+      announcedVersion.current = lastMessage.data.version;
+    }
+
+    if (lastMessage.type === "quiz_leaderboard_snapshot") {
+      const snapshot: QuizLeaderboard = lastMessage.data;
+      if (
+        board?.version != null &&
+        snapshot.version != null &&
+        board.version > snapshot.version
+      ) {
+        return;
+      }
+      // Diffs that arrived before the snapshot are applied on top of it
+      board = snapshot;
+      diffs = [];
+      if (snapshot.version == null) {
+        pendingDiffs.current = [];
+        queryClient.setQueryData(leaderboardKey, snapshot);
+        return;
+      }
+    } else if (!diffs) {
+      refetchLeaderboard();
+      return;
+    } else if (!board) {
+      // The snapshot is on its way; keep the diffs until it arrives
+      pendingDiffs.current = [...pendingDiffs.current, ...diffs];
+      if (!gapTimer.current) {
+        gapTimer.current = setTimeout(refetchLeaderboard, DIFF_GAP_TIMEOUT_MS);
+      }
+      return;
+    }
+
+    const result = applyQuizLeaderboardDiffs(board, [
+      ...pendingDiffs.current,
+      ...diffs,
+    ]);
+    if (result.resync) {
+      refetchLeaderboard();
+      return;
+    }
+    queryClient.setQueryData(leaderboardKey, result.board);
+    pendingDiffs.current = result.pending;
+
+    // Our own rank only changes when someone beats us; ties share our rank
+    const ownRank = userPerformance?.user_performance.rank;
+    if (
+      ownRank &&
+      result.applied.some((diff) => diff.entry && diff.entry.rank < ownRank)
+    ) {
+      queryClient.invalidateQueries({
+        queryKey: ["userPerformance", "quiz", resolvedParams.id],
+      });
+    }
 
-        console.log(
-          "Quiz leaderboard auto-refreshed due to WebSocket message:",
-          lastMessage.type
-        );
+    // An empty diff list only announces the version; the board must reach it
+    const behind =
+      result.pending.length > 0 ||
+      (announcedVersion.current != null &&
+        result.board.version != null &&
+        result.board.version < announcedVersion.current);
+    if (!behind) {
+      if (gapTimer.current) {
+        clearTimeout(gapTimer.current);
+        gapTimer.current = null;
       }
+    } else if (!gapTimer.current) {
+      gapTimer.current = setTimeout(refetchLeaderboard, DIFF_GAP_TIMEOUT_MS);
     }
-  }, [lastMessage, queryClient, resolvedParams.id]);
+  }, [
+    lastMessage,
+    queryClient,
+    resolvedParams.id,
+    refetchLeaderboard,
+    userPerformance,
+  ]);
 
   const isLoading = quizLoading || leaderboardLoading;
 
@@ -227,11 +361,11 @@ function QuizPageContent({ params }: QuizPageProps) {
                       </tr>
                     </thead>
                     <tbody>
-                      {leaderboardData.leaderboard.map((entry, index) => (
+                      {leaderboardData.leaderboard.map((entry) => (
                         <tr
                           key={entry.id}
                           className={`border-b border-gray-100 ${
-                            index + 1 <= 3
+                            entry.rank <= 3
                               ? "bg-yellow-50 hover:bg-yellow-100"
                               : ""
                           } ${
@@ -242,7 +376,7 @@ function QuizPageContent({ params }: QuizPageProps) {
                         >
                           <td className="py-3 px-4">
                             <span className="flex items-center">
-                              {getRankIcon(index + 1)}
+                              {getRankIcon(entry.rank)}
                             </span>
                           </td>
                           <td className="py-3 px-4">{entry.username}</td>
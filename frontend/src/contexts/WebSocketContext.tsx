@@ -16,6 +16,7 @@ interface WebSocketMessage {
   data?: any;
   quiz_id?: string;
   message?: string;
+  seq?: number;
 }
 
 interface WebSocketContextType {
@@ -88,6 +89,8 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
   } | null>(null);
   const ws = useRef<WebSocket | null>(null);
   const reconnectAttempts = useRef(0);
+  // Quizzes to (re)subscribe to whenever the socket opens
+  const quizSubscriptions = useRef<Set<string>>(new Set());
   const maxReconnectAttempts = 5;
   const reconnectInterval = useRef<NodeJS.Timeout | null>(null);
 
@@ -112,7 +115,8 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
     }
 
     const wsUrl = process.env.NEXT_PUBLIC_WS_URL || "ws://localhost:8000";
-    const wsEndpoint = `${wsUrl}/ws/leaderboard/?token=${token}`;
+    // ack=1 opts in to pings, so the server holds frames back when we lag
+    const wsEndpoint = `${wsUrl}/ws/leaderboard/?token=${token}&ack=1`;
 
     try {
       ws.current = new WebSocket(wsEndpoint);
@@ -126,11 +130,27 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
           clearInterval(reconnectInterval.current);
           reconnectInterval.current = null;
         }
+
+        // One message subscribes to every quiz again, each answered with a snapshot
+        if (quizSubscriptions.current.size > 0) {
+          ws.current?.send(
+            JSON.stringify({
+              type: "subscribe_quiz",
+              quiz_ids: Array.from(quizSubscriptions.current),
+            })
+          );
+        }
       };
 
       ws.current.onmessage = (event) => {
         try {
           const message: WebSocketMessage = JSON.parse(event.data);
+
+          // The server stops sending to clients that leave pings unanswered
+          if (message.type === "ping") {
+            ws.current?.send(JSON.stringify({ type: "pong", seq: message.seq }));
+            return;
+          }
           setLastMessage(message);
 
           // Handle different message types with notifications
@@ -223,6 +243,7 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
   }, []);
 
   const subscribeToQuiz = useCallback((quizId: string) => {
+    quizSubscriptions.current.add(quizId);
     if (ws.current?.readyState === WebSocket.OPEN) {
       ws.current.send(
         JSON.stringify({
@@ -234,6 +255,7 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({
   }, []);
 
   const unsubscribeFromQuiz = useCallback((quizId: string) => {
+    quizSubscriptions.current.delete(quizId);
     if (ws.current?.readyState === WebSocket.OPEN) {
       ws.current.send(
         JSON.stringify({
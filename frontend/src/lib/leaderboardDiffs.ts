@@ -0,0 +1,76 @@
+import { QuizLeaderboard, QuizLeaderboardDiff } from "@/types";
+
+export interface QuizLeaderboardDiffResult {
+  board: QuizLeaderboard;
+  applied: QuizLeaderboardDiff[];
+  // Diffs for later versions, waiting for the versions in between
+  pending: QuizLeaderboardDiff[];
+  // The board cannot be brought up to date and has to be fetched again
+  resync: boolean;
+}
+
+/**
+ * Apply versioned diffs pushed over WebSocket to a cached quiz leaderboard.
+ *
+ * Diffs already contained in the board are skipped and diffs are applied in
+ * version order for as long as there is no gap. A new entry is inserted at its
+ * position, moving the rows below it down and the last row off the page. Rows
+ * with the same score and duration share a rank, as in the server's pages.
+ */
+export function applyQuizLeaderboardDiffs(
+  board: QuizLeaderboard,
+  diffs: QuizLeaderboardDiff[]
+): QuizLeaderboardDiffResult {
+  if (board.version == null) {
+    return { board, applied: [], pending: [], resync: true };
+  }
+
+  let version = board.version;
+  let totalParticipants = board.total_participants;
+  let rows = [...board.leaderboard];
+  const applied: QuizLeaderboardDiff[] = [];
+  const pending: QuizLeaderboardDiff[] = [];
+
+  const sorted = [...diffs].sort((a, b) => a.version - b.version);
+  for (const diff of sorted) {
+    if (diff.version <= version) {
+      continue;
+    }
+    if (diff.version !== version + 1 || pending.length > 0) {
+      pending.push(diff);
+      continue;
+    }
+    if (diff.resync) {
+      return { board, applied: [], pending: [], resync: true };
+    }
+
+    version = diff.version;
+    totalParticipants = diff.total_participants ?? totalParticipants;
+    if (diff.entry && diff.position) {
+      rows.splice(diff.position - 1, 0, diff.entry);
+      rows = rows.slice(0, board.limit ?? rows.length);
+      rows = rows.reduce<typeof rows>((ranked, row, index) => {
+        const previous = ranked[index - 1];
+        const tied =
+          previous &&
+          previous.score === row.score &&
+          previous.duration === row.duration;
+        ranked.push({ ...row, rank: tied ? previous.rank : index + 1 });
+        return ranked;
+      }, []);
+    }
+    applied.push(diff);
+  }
+
+  return {
+    board: {
+      ...board,
+      version,
+      total_participants: totalParticipants,
+      leaderboard: rows,
+    },
+    applied,
+    pending,
+    resync: false,
+  };
+}
@@ -59,7 +59,20 @@ export interface SubjectLeaderboard {
 
 export interface QuizLeaderboard {
   bidang_name: string;
-  leaderboard: QuizLeaderboardEntry[];
+  leaderboard: (QuizLeaderboardEntry & { rank: number })[];
+  total_participants?: number;
+  limit?: number;
+  version?: number | null;
+}
+
+// Change to the top page of a quiz leaderboard, pushed over WebSocket
+export interface QuizLeaderboardDiff {
+  version: number;
+  total_participants?: number;
+  // 1-based row the entry is inserted at; ranks are shared by ties
+  position?: number;
+  entry?: QuizLeaderboardEntry & { rank: number };
+  resync?: boolean;
 }
 
 export interface UserPerformance {